@@ -0,0 +1,125 @@
+import asyncio
+import collections
+import json
+import logging
+from http import HTTPStatus
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# How often the loop lag probe wakes up and how many samples it keeps
+LOOP_LAG_INTERVAL = 0.25
+LOOP_LAG_SAMPLES = 20
+
+# Slow or idle probes are dropped instead of holding a connection open
+_REQUEST_TIMEOUT = 5.0
+
+LOOP_LAG_SECONDS = Gauge("nova_sonic_event_loop_lag_seconds", "Worst event loop lag over the last few seconds")
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a periodic sleeper.
+
+    A wedged or saturated loop delays every session on the process, so the
+    worst lag of the last few seconds is what readiness looks at.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, samples=LOOP_LAG_SAMPLES):
+        self.interval = interval
+        self._samples = collections.deque(maxlen=samples)
+        self._task = None
+        self._reset_at = 0.0
+
+    @property
+    def lag(self):
+        return max(self._samples, default=0.0)
+
+    def reset(self):
+        """Forget the lag measured so far, e.g. the one of startup work."""
+        self._samples.clear()
+        self._reset_at = asyncio.get_running_loop().time()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            LOOP_LAG_SECONDS.set_function(lambda: self.lag)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            if started >= self._reset_at:
+                self._samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def json_response(payload, ok=True):
+    """(status, content type, body) for a JSON endpoint; 503 when not ok."""
+    status = HTTPStatus.OK if ok else HTTPStatus.SERVICE_UNAVAILABLE
+    return status, "application/json", json.dumps(payload).encode("utf-8")
+
+
+class AdminServer:
+    """Minimal HTTP/1.1 server for health, readiness and metrics on the event loop.
+
+    Answering from the same loop that serves the WebSocket sessions means a
+    wedged loop fails its probes instead of looking healthy from a side thread.
+    Handlers map a path to a callable returning (status, content type, body);
+    they run on the loop and must not block.
+    """
+
+    def __init__(self, host, port, routes):
+        self.host = host
+        self.port = port
+        self.routes = routes
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Admin server listening on %s:%s (%s)", self.host, self.port, ", ".join(sorted(self.routes)))
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), _REQUEST_TIMEOUT)
+            # Headers are read and ignored, every response closes the connection
+            while True:
+                line = await asyncio.wait_for(reader.readline(), _REQUEST_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] not in ("GET", "HEAD"):
+                status, content_type, body = HTTPStatus.METHOD_NOT_ALLOWED, "text/plain", b""
+            else:
+                handler = self.routes.get(parts[1].split("?", 1)[0])
+                if handler is None:
+                    status, content_type, body = HTTPStatus.NOT_FOUND, "text/plain", b""
+                else:
+                    status, content_type, body = handler()
+                logger.debug("%s %s -> %d", parts[0], parts[1], status.value)
+
+            head = (
+                f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            writer.write(head if parts and parts[0] == "HEAD" else head + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.warning("Error handling admin request: %s", e)
+        finally:
+            writer.close()
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+from metrics import ADMISSION_TOTAL, ADMISSION_WAIT_SECONDS
+
+# Sessions this process serves at once and Bedrock streams it keeps open (0 = no limit)
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "0"))
+MAX_BEDROCK_STREAMS = int(os.getenv("MAX_BEDROCK_STREAMS", "0"))
+# New sessions are shed while the event loop lags more than this (seconds, 0 = off)
+SHED_LOOP_LAG = float(os.getenv("SHED_LOOP_LAG", "1.0"))
+# How long a new connection may wait for capacity before being rejected
+# (0 = reject right away) and how many connections may wait at once
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "0"))
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "10"))
+
+# How often waiting connections re-check conditions nobody signals (loop lag)
+_RECHECK_INTERVAL = 0.1
+
+
+class AdmissionRejected(Exception):
+    """A new session was turned away; reason is a short machine readable code"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Session rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Caps concurrent sessions and Bedrock streams, and sheds load on loop lag.
+
+    Sessions that get in keep their latency under a burst because extra
+    connections are rejected (optionally after a short wait for a free slot)
+    instead of all sessions of the process degrading together.
+    """
+
+    def __init__(self, streams_in_use, loop_lag, bedrock_retry_after=lambda: 0.0, max_sessions=MAX_SESSIONS,
+                 max_streams=MAX_BEDROCK_STREAMS, shed_loop_lag=SHED_LOOP_LAG,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, max_waiting=ADMISSION_MAX_WAITING):
+        # Callables, so the controller doesn't depend on the pool or the monitor
+        self.streams_in_use = streams_in_use
+        self.loop_lag = loop_lag
+        # Seconds until Bedrock's circuit breaker lets streams open again
+        self.bedrock_retry_after = bedrock_retry_after
+        self.max_sessions = max_sessions
+        self.max_streams = max_streams
+        self.shed_loop_lag = shed_loop_lag
+        self.queue_timeout = queue_timeout
+        self.max_waiting = max_waiting
+
+        self.sessions = 0
+        self.waiting = 0
+        self.draining = False
+        self._released = asyncio.Event()
+
+    def rejection_reason(self):
+        """Return why a new session can't start right now, or None."""
+        if self.draining:
+            return "draining"
+        if self.max_sessions and self.sessions >= self.max_sessions:
+            return "max_sessions"
+        # Every admitted session opens a stream, some may not have done it yet
+        if self.max_streams and max(self.sessions, self.streams_in_use()) >= self.max_streams:
+            return "max_streams"
+        if self.bedrock_retry_after() > 0:
+            return "bedrock_unavailable"
+        if self.shed_loop_lag and self.loop_lag() > self.shed_loop_lag:
+            return "overloaded"
+        return None
+
+    async def acquire(self):
+        """Reserve a session slot, waiting up to queue_timeout for one.
+
+        Raises AdmissionRejected when no slot frees up in time.
+        """
+        reason = self.rejection_reason()
+        if reason is None:
+            return self._admit(0.0)
+        if self.queue_timeout <= 0 or self.waiting >= self.max_waiting:
+            raise self._reject(reason)
+
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        self.waiting += 1
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._reject(reason)
+                self._released.clear()
+                try:
+                    await asyncio.wait_for(self._released.wait(), min(remaining, _RECHECK_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+                reason = self.rejection_reason()
+                if reason is None:
+                    return self._admit(time.monotonic() - started)
+        finally:
+            self.waiting -= 1
+
+    def start_draining(self):
+        """Reject every new session from now on, waiting ones included."""
+        self.draining = True
+        self._released.set()
+
+    def release(self):
+        """Give back the slot of a session that ended."""
+        self.sessions -= 1
+        self._released.set()
+
+    def _admit(self, waited):
+        self.sessions += 1
+        ADMISSION_TOTAL.labels("admitted", "").inc()
+        ADMISSION_WAIT_SECONDS.observe(waited)
+
+    def _reject(self, reason):
+        ADMISSION_TOTAL.labels("rejected", reason).inc()
+        # Connections shed for loop lag can retry sooner than at full capacity,
+        # and Bedrock is tried again when the circuit half-opens
+        if reason == "bedrock_unavailable":
+            return AdmissionRejected(reason, retry_after=max(self.bedrock_retry_after(), 1.0))
+        return AdmissionRejected(reason, retry_after=1.0 if reason == "overloaded" else 5.0)
+
+    def stats(self):
+        return {
+            "sessions": self.sessions,
+            "waiting": self.waiting,
+            "draining": self.draining,
+            "max_sessions": self.max_sessions,
+            "max_streams": self.max_streams,
+            "rejecting": self.rejection_reason(),
+        }
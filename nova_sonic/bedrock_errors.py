@@ -0,0 +1,82 @@
+import asyncio
+import re
+from aws_sdk_bedrock_runtime.models import (
+    AccessDeniedException,
+    ApiError,
+    InternalServerException,
+    ModelErrorException,
+    ModelNotReadyException,
+    ModelStreamErrorException,
+    ModelTimeoutException,
+    ResourceNotFoundException,
+    ServiceQuotaExceededException,
+    ServiceUnavailableException,
+    ThrottlingException,
+    ValidationException,
+)
+
+try:
+    from awscrt.exceptions import AwsCrtError
+except ImportError:  # Only raised by the CRT HTTP client of the Bedrock SDK
+    AwsCrtError = None
+
+# Categories of the Bedrock runtime SDK's modeled errors, first match wins.
+# The categories are also the labels of nova_sonic_bedrock_errors_total.
+_API_ERROR_CATEGORIES = (
+    ((ThrottlingException, ServiceQuotaExceededException), "throttling"),
+    ((ServiceUnavailableException, InternalServerException, ModelStreamErrorException,
+      ModelNotReadyException, ModelErrorException), "service"),
+    (ModelTimeoutException, "model_timeout"),
+    (ValidationException, "validation"),
+    ((AccessDeniedException, ResourceNotFoundException), "access"),
+)
+
+# The ValidationException a stream ends with once it reaches Nova Sonic's
+# session time limit; any other validation error comes from the events sent,
+# and would come back on a stream rebuilt from the same conversation
+_SESSION_LIMIT_MESSAGE = re.compile(r"duration|time limit", re.IGNORECASE)
+
+# Categories saying Bedrock (or the way to it) is failing for every session,
+# not just one: they count towards the circuit breaker, and retrying them
+# spends the shared retry budget
+BEDROCK_FAILURE_CATEGORIES = frozenset(("throttling", "service", "connection"))
+
+# How many causes to follow looking for the CRT error behind an OSError
+_MAX_CAUSE_DEPTH = 3
+
+
+def _crt_error(error):
+    """The AwsCrtError raised or wrapped (as __cause__) by the SDK, if any."""
+    for _ in range(_MAX_CAUSE_DEPTH):
+        if error is None:
+            return None
+        if AwsCrtError is not None and isinstance(error, AwsCrtError):
+            return error
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def classify_error(error):
+    """Category of an exception raised opening or reading a Bedrock stream."""
+    if isinstance(error, ApiError):
+        if isinstance(error, ValidationException) and _SESSION_LIMIT_MESSAGE.search(error.message or ""):
+            return "session_limit"
+        for types, category in _API_ERROR_CATEGORIES:
+            if isinstance(error, types):
+                return category
+        # Unmodeled API errors still say whose fault they are
+        return "service" if error.fault == "server" else "other"
+    if isinstance(error, (asyncio.CancelledError, asyncio.InvalidStateError)):
+        # The stream was closed under the reader, normal when a session ends
+        return "connection_closed"
+    crt_error = _crt_error(error)
+    if crt_error is not None:
+        if "CHECKSUM" in crt_error.name:
+            return "checksum"
+        # Closing a stream that is still being read ends its read with these
+        if "CANCEL" in crt_error.name or "CLOSED" in crt_error.name or crt_error.name == "AWS_ERROR_UNKNOWN":
+            return "connection_closed"
+        return "connection"
+    if isinstance(error, (OSError, asyncio.TimeoutError)):
+        return "connection"
+    return "other"
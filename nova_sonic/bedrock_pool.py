@@ -0,0 +1,233 @@
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import time
+from aws_sdk_bedrock_runtime.client import BedrockRuntimeClient, InvokeModelWithBidirectionalStreamOperationInput
+from aws_sdk_bedrock_runtime.config import Config, HTTPAuthSchemeResolver, SigV4AuthScheme
+from smithy_aws_core.credentials_resolvers.environment import EnvironmentCredentialsResolver
+from bedrock_errors import classify_error
+from circuit_breaker import OPEN, CircuitBreaker, CircuitOpenError, RetryBudget
+from metrics import STREAM_OPEN_SECONDS
+
+DEFAULT_MODEL_ID = 'amazon.nova-sonic-v1:0'
+
+# Where sessions' streams come from: "bedrock" (Amazon Bedrock) or "fake", the
+# in-process Nova Sonic simulator of fake_nova_sonic.py for offline testing
+# and benchmarking (no AWS credentials needed)
+STREAM_BACKEND = os.getenv("STREAM_BACKEND", "bedrock").lower()
+STREAM_BACKENDS = ("bedrock", "fake")
+
+# Number of Bedrock runtime clients shared by all sessions of the process
+BEDROCK_CLIENT_POOL_SIZE = int(os.getenv("BEDROCK_CLIENT_POOL_SIZE", "1"))
+# Bidirectional streams kept open ahead of time for new sessions to claim
+BEDROCK_PREWARM_STREAMS = int(os.getenv("BEDROCK_PREWARM_STREAMS", "0"))
+# Pre-opened streams older than this are discarded instead of handed out
+BEDROCK_PREWARM_MAX_AGE = float(os.getenv("BEDROCK_PREWARM_MAX_AGE", "30"))
+
+# Delay before retrying to refill the stream pool after a failed open
+_REFILL_RETRY_DELAY = 2.0
+
+logger = logging.getLogger(__name__)
+
+
+class BedrockClientPool:
+    """Process-wide pool of Bedrock runtime clients and pre-opened streams.
+
+    Clients are built once at startup and handed out round-robin, so a new
+    session doesn't pay for Config, credentials resolver and client
+    construction. When prewarm_streams > 0 a background task keeps that many
+    bidirectional streams open for new sessions to claim. Stream opens go
+    through the pool's circuit breaker, and sessions retrying a failed stream
+    share its retry budget.
+    """
+
+    def __init__(self, region, model_id=DEFAULT_MODEL_ID, size=BEDROCK_CLIENT_POOL_SIZE,
+                 prewarm_streams=BEDROCK_PREWARM_STREAMS, prewarm_max_age=BEDROCK_PREWARM_MAX_AGE,
+                 backend=STREAM_BACKEND):
+        if backend not in STREAM_BACKENDS:
+            raise ValueError(f"Unknown stream backend {backend!r}, expected one of {', '.join(STREAM_BACKENDS)}")
+        self.region = region
+        self.model_id = model_id
+        self.backend = backend
+        self.prewarm_streams = prewarm_streams
+        self.prewarm_max_age = prewarm_max_age
+        self.clients = [self._create_client() for _ in range(max(1, size))]
+        self._client_cycle = itertools.cycle(self.clients)
+
+        # (opened_at, stream) pairs, oldest first
+        self._streams = collections.deque()
+        self._refill_needed = asyncio.Event()
+        self._refill_task = None
+        # Streams handed out to sessions and not released yet
+        self.streams_in_use = 0
+
+        # Counters exposed through stats()
+        self.streams_opened = 0
+        self.streams_claimed_prewarmed = 0
+        self.streams_expired = 0
+        self.open_failures = 0
+        self.last_error = None
+
+        self.breaker = CircuitBreaker()
+        self.retry_budget = RetryBudget()
+
+    def _create_client(self):
+        if self.backend == "fake":
+            # Imported here so that production never loads the simulator
+            from fake_nova_sonic import FakeNovaSonicClient
+            return FakeNovaSonicClient()
+        config = Config(
+            endpoint_uri=f"https://bedrock-runtime.{self.region}.amazonaws.com",
+            region=self.region,
+            aws_credentials_identity_resolver=EnvironmentCredentialsResolver(),
+            http_auth_scheme_resolver=HTTPAuthSchemeResolver(),
+            http_auth_schemes={"aws.auth#sigv4": SigV4AuthScheme()}
+        )
+        return BedrockRuntimeClient(config=config)
+
+    def get_client(self):
+        """Return the next client of the pool."""
+        return next(self._client_cycle)
+
+    async def open_stream(self):
+        """Open a new bidirectional stream on one of the pooled clients.
+
+        Raises CircuitOpenError without calling Bedrock while the circuit is open.
+        """
+        self.breaker.before_call()
+        started = time.monotonic()
+        try:
+            stream = await self.get_client().invoke_model_with_bidirectional_stream(
+                InvokeModelWithBidirectionalStreamOperationInput(model_id=self.model_id)
+            )
+        except Exception as e:
+            self.open_failures += 1
+            self.last_error = str(e)
+            self.breaker.record_failure(classify_error(e))
+            raise
+        STREAM_OPEN_SECONDS.observe(time.monotonic() - started)
+        self.streams_opened += 1
+        self.last_error = None
+        self.breaker.record_success()
+        return stream
+
+    async def claim_stream(self):
+        """Return a pre-opened stream if a fresh one is available, else open one."""
+        now = time.monotonic()
+        stream = None
+        while self._streams:
+            opened_at, candidate = self._streams.popleft()
+            if now - opened_at <= self.prewarm_max_age:
+                stream = candidate
+                break
+            self.streams_expired += 1
+            await self._close_stream(candidate)
+
+        if self.prewarm_streams:
+            self._refill_needed.set()
+
+        if stream is None:
+            stream = await self.open_stream()
+        else:
+            self.streams_claimed_prewarmed += 1
+        self.streams_in_use += 1
+        return stream
+
+    async def release_stream(self, stream):
+        """Close a stream obtained from claim_stream()."""
+        self.streams_in_use -= 1
+        await stream.input_stream.close()
+
+    async def start(self):
+        """Start keeping pre-opened streams available (no-op without prewarming)."""
+        if self.prewarm_streams and self._refill_task is None:
+            self._refill_needed.set()
+            self._refill_task = asyncio.create_task(self._refill_streams())
+
+    async def _refill_streams(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._refill_needed.wait(), timeout=self.prewarm_max_age / 2)
+            except asyncio.TimeoutError:
+                pass
+            self._refill_needed.clear()
+
+            # Drop streams that got too old to hand out
+            now = time.monotonic()
+            while self._streams and now - self._streams[0][0] > self.prewarm_max_age:
+                self.streams_expired += 1
+                await self._close_stream(self._streams.popleft()[1])
+
+            while len(self._streams) < self.prewarm_streams:
+                try:
+                    stream = await self.open_stream()
+                except asyncio.CancelledError:
+                    raise
+                except CircuitOpenError as e:
+                    # Don't probe Bedrock just to keep spare streams around
+                    await asyncio.sleep(e.retry_after)
+                    break
+                except Exception as e:
+                    logger.warning("Failed to pre-open Bedrock stream: %s", e)
+                    await asyncio.sleep(_REFILL_RETRY_DELAY)
+                    break
+                self._streams.append((time.monotonic(), stream))
+
+    async def _close_stream(self, stream):
+        try:
+            await stream.input_stream.close()
+        except Exception as e:
+            logger.warning("Error closing pre-opened stream: %s", e)
+
+    async def close(self):
+        """Stop refilling and close every pre-opened stream."""
+        if self._refill_task:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+        while self._streams:
+            await self._close_stream(self._streams.popleft()[1])
+
+    def is_failing(self):
+        """True while the circuit is open.
+
+        Half-open once the open time is over, so that a task taken out of
+        rotation gets traffic again and can find out Bedrock recovered.
+        """
+        return self.breaker.state == OPEN
+
+    def stats(self):
+        return {
+            "failing": self.is_failing(),
+            "circuit": self.breaker.stats(),
+            "retry_budget": self.retry_budget.stats(),
+            "backend": self.backend,
+            "region": self.region,
+            "clients": len(self.clients),
+            "prewarm_target": self.prewarm_streams,
+            "prewarmed_available": len(self._streams),
+            "streams_in_use": self.streams_in_use,
+            "streams_opened": self.streams_opened,
+            "streams_claimed_prewarmed": self.streams_claimed_prewarmed,
+            "streams_expired": self.streams_expired,
+            "open_failures": self.open_failures,
+            "last_error": self.last_error,
+        }
+
+
+_pools = {}
+
+
+def get_client_pool(region, model_id=DEFAULT_MODEL_ID):
+    """Return the process-wide pool for a region and model, creating it once."""
+    key = (region, model_id)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = BedrockClientPool(region, model_id)
+        _pools[key] = pool
+    return pool
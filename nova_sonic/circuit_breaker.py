@@ -0,0 +1,172 @@
+import logging
+import os
+import time
+from metrics import BEDROCK_CIRCUIT_REJECTED, BEDROCK_CIRCUIT_TRANSITIONS, BEDROCK_RETRIES
+
+# The circuit opens after this many Bedrock failures in a row: stream opens
+# that failed, and streams lost to throttling, service or connection errors
+BEDROCK_FAILURE_THRESHOLD = int(os.getenv("BEDROCK_FAILURE_THRESHOLD", "3"))
+# Seconds the circuit stays open before a single probe stream is let
+# through; doubled after every failed probe, up to BEDROCK_BREAKER_MAX_OPEN
+BEDROCK_FAILURE_WINDOW = float(os.getenv("BEDROCK_FAILURE_WINDOW", "10"))
+BEDROCK_BREAKER_MAX_OPEN = float(os.getenv("BEDROCK_BREAKER_MAX_OPEN", "60"))
+
+# Retries shared by all the sessions of the process: renewing a stream lost
+# to a Bedrock failure takes a token, refilled at BEDROCK_RETRY_BUDGET_RATE
+# per second up to BEDROCK_RETRY_BUDGET_BURST
+BEDROCK_RETRY_BUDGET_RATE = float(os.getenv("BEDROCK_RETRY_BUDGET_RATE", "1"))
+BEDROCK_RETRY_BUDGET_BURST = float(os.getenv("BEDROCK_RETRY_BUDGET_BURST", "10"))
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+# Values of the nova_sonic_bedrock_circuit_state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """A Bedrock call was failed fast; reason and retry_after as in AdmissionRejected"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Bedrock circuit open, retry in {retry_after:.1f}s")
+        self.reason = "bedrock_unavailable"
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops opening Bedrock streams while Bedrock keeps failing.
+
+    Closed, every call goes through and failures in a row are counted. Open,
+    calls fail right away with CircuitOpenError instead of adding load to a
+    struggling service. Once the open time is over the circuit is half-open:
+    one probe call goes through, and its outcome closes the circuit or opens
+    it again for twice as long.
+    """
+
+    def __init__(self, threshold=BEDROCK_FAILURE_THRESHOLD, open_seconds=BEDROCK_FAILURE_WINDOW,
+                 max_open_seconds=BEDROCK_BREAKER_MAX_OPEN):
+        self.threshold = threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self._state = CLOSED
+        self.open_seconds = open_seconds
+        self.opened_at = 0.0
+        self.probe_started_at = None
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.rejected = 0
+
+    @property
+    def state(self):
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def retry_after(self):
+        """Seconds until the circuit lets a call through again (0 unless open)."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go to Bedrock now."""
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN:
+            # A probe that never reported back doesn't block the circuit forever
+            now = time.monotonic()
+            if self.probe_started_at is None or now - self.probe_started_at >= self.open_seconds:
+                self.probe_started_at = now
+                return
+        self.rejected += 1
+        BEDROCK_CIRCUIT_REJECTED.inc()
+        raise CircuitOpenError(max(self.retry_after(), 1.0))
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.last_error = None
+        if self._state != CLOSED:
+            self.open_seconds = self.base_open_seconds
+            self._transition(CLOSED)
+
+    def record_failure(self, error):
+        """Count a Bedrock failure; error is its category or message."""
+        self.consecutive_failures += 1
+        self.last_error = error
+        state = self.state
+        if state == HALF_OPEN:
+            # The probe failed: Bedrock isn't back yet
+            self.open_seconds = min(self.open_seconds * 2, self.max_open_seconds)
+            self._open()
+        elif state == CLOSED and self.consecutive_failures >= self.threshold:
+            self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._transition(OPEN)
+        logger.warning("Bedrock circuit open for %.0fs after %d failures in a row (%s)", self.open_seconds,
+                       self.consecutive_failures, self.last_error)
+
+    def _transition(self, state):
+        self._state = state
+        self.probe_started_at = None
+        BEDROCK_CIRCUIT_TRANSITIONS.labels(state).inc()
+        if state != OPEN:
+            logger.info("Bedrock circuit %s", state.replace("_", "-"))
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after": round(self.retry_after(), 1),
+            "open_seconds": self.open_seconds,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+        }
+
+
+class RetryBudget:
+    """Token bucket bounding the retries of all sessions together.
+
+    During a Bedrock incident every session would otherwise retry on its own
+    schedule and multiply the load; with the budget spent, a failed stream
+    is given up right away.
+    """
+
+    def __init__(self, rate=BEDROCK_RETRY_BUDGET_RATE, burst=BEDROCK_RETRY_BUDGET_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self.allowed = 0
+        self.denied = 0
+
+    @property
+    def tokens(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return self._tokens
+
+    def try_acquire(self):
+        """Take a token for one retry; False when the budget is spent."""
+        if self.tokens < 1:
+            self.denied += 1
+            BEDROCK_RETRIES.labels("denied").inc()
+            return False
+        self._tokens -= 1
+        self.allowed += 1
+        BEDROCK_RETRIES.labels("allowed").inc()
+        return True
+
+    def stats(self):
+        return {
+            "tokens": round(self.tokens, 1),
+            "rate": self.rate,
+            "burst": self.burst,
+            "allowed": self.allowed,
+            "denied": self.denied,
+        }
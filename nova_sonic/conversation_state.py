@@ -0,0 +1,206 @@
+import base64
+import json
+import os
+import uuid
+from collections import deque
+from s2s_codec import audio_size
+
+# Text turns (user transcripts and final assistant replies) replayed into a
+# renewed Bedrock stream, and the total characters they may add up to
+RENEWAL_HISTORY_TURNS = int(os.getenv("RENEWAL_HISTORY_TURNS", "20"))
+RENEWAL_HISTORY_CHARS = int(os.getenv("RENEWAL_HISTORY_CHARS", "20000"))
+# Microphone audio kept since the last user transcript, re-sent to a renewed
+# stream when the failure cut the user's turn before it was transcribed
+RENEWAL_AUDIO_MS = int(os.getenv("RENEWAL_AUDIO_MS", "10000"))
+
+# 16 kHz 16-bit mono LPCM
+_AUDIO_BYTES_PER_MS = 32
+
+
+class ConversationState:
+    """What a session told Bedrock and heard back, to rebuild it on a new stream.
+
+    Fed with the client's control events, the audio sent to Bedrock and
+    Bedrock's text output; a fresh stream gets sessionStart, promptStart, the
+    system prompt, the recent conversation as non-interactive text contents
+    and the open audio content, in that order (replay_events). A user turn
+    the old stream didn't answer is sent again so the caller gets a reply:
+    as interactive text once transcribed, preceded by the results of the
+    tools already run for it, else as the audio buffered since the last
+    transcript.
+    """
+
+    def __init__(self, max_turns=RENEWAL_HISTORY_TURNS, max_chars=RENEWAL_HISTORY_CHARS,
+                 max_audio_bytes=RENEWAL_AUDIO_MS * _AUDIO_BYTES_PER_MS):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.max_audio_bytes = max_audio_bytes
+        self.session_start = None
+        self.prompt_start = None
+        # Events of the client's SYSTEM text content, once it ended
+        self.system_content = []
+        self.audio_content_start = None
+        # [role, text] turns (USER, ASSISTANT or TOOL results), oldest first,
+        # consecutive same-role text merged
+        self.history = deque()
+        self._open_client_contents = {}
+        # contentId -> [role, text parts] of Bedrock text contents being
+        # received; parts are textOutput payloads, parsed at contentEnd
+        self._open_outputs = {}
+        # Audio (base64 text or raw PCM) sent since the last user transcript
+        self.pending_audio = deque()
+        self.pending_audio_bytes = 0
+
+    def client_event(self, event_type, event_data):
+        """Record a control event sent by the client (audioInput excluded)."""
+        event = event_data["event"][event_type]
+        if event_type == "sessionStart":
+            self.session_start = event_data
+        elif event_type == "promptStart":
+            self.prompt_start = event_data
+            self.history.clear()
+            self._clear_audio()
+        elif event_type == "contentStart":
+            if event.get("type") == "AUDIO":
+                self.audio_content_start = event_data
+            elif event.get("type") == "TEXT" and event.get("role") == "SYSTEM":
+                self._open_client_contents[event.get("contentName")] = [event_data]
+        elif event_type == "textInput":
+            events = self._open_client_contents.get(event.get("contentName"))
+            if events is not None:
+                events.append(event_data)
+        elif event_type == "contentEnd":
+            content_name = event.get("contentName")
+            if self.audio_content_start and content_name == self.audio_content_start["event"]["contentStart"].get("contentName"):
+                self.audio_content_start = None
+                self._clear_audio()
+            events = self._open_client_contents.pop(content_name, None)
+            if events is not None:
+                events.append(event_data)
+                self.system_content = events
+
+    def user_audio(self, audio):
+        """Record microphone audio sent to Bedrock in the open audio content."""
+        self.pending_audio.append(audio)
+        self.pending_audio_bytes += audio_size(audio)
+        while self.pending_audio_bytes > self.max_audio_bytes and len(self.pending_audio) > 1:
+            self.pending_audio_bytes -= audio_size(self.pending_audio.popleft())
+
+    def _clear_audio(self):
+        self.pending_audio.clear()
+        self.pending_audio_bytes = 0
+
+    def output_text(self, content_id, payload):
+        """Record a serialized textOutput without parsing it (fast path)."""
+        content = self._open_outputs.get(content_id)
+        if content is not None:
+            content[1].append(payload)
+
+    def output_event(self, event_type, event):
+        """Record a parsed Bedrock output event; only text contents matter."""
+        if event_type == "contentStart":
+            if event.get("type") != "TEXT":
+                return
+            try:
+                stage = json.loads(event.get("additionalModelFields") or "{}").get("generationStage")
+            except (ValueError, AttributeError):
+                stage = None
+            # Speculative assistant text is repeated as FINAL once spoken
+            if stage != "SPECULATIVE":
+                self._open_outputs[event.get("contentId")] = [event.get("role"), []]
+        elif event_type == "textOutput":
+            content = self._open_outputs.get(event.get("contentId"))
+            if content is not None:
+                content[1].append(event.get("content", ""))
+        elif event_type == "contentEnd":
+            content = self._open_outputs.pop(event.get("contentId"), None)
+            if content is not None:
+                role, parts = content
+                text = "".join(self._part_text(part) for part in parts).strip()
+                if text and role in ("USER", "ASSISTANT"):
+                    self._add_turn(role, text)
+                if role == "USER":
+                    # The turn is transcribed, its audio won't be needed again
+                    self._clear_audio()
+
+    @staticmethod
+    def _part_text(part):
+        if isinstance(part, bytes):
+            try:
+                part = json.loads(part)["event"]["textOutput"].get("content", "")
+            except (ValueError, KeyError, TypeError):
+                return ""
+        # Skip the { "interrupted" : true } marker of a barge-in
+        if part.lstrip().startswith("{") and '"interrupted"' in part:
+            return ""
+        return part
+
+    def tool_result(self, tool_name, content):
+        """Record the result of a tool call the assistant is answering with."""
+        self._add_turn("TOOL", f"Resultado de {tool_name}: {content}")
+
+    def _add_turn(self, role, text):
+        last = next((turn for turn in reversed(self.history) if turn[0] != "TOOL"), None)
+        if role != "TOOL" and last == [role, text]:
+            # The transcript of a turn re-sent to a renewed stream
+            return
+        if self.history and self.history[-1][0] == role:
+            self.history[-1][1] += " " + text
+        else:
+            self.history.append([role, text])
+        while len(self.history) > self.max_turns or (
+                len(self.history) > 1 and sum(len(turn[1]) for turn in self.history) > self.max_chars):
+            self.history.popleft()
+
+    def replay_events(self):
+        """Events that rebuild the conversation on a new stream, in order."""
+        if self.session_start is None or self.prompt_start is None:
+            return []
+        events = [self.session_start, self.prompt_start, *self.system_content]
+        prompt_name = self.prompt_start["event"]["promptStart"]["promptName"]
+        # The model expects the history to start with a user turn
+        turns = list(self.history)
+        while turns and turns[0][0] != "USER":
+            turns.pop(0)
+        # A last user turn without a reply is asked again, interactively,
+        # after the tool results the old stream already got for it
+        results = []
+        while turns and turns[-1][0] == "TOOL":
+            results.insert(0, turns.pop())
+        unanswered = turns.pop() if turns and turns[-1][0] == "USER" else None
+        if unanswered is None:
+            turns.extend(results)
+            results = []
+        # Tool results are replayed as what the assistant looked up
+        for role, text in turns + results:
+            events.extend(self._text_content(prompt_name, "ASSISTANT" if role == "TOOL" else role, text,
+                                             interactive=False))
+        if unanswered is not None:
+            events.extend(self._text_content(prompt_name, "USER", unanswered[1], interactive=True))
+        if self.audio_content_start is not None:
+            events.append(self.audio_content_start)
+            if unanswered is None:
+                # Audio of a turn the old stream didn't transcribe yet
+                content_name = self.audio_content_start["event"]["contentStart"]["contentName"]
+                for audio in self.pending_audio:
+                    if not isinstance(audio, str):
+                        audio = base64.b64encode(audio).decode("ascii")
+                    events.append({"event": {"audioInput": {
+                        "promptName": prompt_name, "contentName": content_name, "content": audio}}})
+        return events
+
+    @staticmethod
+    def _text_content(prompt_name, role, text, interactive):
+        content_name = str(uuid.uuid4())
+        return [
+            {"event": {"contentStart": {
+                "promptName": prompt_name,
+                "contentName": content_name,
+                "type": "TEXT",
+                "interactive": interactive,
+                "role": role,
+                "textInputConfiguration": {"mediaType": "text/plain"},
+            }}},
+            {"event": {"textInput": {"promptName": prompt_name, "contentName": content_name, "content": text}}},
+            {"event": {"contentEnd": {"promptName": prompt_name, "contentName": content_name}}},
+        ]
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
+from metrics import DYNAMODB_SECONDS
+
+# Threads running DynamoDB calls; also the size of each thread's connection pool
+DYNAMODB_MAX_WORKERS = int(os.getenv("DYNAMODB_MAX_WORKERS", "16"))
+# Pool threads given their boto3 resource at startup; the others build it on
+# their first call. Building one holds the GIL for a while, so warming the
+# whole pool at once stalls the event loop for seconds.
+DYNAMODB_WARM_UP_THREADS = int(os.getenv("DYNAMODB_WARM_UP_THREADS", "2"))
+# Optional endpoint override, e.g. http://localhost:8000 for DynamoDB Local
+DYNAMODB_ENDPOINT_URL = os.getenv("DYNAMODB_ENDPOINT_URL")
+
+
+class AsyncDynamoDB:
+    """Runs boto3 DynamoDB calls on a bounded thread pool, off the event loop.
+
+    boto3 resources aren't thread-safe, so every pool thread lazily builds its
+    own session, resource and HTTP connection pool and reuses them for all of
+    its calls. At most max_workers calls are in flight; extra calls wait in
+    the executor queue instead of piling up connections.
+    """
+
+    def __init__(self, max_workers=DYNAMODB_MAX_WORKERS, endpoint_url=DYNAMODB_ENDPOINT_URL):
+        self.max_workers = max_workers
+        self.endpoint_url = endpoint_url
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dynamodb")
+        self._local = threading.local()
+
+    def _table(self, table_name):
+        tables = getattr(self._local, "tables", None)
+        if tables is None:
+            session = boto3.session.Session()
+            self._local.resource = session.resource(
+                "dynamodb",
+                endpoint_url=self.endpoint_url,
+                config=Config(max_pool_connections=1, retries={"max_attempts": 3, "mode": "standard"}),
+            )
+            tables = self._local.tables = {}
+        table = tables.get(table_name)
+        if table is None:
+            table = tables[table_name] = self._local.resource.Table(table_name)
+        return table
+
+    def _call_sync(self, table_name, operation, kwargs):
+        return getattr(self._table(table_name), operation)(**kwargs)
+
+    async def call(self, table_name, operation, **kwargs):
+        """Run a Table operation (get_item, put_item, ...) in the pool."""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            return await loop.run_in_executor(self._executor, self._call_sync, table_name, operation, kwargs)
+        finally:
+            DYNAMODB_SECONDS.labels(operation).observe(time.monotonic() - started)
+
+    def table(self, table_name):
+        return AsyncTable(self, table_name)
+
+    async def warm_up(self, *table_names, threads=DYNAMODB_WARM_UP_THREADS):
+        """Build the boto3 resource of a few pool threads ahead of the first tool call."""
+        threads = min(threads, self.max_workers)
+        if threads <= 0:
+            return
+        barrier = threading.Barrier(threads)
+
+        def init_thread():
+            for table_name in table_names:
+                self._table(table_name)
+            # Hold the thread until all of them are busy so each one gets initialized
+            try:
+                barrier.wait(timeout=10)
+            except threading.BrokenBarrierError:
+                pass
+
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, init_thread) for _ in range(threads)))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class AsyncTable:
+    """Awaitable counterpart of a boto3 DynamoDB Table"""
+
+    def __init__(self, dynamodb, table_name):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+
+    async def get_item(self, **kwargs):
+        return await self.dynamodb.call(self.table_name, "get_item", **kwargs)
+
+    async def put_item(self, **kwargs):
+        return await self.dynamodb.call(self.table_name, "put_item", **kwargs)
+
+    async def update_item(self, **kwargs):
+        return await self.dynamodb.call(self.table_name, "update_item", **kwargs)
+
+    async def delete_item(self, **kwargs):
+        return await self.dynamodb.call(self.table_name, "delete_item", **kwargs)
+
+    async def query(self, **kwargs):
+        return await self.dynamodb.call(self.table_name, "query", **kwargs)
+
+    async def scan(self, **kwargs):
+        return await self.dynamodb.call(self.table_name, "scan", **kwargs)
+
+
+_deserializer = TypeDeserializer()
+
+
+def condition_failure_item(error):
+    """Item returned by a failed conditional write made with
+    ReturnValuesOnConditionCheckFailure=ALL_OLD, or None if it doesn't exist.
+
+    Error responses aren't converted by the boto3 resource layer, so the item
+    comes back in DynamoDB's typed JSON and is deserialized here.
+    """
+    item = error.response.get("Item")
+    if item is None:
+        return None
+    return {key: _deserializer.deserialize(value) for key, value in item.items()}
+
+
+_dynamodb = None
+
+
+def get_dynamodb():
+    """Return the process-wide async DynamoDB layer, creating it on first use."""
+    global _dynamodb
+    if _dynamodb is None:
+        _dynamodb = AsyncDynamoDB()
+    return _dynamodb
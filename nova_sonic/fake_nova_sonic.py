@@ -0,0 +1,358 @@
+import array
+import asyncio
+import base64
+import copy
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from aws_sdk_bedrock_runtime.models import (
+    BidirectionalOutputPayloadPart,
+    InvokeModelWithBidirectionalStreamOutputChunk,
+    ModelStreamErrorException,
+    ModelTimeoutException,
+    ServiceUnavailableException,
+    ThrottlingException,
+    ValidationException,
+)
+
+# JSON file overriding DEFAULT_SCENARIO (turns, timing and faults)
+FAKE_NOVA_SONIC_SCENARIO = os.getenv("FAKE_NOVA_SONIC_SCENARIO", "")
+# Seed for the injected faults, so a benchmark run can be repeated
+FAKE_NOVA_SONIC_SEED = os.getenv("FAKE_NOVA_SONIC_SEED")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCENARIO = {
+    # Seconds to open a stream
+    "open_delay": 0.05,
+    # A user turn ends after this much silence following speech (seconds)
+    "end_of_turn_silence": 0.6,
+    # Peak amplitude (16-bit PCM) above which input audio counts as speech
+    "speech_threshold": 500,
+    # From the end of the user turn (or the tool result) to the first output
+    "first_output_delay": 0.3,
+    # Assistant audio is sent in chunks of this many milliseconds, paced at
+    # audio_pace times real time (0 = as fast as possible)
+    "audio_chunk_ms": 40,
+    "audio_pace": 1.0,
+    # The stream fails after this many seconds, like the service's session
+    # duration limit (0 = no limit)
+    "max_session_seconds": 0,
+    # Played in order, one per user turn, starting over after the last one.
+    # A turn with "tool" asks for that tool and answers once the result arrives.
+    "turns": [
+        {
+            "transcript": "Hola, quiero saber el estado de mi pedido",
+            "tool": {"name": "consultarOrder", "input": {"orderId": "1", "dni": "12345678"}},
+            "text": "Tu pedido está en camino y llega mañana.",
+            "audio_ms": 1600,
+        },
+        {
+            "transcript": "Gracias",
+            "text": "De nada, ¿te puedo ayudar con algo más?",
+            "audio_ms": 1200,
+        },
+    ],
+    # Probabilities: open_error and throttling per stream open, the rest per turn
+    "faults": {
+        "open_error": 0.0,
+        "throttling": 0.0,
+        "stream_error": 0.0,
+        "model_timeout": 0.0,
+        "stall": 0.0,
+        "end_stream": 0.0,
+    },
+}
+
+# Output sample rate of the assistant audio (DEFAULT_AUDIO_OUTPUT_CONFIG)
+_OUTPUT_BYTES_PER_MS = 24000 * 2 // 1000
+
+
+def load_scenario(path=FAKE_NOVA_SONIC_SCENARIO):
+    """DEFAULT_SCENARIO with the values of a scenario JSON file applied."""
+    scenario = copy.deepcopy(DEFAULT_SCENARIO)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        faults = overrides.pop("faults", {})
+        unknown = set(faults) - set(scenario["faults"])
+        if unknown:
+            raise ValueError(f"Unknown faults in {path}: {', '.join(sorted(unknown))}")
+        scenario.update(overrides)
+        scenario["faults"].update(faults)
+    return scenario
+
+
+def is_speech(pcm, threshold):
+    """Whether a chunk of 16-bit LPCM has a sample louder than threshold."""
+    if len(pcm) < 2:
+        return False
+    samples = array.array("h", pcm[:len(pcm) - len(pcm) % 2])
+    return max(samples) > threshold or -min(samples) > threshold
+
+
+class _FakeInputStream:
+    """The input side of a FakeNovaSonicStream (stream.input_stream)."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def send(self, chunk):
+        self._stream.handle_input(chunk.value.bytes_)
+
+    async def close(self):
+        self._stream.close()
+
+
+class _FakeOutputStream:
+    """The output side of a FakeNovaSonicStream, as returned by await_output()."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def receive(self):
+        item = await self._stream.output.get()
+        if item is None:
+            # Like the SDK, keep returning None once the stream is over
+            self._stream.output.put_nowait(None)
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return InvokeModelWithBidirectionalStreamOutputChunk(value=BidirectionalOutputPayloadPart(bytes_=item))
+
+    async def close(self):
+        self._stream.close()
+
+
+class FakeNovaSonicStream:
+    """In-process stand-in for a Nova Sonic bidirectional stream.
+
+    Accepts the input events built by S2sEvent, checks their order like the
+    service does (violations fail the output with a ValidationException) and
+    answers every user turn with the next scripted turn of the scenario.
+    User turns end on silence after speech in the input audio, or at the end
+    of a USER text content. Speech during the assistant's reply interrupts it.
+    """
+
+    def __init__(self, scenario, rng):
+        self.scenario = scenario
+        self.rng = rng
+        self.input_stream = _FakeInputStream(self)
+        self.output = asyncio.Queue()
+        self.closed = False
+
+        self.session_started = False
+        self.prompt_name = None
+        # contentName -> (type, role, interactive) of the open input contents
+        self.contents = {}
+        self.tool_results = {}
+        self.tool_result_ready = asyncio.Event()
+
+        self.turn_index = 0
+        self.in_speech = False
+        self.last_speech_at = 0.0
+        self.user_text = None
+        self.turn_ready = asyncio.Event()
+        self.speaking = False
+        self.interrupted = False
+        self.completion_id = None
+
+        chunk = bytes(_OUTPUT_BYTES_PER_MS * scenario["audio_chunk_ms"])
+        self._audio_chunk = base64.b64encode(chunk).decode("ascii")
+        self._task = asyncio.create_task(self._run())
+        if scenario["max_session_seconds"]:
+            asyncio.get_running_loop().call_later(scenario["max_session_seconds"], self._fail, ValidationException(
+                message="Session exceeded the maximum duration"))
+
+    async def await_output(self):
+        return None, _FakeOutputStream(self)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._task.cancel()
+        self.output.put_nowait(None)
+
+    def _fail(self, error):
+        """End the stream with an error raised by the next receive()."""
+        if not self.closed:
+            self.output.put_nowait(error)
+            self.close()
+
+    def handle_input(self, payload):
+        if self.closed:
+            raise OSError("Stream is closed")
+        try:
+            event_name, event = next(iter(json.loads(payload)["event"].items()))
+        except (ValueError, KeyError, AttributeError, StopIteration):
+            return self._fail(ValidationException(message="Invalid input event"))
+
+        if event_name == "sessionStart":
+            self.session_started = True
+            return
+        if not self.session_started:
+            return self._fail(ValidationException(message=f"{event_name} received before sessionStart"))
+        if event_name == "sessionEnd":
+            return self.close()
+        if event_name == "promptStart":
+            self.prompt_name = event.get("promptName")
+            return
+        if event.get("promptName") != self.prompt_name:
+            return self._fail(ValidationException(message=f"Unknown promptName in {event_name}"))
+        if event_name == "promptEnd":
+            return
+
+        content_name = event.get("contentName")
+        if event_name == "contentStart":
+            self.contents[content_name] = (event.get("type"), event.get("role", "USER"), event.get("interactive", True))
+            return
+        content = self.contents.get(content_name)
+        if content is None:
+            return self._fail(ValidationException(message=f"Unknown contentName in {event_name}"))
+
+        if event_name == "audioInput":
+            self._handle_audio(base64.b64decode(event.get("content", "")))
+        elif event_name == "textInput":
+            # Non-interactive text is conversation history, not a new turn
+            if content[1] == "USER" and content[2]:
+                self.user_text = event.get("content", "")
+        elif event_name == "toolResult":
+            self.tool_results[content_name] = event.get("content")
+        elif event_name == "contentEnd":
+            del self.contents[content_name]
+            if content[0] == "TOOL":
+                self.tool_result_ready.set()
+            elif content[1] == "USER" and self.user_text is not None:
+                self.turn_ready.set()
+
+    def _handle_audio(self, pcm):
+        if is_speech(pcm, self.scenario["speech_threshold"]):
+            self.last_speech_at = time.monotonic()
+            if not self.in_speech:
+                self.in_speech = True
+                # Barge-in: the caller talks over the assistant
+                if self.speaking:
+                    self.interrupted = True
+        elif self.in_speech and time.monotonic() - self.last_speech_at >= self.scenario["end_of_turn_silence"]:
+            self.in_speech = False
+            self.turn_ready.set()
+
+    async def _run(self):
+        try:
+            while True:
+                # Callers that stop sending audio mid-speech still end their turn
+                try:
+                    await asyncio.wait_for(self.turn_ready.wait(), self.scenario["end_of_turn_silence"])
+                except asyncio.TimeoutError:
+                    if not (self.in_speech and time.monotonic() - self.last_speech_at
+                            >= self.scenario["end_of_turn_silence"]):
+                        continue
+                    self.in_speech = False
+                self.turn_ready.clear()
+                await self._play_turn()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning("Fake Nova Sonic stream failed: %s", e)
+            self._fail(ModelStreamErrorException(message=str(e)))
+
+    def _fault(self, name):
+        probability = self.scenario["faults"][name]
+        return probability > 0 and self.rng.random() < probability
+
+    def _emit(self, event_name, **fields):
+        event = {"sessionId": "fake-session", "promptName": self.prompt_name}
+        event.update(fields)
+        self.output.put_nowait(json.dumps({"event": {event_name: event}}).encode("utf-8"))
+
+    def _emit_content(self, content_type, role, stop_reason, events=(), stage=None):
+        content_id = str(uuid.uuid4())
+        fields = {"completionId": self.completion_id, "contentId": content_id}
+        extra = {"additionalModelFields": json.dumps({"generationStage": stage})} if stage else {}
+        self._emit("contentStart", type=content_type, role=role, **fields, **extra)
+        for event_name, payload in events:
+            self._emit(event_name, **fields, **payload)
+        self._emit("contentEnd", type=content_type, stopReason=stop_reason, **fields)
+
+    async def _play_turn(self):
+        turn = self.scenario["turns"][self.turn_index % len(self.scenario["turns"])]
+        self.turn_index += 1
+        if self.completion_id is None:
+            self.completion_id = str(uuid.uuid4())
+            self._emit("completionStart", completionId=self.completion_id)
+
+        if self._fault("stall"):
+            return
+        if self._fault("end_stream"):
+            return self.close()
+        if self._fault("stream_error"):
+            return self._fail(ModelStreamErrorException(message="Unexpected error during processing"))
+        if self._fault("model_timeout"):
+            return self._fail(ModelTimeoutException(message="Model timed out waiting for input"))
+
+        transcript = self.user_text if self.user_text is not None else turn.get("transcript", "")
+        self.user_text = None
+        self._emit_content("TEXT", "USER", "END_TURN", [("textOutput", {"role": "USER", "content": transcript})])
+
+        tool = turn.get("tool")
+        if tool:
+            await asyncio.sleep(self.scenario["first_output_delay"])
+            self.tool_result_ready.clear()
+            self._emit_content("TOOL", "TOOL", "TOOL_USE", [("toolUse", {
+                "toolName": tool["name"],
+                "toolUseId": str(uuid.uuid4()),
+                "content": json.dumps(tool.get("input", {})),
+            })])
+            await self.tool_result_ready.wait()
+
+        await asyncio.sleep(self.scenario["first_output_delay"])
+        # Like Nova Sonic: the reply text comes SPECULATIVE before the audio,
+        # and FINAL only once the audio was played to the end
+        text = [("textOutput", {"role": "ASSISTANT", "content": turn.get("text", "")})]
+        self._emit_content("TEXT", "ASSISTANT", "PARTIAL_TURN", text, stage="SPECULATIVE")
+        if await self._play_audio(turn.get("audio_ms", 0)):
+            self._emit_content("TEXT", "ASSISTANT", "END_TURN", text, stage="FINAL")
+
+    async def _play_audio(self, duration_ms):
+        chunk_ms = self.scenario["audio_chunk_ms"]
+        interval = chunk_ms / 1000 * self.scenario["audio_pace"]
+        fields = {"completionId": self.completion_id, "contentId": str(uuid.uuid4())}
+        self._emit("contentStart", type="AUDIO", role="ASSISTANT", **fields)
+        self.speaking = True
+        self.interrupted = False
+        try:
+            started = time.monotonic()
+            for index in range(max(1, -(-duration_ms // chunk_ms))):
+                if self.interrupted:
+                    self._emit("textOutput", role="ASSISTANT", content='{ "interrupted" : true }', **fields)
+                    self._emit("contentEnd", type="AUDIO", stopReason="INTERRUPTED", **fields)
+                    return False
+                self._emit("audioOutput", content=self._audio_chunk, **fields)
+                if interval:
+                    # Pace against the start time so the sleeps don't drift
+                    await asyncio.sleep(max(0.0, started + (index + 1) * interval - time.monotonic()))
+            self._emit("contentEnd", type="AUDIO", stopReason="END_TURN", **fields)
+            return True
+        finally:
+            self.speaking = False
+
+
+class FakeNovaSonicClient:
+    """Drop-in for BedrockRuntimeClient that opens FakeNovaSonicStreams."""
+
+    def __init__(self, scenario=None, seed=FAKE_NOVA_SONIC_SEED):
+        self.scenario = scenario if scenario is not None else load_scenario()
+        self.rng = random.Random(seed)
+
+    async def invoke_model_with_bidirectional_stream(self, input):
+        await asyncio.sleep(self.scenario["open_delay"])
+        faults = self.scenario["faults"]
+        if faults["open_error"] and self.rng.random() < faults["open_error"]:
+            raise ServiceUnavailableException(message="Service unavailable, please try again later")
+        if faults["throttling"] and self.rng.random() < faults["throttling"]:
+            raise ThrottlingException(message="Too many requests, please wait before trying again")
+        return FakeNovaSonicStream(self.scenario, self.rng)
@@ -0,0 +1,102 @@
+import asyncio
+import os
+from botocore.exceptions import ClientError
+
+# IDs reserved per round-trip to the counter item; unused IDs of a block are
+# skipped when the worker restarts
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "10"))
+
+
+def is_conditional_check_failed(error):
+    """True when a boto3 ClientError comes from a failed ConditionExpression"""
+    return isinstance(error, ClientError) and \
+        error.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+
+class BlockIdAllocator:
+    """Numeric ID allocator backed by an atomic counter item.
+
+    A counter item (PK = SK = COUNTER#<entity>) in the entity's own table holds
+    the highest reserved ID; scans of the table skip it by filtering on the
+    entity's key prefix (begins_with(PK, "ORDER#")), as the REST API does.
+    Each worker reserves a block of IDs with a single atomic ADD and hands
+    them out from memory, so creating an item no longer scans the table. On
+    first use the counter is seeded, exactly once, from the highest existing
+    ID so numbering continues where the scan-based scheme left off.
+    """
+
+    def __init__(self, table, entity, key_prefix, block_size=ID_BLOCK_SIZE):
+        self.table = table
+        self.key_prefix = key_prefix
+        self.block_size = block_size
+        self.counter_key = {"PK": f"COUNTER#{entity}", "SK": f"COUNTER#{entity}"}
+        self._next = 1
+        self._end = 0
+        self._seeded = False
+        self._lock = asyncio.Lock()
+
+    async def next_id(self):
+        """Return the next unused ID."""
+        async with self._lock:
+            if self._next > self._end:
+                await self._reserve_block()
+            value = self._next
+            self._next += 1
+            return value
+
+    async def _reserve_block(self):
+        if not self._seeded:
+            await self._seed_counter()
+        response = await self.table.update_item(
+            Key=self.counter_key,
+            UpdateExpression="ADD lastId :block",
+            ExpressionAttributeValues={":block": self.block_size},
+            ReturnValues="UPDATED_NEW"
+        )
+        end = int(response["Attributes"]["lastId"])
+        self._next = end - self.block_size + 1
+        self._end = end
+
+    async def _seed_counter(self):
+        response = await self.table.get_item(Key=self.counter_key, ProjectionExpression="PK")
+        if "Item" not in response:
+            highest = await self._highest_existing_id()
+            try:
+                await self.table.put_item(
+                    Item={**self.counter_key, "lastId": highest},
+                    ConditionExpression="attribute_not_exists(PK)"
+                )
+            except ClientError as e:
+                # Another worker seeded it first
+                if not is_conditional_check_failed(e):
+                    raise
+        self._seeded = True
+
+    async def _highest_existing_id(self):
+        """Paginated scan for the highest numeric ID (only runs when seeding)."""
+        highest = 0
+        kwargs = {
+            "ProjectionExpression": "id",
+            "FilterExpression": "begins_with(PK, :prefix)",
+            "ExpressionAttributeValues": {":prefix": self.key_prefix},
+        }
+        while True:
+            response = await self.table.scan(**kwargs)
+            for item in response.get("Items", []):
+                item_id = str(item.get("id", ""))
+                if item_id.isdigit():
+                    highest = max(highest, int(item_id))
+            if "LastEvaluatedKey" not in response:
+                return highest
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+_allocators = {}
+
+
+def get_id_allocator(table, entity, key_prefix):
+    """Return the process-wide allocator for a table, creating it once."""
+    allocator = _allocators.get(table.table_name)
+    if allocator is None:
+        allocator = _allocators[table.table_name] = BlockIdAllocator(table, entity, key_prefix)
+    return allocator
@@ -0,0 +1,64 @@
+import asyncio
+import itertools
+from aws_sdk_bedrock_runtime.models import InvokeModelWithBidirectionalStreamInputChunk, BidirectionalInputPayloadPart
+from metrics import INPUT_SEND_WAIT_SECONDS
+
+# Lanes of the Bedrock input stream, lower values sent first. Events within a
+# lane keep their submission order.
+URGENT_LANE = 0   # Tool results and control events that don't depend on audio
+ORDERED_LANE = 1  # Audio, and the events that must stay behind it (audio contentStart/contentEnd, promptEnd, sessionEnd)
+LANE_NAMES = {URGENT_LANE: "urgent", ORDERED_LANE: "ordered"}
+
+
+def _resolve(future, sent):
+    if not future.done():
+        future.set_result(sent)
+
+
+class BedrockInputWriter:
+    """The only task writing to a session's Bedrock input stream.
+
+    Callers submit serialized events and await the returned future, which
+    resolves once the event has been handed to the stream (or fails with the
+    stream's error). A tool result submitted while microphone audio is being
+    sent only waits for the frame in flight, not for the audio behind it.
+    """
+
+    def __init__(self, input_stream):
+        self.input_stream = input_stream
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._wait_metrics = {lane: INPUT_SEND_WAIT_SECONDS.labels(name) for lane, name in LANE_NAMES.items()}
+
+    def submit(self, payload, lane=URGENT_LANE):
+        """Queue an event for the stream; returns a future for its send."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put_nowait((lane, next(self._order), payload, future, loop.time()))
+        return future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            lane, _, payload, future, queued_at = await self._queue.get()
+            if future.done():
+                # The caller gave up (its task was cancelled)
+                continue
+            self._wait_metrics[lane].observe(loop.time() - queued_at)
+            try:
+                await self.input_stream.send(
+                    InvokeModelWithBidirectionalStreamInputChunk(value=BidirectionalInputPayloadPart(bytes_=payload))
+                )
+            except asyncio.CancelledError:
+                _resolve(future, False)
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            _resolve(future, True)
+
+    def close(self):
+        """Resolve what is still queued as not sent, so no caller waits forever."""
+        while not self._queue.empty():
+            _resolve(self._queue.get_nowait()[3], False)
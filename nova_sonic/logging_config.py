@@ -0,0 +1,162 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Root log level; per-chunk audio and per-event logs are DEBUG, so they're
+# skipped (without formatting their arguments) unless LOGLEVEL=DEBUG
+LOGLEVEL = os.getenv("LOGLEVEL", "INFO").upper()
+# "text" for human readable lines, "json" for one JSON object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Records allowed per call site per second; the rest are counted and dropped (0 = no limit)
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+# Records waiting for the writer thread; when full new records are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Extra record attributes appended to every formatted line
+STRUCTURED_FIELDS = ("session", "event", "tool", "worker")
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `rate` records per call site per second.
+
+    Runs on the logging thread (usually the event loop) before the record is
+    queued, so suppressed records cost a dict lookup. The first record let
+    through after a suppressed window reports how many were dropped.
+    """
+
+    def __init__(self, rate=LOG_RATE_LIMIT):
+        super().__init__()
+        self.rate = rate
+        # (pathname, lineno) -> [window_start, emitted, suppressed]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.rate:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of failing when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Merges the arguments (and traceback) into the message here, so they
+        # can't change before the writer thread runs
+        record = super().prepare(record)
+        if self.dropped:
+            record.dropped = self.dropped
+            self.dropped = 0
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = " ".join(f"{name}={getattr(record, name)}" for name in STRUCTURED_FIELDS if hasattr(record, name))
+        if fields:
+            line = f"{line} [{fields}]"
+        if getattr(record, "suppressed", 0):
+            line += f" (+{record.suppressed} similar suppressed)"
+        if getattr(record, "dropped", 0):
+            line += f" ({record.dropped} records dropped, log queue full)"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in STRUCTURED_FIELDS + ("suppressed", "dropped"):
+            if hasattr(record, name):
+                entry[name] = getattr(record, name)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SessionLogger(logging.LoggerAdapter):
+    """Adds fixed fields (e.g. the session id) to every record, keeping call-site extras."""
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+
+_listener = None
+_listener_pid = None
+
+
+def configure_logging(level=LOGLEVEL, fmt=LOG_FORMAT, rate_limit=LOG_RATE_LIMIT):
+    """Route all logging through a bounded queue drained by a writer thread.
+
+    Call once per process; forked workers call it again because the writer
+    thread doesn't survive fork.
+    """
+    global _listener, _listener_pid
+
+    # A listener inherited through fork has no thread left to stop
+    if _listener_pid == os.getpid():
+        stop_logging()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(RateLimitFilter(rate_limit))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+
+def stop_logging():
+    """Flush pending records and stop the writer thread."""
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = None
+
+
+atexit.register(stop_logging)
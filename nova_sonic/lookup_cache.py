@@ -0,0 +1,124 @@
+import collections
+import ctypes
+import multiprocessing
+import os
+import time
+import zlib
+from metrics import LOOKUP_CACHE_EVICTIONS, LOOKUP_CACHE_INVALIDATIONS, LOOKUP_CACHE_LOOKUPS
+
+# Seconds a cached order/appointment is served without going back to DynamoDB
+# (0 disables the cache) and maximum number of cached items per process
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", "30"))
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", "1024"))
+# Invalidation slots shared between workers (0 disables cross-worker invalidation)
+LOOKUP_CACHE_SHARED_SLOTS = int(os.getenv("LOOKUP_CACHE_SHARED_SLOTS", "4096"))
+
+
+class LookupCache:
+    """TTL + LRU cache of DynamoDB items keyed by (table, PK).
+
+    Writes made by this process refresh or drop the cached item. Writes made
+    by other workers are seen through an optional shared array of version
+    counters: a write bumps the slot of its key, and a cached entry whose slot
+    changed since it was stored is treated as a miss. Items changed outside the
+    server (e.g. through the REST API) are bounded by the TTL.
+
+    Only touched from the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, ttl=LOOKUP_CACHE_TTL, maxsize=LOOKUP_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # key -> (expires_at, version, item), least recently used first
+        self._entries = collections.OrderedDict()
+        self._versions = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def enable_shared_invalidation(self, slots=LOOKUP_CACHE_SHARED_SLOTS):
+        """Share invalidations with processes forked after this call."""
+        if slots > 0:
+            self._versions = multiprocessing.get_context("fork").Array(ctypes.c_uint32, slots, lock=False)
+
+    def _slot(self, key):
+        return zlib.crc32(f"{key[0]}|{key[1]}".encode()) % len(self._versions)
+
+    def _version(self, key):
+        return self._versions[self._slot(key)] if self._versions is not None else 0
+
+    def get(self, table_name, pk):
+        """Return the cached item, or None on a miss."""
+        if not self.enabled:
+            return None
+        key = (table_name, pk)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, version, item = entry
+            if expires_at > time.monotonic() and version == self._version(key):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                LOOKUP_CACHE_LOOKUPS.labels("hit").inc()
+                return item
+            del self._entries[key]
+        self.misses += 1
+        LOOKUP_CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    def put(self, table_name, pk, item):
+        """Cache an item just read from or written to DynamoDB."""
+        if not self.enabled:
+            return
+        key = (table_name, pk)
+        self._entries[key] = (time.monotonic() + self.ttl, self._version(key), item)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            LOOKUP_CACHE_EVICTIONS.inc()
+
+    def invalidate(self, table_name, pk, item=None):
+        """Record a write: tell other workers and keep item (if known) locally."""
+        key = (table_name, pk)
+        self.invalidations += 1
+        LOOKUP_CACHE_INVALIDATIONS.inc()
+        if self._versions is not None:
+            slot = self._slot(key)
+            # Concurrent bumps may collapse into one, which still changes the value
+            self._versions[slot] = (self._versions[slot] + 1) & 0xFFFFFFFF
+        self._entries.pop(key, None)
+        if item is not None:
+            self.put(table_name, pk, item)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "shared_invalidation": self._versions is not None,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+_cache = None
+
+
+def get_lookup_cache():
+    """Return the process-wide lookup cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        _cache = LookupCache()
+    return _cache
@@ -0,0 +1,253 @@
+import bisect
+import math
+import os
+import resource
+
+# Latency buckets in seconds, from a fast DynamoDB hit to a slow model turn
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    """Base of the metric families: a name, help text and labeled children.
+
+    Updates and /metrics rendering both happen on the event loop thread, so
+    no locking is needed.
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        """Return the child for these label values; keep it to skip the lookup."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self, values, child):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._samples(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].value += amount
+
+    def _samples(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, function):
+        """Compute the value when scraped instead of tracking it."""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount=1):
+        self._children[()].dec(amount)
+
+    def set_function(self, function):
+        self._children[()].set_function(function)
+
+    def _samples(self, values, child):
+        try:
+            value = child.get()
+        except Exception:
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        # One slot per bucket plus +Inf; made cumulative only when rendered
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def _samples(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (math.inf,), list(child.counts)):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, [("le", _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def resident_memory_bytes():
+    """Current RSS of this process; the peak RSS where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Server-wide metrics, updated by the modules that own each measurement
+ACTIVE_SESSIONS = Gauge("nova_sonic_active_sessions", "WebSocket sessions currently served")
+QUEUE_DEPTH = Gauge("nova_sonic_queue_depth", "Items queued across active sessions", ["queue"])
+QUEUE_DROPPED = Counter("nova_sonic_queue_dropped_total", "Items dropped from full session queues", ["queue"])
+PROCESS_RSS = Gauge("process_resident_memory_bytes", "Resident memory size in bytes")
+PROCESS_RSS.set_function(resident_memory_bytes)
+STREAM_OPEN_SECONDS = Histogram("nova_sonic_stream_open_seconds", "Time to open a Bedrock bidirectional stream")
+FIRST_OUTPUT_SECONDS = Histogram(
+    "nova_sonic_first_output_seconds",
+    "Time from the end of the user's speech to the first assistant output of the turn",
+    ["output"],
+)
+TOOL_SECONDS = Histogram("nova_sonic_tool_seconds", "Tool execution time", ["tool", "outcome"])
+DYNAMODB_SECONDS = Histogram("nova_sonic_dynamodb_seconds", "DynamoDB call time, queueing included", ["operation"])
+BEDROCK_ERRORS = Counter("nova_sonic_bedrock_errors_total", "Errors reading the Bedrock output stream", ["category"])
+ADMISSION_TOTAL = Counter("nova_sonic_admission_total", "New WebSocket sessions by admission outcome", ["outcome", "reason"])
+ADMISSION_WAIT_SECONDS = Histogram("nova_sonic_admission_wait_seconds", "Time admitted sessions waited for a free slot")
+AUDIO_FRAME_DELAY_SECONDS = Histogram(
+    "nova_sonic_audio_frame_delay_seconds",
+    "Time microphone audio waited to fill a frame before being sent to Bedrock",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.15, 0.25, 0.5, 1.0),
+)
+AUDIO_INPUT_CHUNKS = Counter("nova_sonic_audio_input_chunks_total", "Microphone chunks joined into Bedrock audioInput frames")
+INPUT_SEND_WAIT_SECONDS = Histogram(
+    "nova_sonic_input_send_wait_seconds",
+    "Time events waited for the session's Bedrock input writer",
+    ["lane"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+BARGE_IN_SECONDS = Histogram(
+    "nova_sonic_barge_in_seconds",
+    "Time from detecting a barge-in to sending the client its audioFlush event",
+    ["source"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+BARGE_IN_DROPPED = Counter("nova_sonic_barge_in_dropped_chunks_total", "Queued assistant audio chunks dropped on barge-in")
+STREAM_RENEWALS = Counter("nova_sonic_stream_renewals_total", "Failed Bedrock streams replaced behind a live session", ["outcome"])
+STREAM_RENEWAL_SECONDS = Histogram("nova_sonic_stream_renewal_seconds", "Time to open a new Bedrock stream and replay the conversation")
+VAD_AUDIO_BYTES = Counter("nova_sonic_vad_audio_bytes_total", "Microphone audio bytes by voice activity decision", ["decision"])
+BEDROCK_CIRCUIT_STATE = Gauge("nova_sonic_bedrock_circuit_state", "Bedrock circuit breaker state (0 closed, 1 half-open, 2 open)")
+BEDROCK_CIRCUIT_TRANSITIONS = Counter("nova_sonic_bedrock_circuit_transitions_total", "Bedrock circuit breaker state changes", ["state"])
+BEDROCK_CIRCUIT_REJECTED = Counter("nova_sonic_bedrock_circuit_rejected_total", "Bedrock stream opens failed fast by the circuit breaker")
+BEDROCK_RETRIES = Counter("nova_sonic_bedrock_retries_total", "Retries of Bedrock streams lost to Bedrock failures, by retry budget decision", ["outcome"])
+LOOKUP_CACHE_LOOKUPS = Counter("nova_sonic_lookup_cache_total", "Order/appointment lookups by lookup cache result", ["result"])
+LOOKUP_CACHE_EVICTIONS = Counter("nova_sonic_lookup_cache_evictions_total", "Items evicted from the lookup cache to stay within its size")
+LOOKUP_CACHE_INVALIDATIONS = Counter("nova_sonic_lookup_cache_invalidations_total", "Lookup cache entries invalidated by writes")
+BEDROCK_RETRY_BUDGET_TOKENS = Gauge("nova_sonic_bedrock_retry_budget_tokens", "Retries the shared Bedrock retry budget allows right now")
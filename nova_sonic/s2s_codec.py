@@ -0,0 +1,216 @@
+import base64
+import json
+import struct
+
+# WebSocket subprotocol a client offers to stream microphone audio as binary frames
+BINARY_AUDIO_SUBPROTOCOL = "nova-sonic.audio.v1"
+
+# Binary audio frame layout (network byte order):
+#   u8 version | u8 promptName length | u8 contentName length | promptName | contentName | raw LPCM
+AUDIO_FRAME_VERSION = 1
+_AUDIO_FRAME_HEADER = struct.Struct("!BBB")
+
+_MAX_CACHED_PREFIXES = 64
+
+
+class AudioFrameError(ValueError):
+    """Raised when a binary audio frame or an audio payload is malformed"""
+
+
+def select_subprotocol(connection, subprotocols):
+    """Accept the binary audio subprotocol when offered, plain JSON otherwise"""
+    if BINARY_AUDIO_SUBPROTOCOL in subprotocols:
+        return BINARY_AUDIO_SUBPROTOCOL
+    return None
+
+
+def parse_audio_frame(frame):
+    """Split a binary audio frame into (prompt_name, content_name, pcm).
+
+    The PCM part is returned as a memoryview over the received frame so it can
+    be base64-encoded without copying it first.
+    """
+    header_size = _AUDIO_FRAME_HEADER.size
+    if len(frame) < header_size:
+        raise AudioFrameError(f"Audio frame too short: {len(frame)} bytes")
+
+    version, prompt_len, content_len = _AUDIO_FRAME_HEADER.unpack_from(frame)
+    if version != AUDIO_FRAME_VERSION:
+        raise AudioFrameError(f"Unsupported audio frame version: {version}")
+
+    content_offset = header_size + prompt_len
+    pcm_offset = content_offset + content_len
+    if not prompt_len or not content_len or len(frame) <= pcm_offset:
+        raise AudioFrameError("Audio frame is missing names or audio data")
+
+    view = memoryview(frame)
+    prompt_name = str(view[header_size:content_offset], "utf-8")
+    content_name = str(view[content_offset:pcm_offset], "utf-8")
+    return prompt_name, content_name, view[pcm_offset:]
+
+
+def build_audio_frame(prompt_name, content_name, pcm):
+    """Build a binary audio frame (used by test clients and tooling)"""
+    prompt = prompt_name.encode("utf-8")
+    content = content_name.encode("utf-8")
+    if len(prompt) > 255 or len(content) > 255:
+        raise AudioFrameError("Prompt and content names must fit in 255 bytes")
+    return b"".join((_AUDIO_FRAME_HEADER.pack(AUDIO_FRAME_VERSION, len(prompt), len(content)), prompt, content, pcm))
+
+
+class AudioInputEncoder:
+    """Builds serialized Bedrock audioInput events without intermediate dicts.
+
+    The JSON envelope around the audio content only depends on the prompt and
+    content names, so it is rendered once per content and reused for every chunk.
+    """
+
+    def __init__(self):
+        self._prefixes = {}
+
+    def _prefix(self, prompt_name, content_name):
+        key = (prompt_name, content_name)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            if len(self._prefixes) >= _MAX_CACHED_PREFIXES:
+                self._prefixes.clear()
+            prefix = (
+                '{"event":{"audioInput":{"promptName":%s,"contentName":%s,"content":'
+                % (json.dumps(prompt_name), json.dumps(content_name))
+            ).encode("utf-8")
+            self._prefixes[key] = prefix
+        return prefix
+
+    def encode_pcm(self, prompt_name, content_name, pcm):
+        """Encode raw LPCM bytes into an audioInput payload (single base64 step)"""
+        return b"".join((self._prefix(prompt_name, content_name), b'"', base64.b64encode(pcm), b'"}}}'))
+
+    def encode_base64(self, prompt_name, content_name, audio_base64):
+        """Encode audio that already arrived base64-encoded from the client"""
+        # json.dumps on an ASCII string is a single C-level scan and keeps a
+        # malformed client payload from breaking out of the JSON string.
+        return b"".join((self._prefix(prompt_name, content_name), json.dumps(audio_base64).encode("ascii"), b"}}}"))
+
+
+def audio_size(audio):
+    """PCM byte count of queued audio: base64 text or raw bytes"""
+    if isinstance(audio, str):
+        return len(audio) * 3 // 4 - audio.count("=", -2)
+    return len(audio)
+
+
+class AudioCoalescer:
+    """Joins small microphone chunks into frames of a target size.
+
+    Chunks are buffered per (prompt name, content name) and released as one
+    frame once frame_bytes of PCM are buffered, when the content changes, or
+    when the caller flushes (deadline or contentEnd). A frame made of a single
+    chunk keeps the chunk as received, so base64 audio is only decoded when
+    two or more chunks are actually joined. frame_bytes=0 passes every chunk
+    straight through.
+    """
+
+    def __init__(self, frame_bytes):
+        self.frame_bytes = frame_bytes
+        self._key = None
+        self._parts = []
+        self._size = 0
+        # When the oldest buffered chunk arrived, for the flush deadline
+        self.started = None
+
+    def __bool__(self):
+        return bool(self._parts)
+
+    def add(self, prompt_name, content_name, audio, now):
+        """Buffer a chunk and return the frames ready to send, oldest first."""
+        frames = []
+        key = (prompt_name, content_name)
+        if self._parts and key != self._key:
+            frames.append(self.flush())
+        if not self._parts:
+            self._key = key
+            self.started = now
+        self._parts.append(audio)
+        self._size += audio_size(audio)
+        if self._size >= self.frame_bytes:
+            frames.append(self.flush())
+        return frames
+
+    def flush(self):
+        """Return the buffered audio as one frame, or None.
+
+        Frames are (prompt name, content name, audio, time the oldest chunk
+        was added), the time being the caller's clock passed to add().
+        """
+        if not self._parts:
+            return None
+        parts = self._parts
+        if len(parts) == 1:
+            audio = parts[0]
+        else:
+            audio = b"".join(base64.b64decode(part) if isinstance(part, str) else part for part in parts)
+        frame = (self._key[0], self._key[1], audio, self.started)
+        self._parts = []
+        self._size = 0
+        self.started = None
+        return frame
+
+
+# Output events forwarded to the client as the original Bedrock bytes
+PASSTHROUGH_EVENTS = frozenset(("audioOutput", "textOutput"))
+
+# The event name is the first key of the "event" object, so it always sits in
+# the first few bytes of the payload; don't scan large audio strings for it
+_EVENT_PEEK_WINDOW = 128
+
+
+def peek_event_type(payload):
+    """Return the name of a serialized S2S event without parsing the payload"""
+    start = payload.find(b'"event"', 0, _EVENT_PEEK_WINDOW)
+    if start < 0:
+        return None
+    brace = payload.find(b"{", start + 7, _EVENT_PEEK_WINDOW)
+    if brace < 0:
+        return None
+    name_start = payload.find(b'"', brace + 1, _EVENT_PEEK_WINDOW)
+    if name_start < 0:
+        return None
+    name_end = payload.find(b'"', name_start + 1, _EVENT_PEEK_WINDOW)
+    if name_end < 0:
+        return None
+    return payload[name_start + 1:name_end].decode("ascii", "replace")
+
+
+def peek_string_field(payload, name):
+    """Return a string member of a serialized event without parsing the payload.
+
+    Meant for short members without escapes (role, contentId) of small
+    events such as textOutput; a quoted key can't occur inside a JSON string
+    value, where its quotes would be escaped. Returns None when not found.
+    """
+    key = b'"' + name.encode("ascii") + b'"'
+    start = payload.find(key)
+    if start < 0:
+        return None
+    colon = payload.find(b":", start + len(key))
+    if colon < 0:
+        return None
+    value_start = payload.find(b'"', colon + 1)
+    if value_start < 0 or payload[colon + 1:value_start].strip():
+        return None
+    value_end = payload.find(b'"', value_start + 1)
+    if value_end < 0:
+        return None
+    return payload[value_start + 1:value_end].decode("utf-8", "replace")
+
+
+def splice_timestamp(payload, timestamp):
+    """Append a top-level "timestamp" member to a serialized event object.
+
+    Returns None when the payload doesn't look like a JSON object so callers
+    can fall back to a full parse.
+    """
+    payload = payload.rstrip()
+    if not payload.endswith(b"}"):
+        return None
+    return b"".join((payload[:-1], b',"timestamp":', str(timestamp).encode("ascii"), b"}"))
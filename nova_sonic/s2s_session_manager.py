@@ -1,42 +1,182 @@
 import asyncio
 import json
 import base64
+import logging
 import warnings
 import uuid
+import os
+import random
+import re
 from s2s_events import S2sEvent
+from s2s_codec import (PASSTHROUGH_EVENTS, AudioCoalescer, AudioInputEncoder, peek_event_type, peek_string_field,
+                       splice_timestamp)
 import time
-from aws_sdk_bedrock_runtime.client import BedrockRuntimeClient, InvokeModelWithBidirectionalStreamOperationInput
-from aws_sdk_bedrock_runtime.models import InvokeModelWithBidirectionalStreamInputChunk, BidirectionalInputPayloadPart
-from aws_sdk_bedrock_runtime.config import Config, HTTPAuthSchemeResolver, SigV4AuthScheme
-from smithy_aws_core.credentials_resolvers.environment import EnvironmentCredentialsResolver
+from bedrock_pool import get_client_pool
+from bedrock_errors import BEDROCK_FAILURE_CATEGORIES, classify_error
+from circuit_breaker import CircuitOpenError
+from input_writer import ORDERED_LANE, URGENT_LANE, BedrockInputWriter
+from conversation_state import ConversationState
 from tool_processor import NovaSonicToolProcessor
+from session_queues import BoundedSessionQueue, QueueOverflowError
+from session_recorder import SessionRecorder
+from voice_activity import VAD_MODE, VoiceActivityDetector, resolve_vad_mode, vad_available
+from logging_config import SessionLogger
+from metrics import (AUDIO_FRAME_DELAY_SECONDS, AUDIO_INPUT_CHUNKS, BARGE_IN_DROPPED, BEDROCK_ERRORS,
+                     FIRST_OUTPUT_SECONDS, STREAM_RENEWAL_SECONDS, STREAM_RENEWALS, TOOL_SECONDS)
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
-DEBUG = False
+logger = logging.getLogger(__name__)
 
-def debug_print(message):
-    """Print only if debug mode is enabled"""
-    if DEBUG:
-        print(message)
+# Per-session queue limits and slow-consumer policies (see session_queues.py).
+# At 16 kHz 16-bit mono, 200 browser chunks is a few seconds of speech.
+AUDIO_INPUT_QUEUE_SIZE = int(os.getenv("AUDIO_INPUT_QUEUE_SIZE", "200"))
+AUDIO_INPUT_QUEUE_POLICY = os.getenv("AUDIO_INPUT_QUEUE_POLICY", "drop_oldest")
+OUTPUT_QUEUE_SIZE = int(os.getenv("OUTPUT_QUEUE_SIZE", "500"))
+OUTPUT_QUEUE_POLICY = os.getenv("OUTPUT_QUEUE_POLICY", "drop_oldest")
+
+# Tool execution timeouts in seconds: TOOL_TIMEOUT is the default and
+# TOOL_TIMEOUTS a JSON object with per-tool overrides, e.g. {"crearOrder": 15}
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "10"))
+TOOL_TIMEOUTS = json.loads(os.getenv("TOOL_TIMEOUTS", "{}"))
+
+# Start read-only tools as soon as toolUse arrives instead of at contentEnd
+SPECULATIVE_TOOLS = os.getenv("SPECULATIVE_TOOLS", "false").lower() in ("1", "true", "yes")
+
+# Microphone chunks are joined into audioInput events of AUDIO_FRAME_MS of
+# audio (0 = one event per chunk); a partial frame is sent anyway once its
+# oldest chunk has waited AUDIO_FRAME_DEADLINE_MS
+AUDIO_FRAME_MS = int(os.getenv("AUDIO_FRAME_MS", "100"))
+AUDIO_FRAME_DEADLINE_MS = int(os.getenv("AUDIO_FRAME_DEADLINE_MS", "150"))
+# 16 kHz 16-bit mono LPCM
+_AUDIO_BYTES_PER_MS = 32
+
+# Barge-in: when the caller talks over the assistant, the assistant audio still
+# queued for the client is dropped and the client gets an audioFlush event to
+# stop its own playback. Nova Sonic's interruption signal triggers it; with
+# BARGE_IN_VAD the local VAD (NumPy) also does, after BARGE_IN_MIN_SPEECH_MS
+# of continuous speech, without waiting for the model.
+BARGE_IN_FLUSH = os.getenv("BARGE_IN_FLUSH", "true").lower() in ("1", "true", "yes")
+BARGE_IN_VAD = os.getenv("BARGE_IN_VAD", "false").lower() in ("1", "true", "yes")
+BARGE_IN_MIN_SPEECH_MS = int(os.getenv("BARGE_IN_MIN_SPEECH_MS", "300"))
+
+# When the Bedrock stream fails (session time limit, service errors, a stuck
+# stream) a new one is opened and the conversation replayed into it, behind
+# the same WebSocket. STREAM_RENEWAL_ATTEMPTS bounds the renewals in a row
+# without a completed reply or _RENEWAL_RESET_SECONDS of stream in between.
+STREAM_RENEWAL = os.getenv("STREAM_RENEWAL", "true").lower() in ("1", "true", "yes")
+STREAM_RENEWAL_ATTEMPTS = int(os.getenv("STREAM_RENEWAL_ATTEMPTS", "3"))
+_RENEWAL_RESET_SECONDS = 60.0
+# Stream failures that renewing can't fix; a validation error would be
+# replayed into the new stream (the session time limit is "session_limit")
+_NOT_RENEWABLE = (None, "slow_client", "access", "validation")
+
+# Upper bound for a coalesced audio chunk (~2s of 16 kHz 16-bit mono PCM)
+MAX_COALESCED_AUDIO_BYTES = 64 * 1024
+
+def merge_audio_chunks(older, newer):
+    """Merge two queued audio chunks of the same content, or return None"""
+    prompt_name, content_name, older_audio = older
+    if newer[0] != prompt_name or newer[1] != content_name:
+        return None
+    newer_audio = newer[2]
+    if isinstance(older_audio, str) != isinstance(newer_audio, str):
+        return None
+    if len(older_audio) + len(newer_audio) > MAX_COALESCED_AUDIO_BYTES:
+        return None
+    if isinstance(older_audio, str):
+        # Unpadded base64 strings can simply be concatenated
+        if older_audio.endswith("="):
+            merged = base64.b64encode(base64.b64decode(older_audio) + base64.b64decode(newer_audio)).decode("ascii")
+        else:
+            merged = older_audio + newer_audio
+    else:
+        merged = bytes(older_audio) + bytes(newer_audio)
+    return (prompt_name, content_name, merged)
+
+
+FIRST_OUTPUT_EVENTS = ('textOutput', 'audioOutput')
+
+
+def is_audio_output(item):
+    """Only assistant audio may be dropped from the output queue"""
+    return item[0] == 'audioOutput'
+
+
+# The content of that textOutput is the JSON text { "interrupted" : true },
+# escaped inside the event's content string
+_INTERRUPTION_CONTENT = re.compile(rb'"content"\s*:\s*"\s*\{\s*\\"interrupted\\"\s*:\s*true\s*\}\s*"')
+
+
+def is_interruption(payload):
+    """True for the textOutput Nova Sonic sends when the user barges in"""
+    return b'interrupted' in payload and _INTERRUPTION_CONTENT.search(payload) is not None
 
 
 class S2sSessionManager:
     """Manages bidirectional streaming with AWS Bedrock using asyncio"""
     
-    def __init__(self, region, model_id='amazon.nova-sonic-v1:0'):
+    def __init__(self, region, model_id='amazon.nova-sonic-v1:0',
+                 audio_queue_size=AUDIO_INPUT_QUEUE_SIZE, audio_queue_policy=AUDIO_INPUT_QUEUE_POLICY,
+                 output_queue_size=OUTPUT_QUEUE_SIZE, output_queue_policy=OUTPUT_QUEUE_POLICY,
+                 client_pool=None, speculative_tools=SPECULATIVE_TOOLS, vad_mode=VAD_MODE,
+                 audio_frame_ms=AUDIO_FRAME_MS, audio_frame_deadline_ms=AUDIO_FRAME_DEADLINE_MS,
+                 barge_in_flush=BARGE_IN_FLUSH, barge_in_vad=BARGE_IN_VAD, stream_renewal=STREAM_RENEWAL):
         """Initialize the stream manager."""
         self.model_id = model_id
         self.region = region
+        self.session_id = uuid.uuid4().hex[:8]
+        self.log = SessionLogger(logger, {"session": self.session_id})
+        # Opt-in recording of the session for replay (SESSION_RECORD_DIR)
+        self.recorder = SessionRecorder.for_session(self.session_id, model_id)
+        if self.recorder:
+            self.log.info("Recording session to %s", self.recorder.path)
+        # Process-wide Bedrock clients (and pre-opened streams) shared by sessions
+        self.client_pool = client_pool
         
-        # Audio and output queues
-        self.audio_input_queue = asyncio.Queue()
-        self.output_queue = asyncio.Queue()
+        # Server-side VAD drops or thins the silence between user turns before
+        # it is queued for Bedrock (None when the mode is off)
+        vad_mode = resolve_vad_mode(vad_mode)
+        self.barge_in_flush = barge_in_flush
+        self.barge_in_vad = barge_in_flush and barge_in_vad and vad_available()
+        if barge_in_flush and barge_in_vad and not self.barge_in_vad:
+            self.log.warning("BARGE_IN_VAD needs NumPy, barge-in relies on Nova Sonic only")
+        # In off mode the detector only tracks speech for barge-in; without it
+        # replies are timed from the user transcript instead of the speech end
+        self.vad = VoiceActivityDetector(vad_mode) if vad_mode != "off" or self.barge_in_vad else None
+        
+        # Bounded audio and output queues cap per-session memory when the
+        # browser or the Bedrock stream falls behind
+        self.audio_input_queue = BoundedSessionQueue(
+            "audio_input", audio_queue_size, audio_queue_policy, merge=merge_audio_chunks
+        )
+        self.output_queue = BoundedSessionQueue(
+            "output", output_queue_size, output_queue_policy, droppable=is_audio_output
+        )
         
         self.response_task = None
+        self.audio_task = None
+        # Single writer of the Bedrock input stream (see input_writer.py)
+        self.input_writer = None
+        self.writer_task = None
+        # Audio contents opened on the stream; their contentEnd stays behind their audio
+        self.audio_contents = set()
+        
+        # Conversation replayed into a new stream when the current one fails.
+        # Sends wait on stream_ready while a renewal is in progress, and tool
+        # results of a previous stream (generation) are never sent.
+        self.conversation = ConversationState()
+        self.stream_renewal = stream_renewal
+        self.stream_ready = asyncio.Event()
+        self.stream_ready.set()
+        self.stream_generation = 0
+        self.stream_opened_at = None
+        self.renewal_attempts = 0
+        self.session_ending = False
         self.stream = None
         self.is_active = False
+        self.is_closed = False
         self.bedrock_client = None
         
         # Session information
@@ -47,24 +187,56 @@ class S2sSessionManager:
         self.toolUseId = ""
         self.toolName = ""
         
+        # Tool invocations run as tracked tasks; their results are sent to
+        # Bedrock in dispatch order by a single sender task
+        self.tool_tasks = set()
+        self.tool_results = asyncio.Queue()
+        self.tool_sender_task = None
+        # Dispatched tool calls whose result isn't recorded in the
+        # conversation yet; a renewal waits for them before replaying it
+        self.dispatched_tools = set()
+        
+        # Read-only tools started on toolUse, by toolUseId, waiting for contentEnd
+        self.speculative_tools = speculative_tools
+        self.speculative_tasks = {}
+        
+        # Renders audioInput payloads straight from the queued audio
+        self.audio_encoder = AudioInputEncoder()
+        # Joins small browser chunks into fewer, larger audioInput events. The
+        # lock keeps a flush on contentEnd from overtaking a frame being sent.
+        self.audio_coalescer = AudioCoalescer(audio_frame_ms * _AUDIO_BYTES_PER_MS)
+        self.audio_frame_deadline = audio_frame_deadline_ms / 1000
+        self.audio_send_lock = asyncio.Lock()
+        
         # Time tracking for stuck stream detection
         self.last_response_time = time.time()
         self.last_audio_sent_time = time.time()
         self.is_processing_response = False  # Track if we're in the middle of a response
         
+        # When the user last stopped speaking (VAD falling edge or the audio
+        # contentEnd; without the VAD, the end of the user transcript), and the
+        # assistant output events still to be timed from it. Not re-stamped
+        # while the assistant is replying.
+        self.turn_started_at = None
+        self.user_transcript_id = None
+        self.first_output_pending = set()
+        self.reply_started = False
+        
+        # Assistant audio content being received, and whether its queued audio
+        # was already flushed by a barge-in (later chunks of it are dropped too)
+        self.assistant_content_id = None
+        self.audio_flushed = False
+        # (monotonic time, source) of the last barge-in, until its audioFlush is sent
+        self.barge_in_started = None
+        
         # Carlos's tool processor
         self.tool_processor = NovaSonicToolProcessor()
 
     def _initialize_client(self):
-        """Initialize the Bedrock client."""
-        config = Config(
-            endpoint_uri=f"https://bedrock-runtime.{self.region}.amazonaws.com",
-            region=self.region,
-            aws_credentials_identity_resolver=EnvironmentCredentialsResolver(),
-            http_auth_scheme_resolver=HTTPAuthSchemeResolver(),
-            http_auth_schemes={"aws.auth#sigv4": SigV4AuthScheme()}
-        )
-        self.bedrock_client = BedrockRuntimeClient(config=config)
+        """Pick the Bedrock client from the process-wide pool."""
+        if self.client_pool is None:
+            self.client_pool = get_client_pool(self.region, self.model_id)
+        self.bedrock_client = self.client_pool.get_client()
 
     async def initialize_stream(self):
         """Initialize the bidirectional stream with Bedrock."""
@@ -73,131 +245,240 @@ class S2sSessionManager:
                 self._initialize_client()
         except Exception as ex:
             self.is_active = False
-            print(f"Failed to initialize Bedrock client: {str(ex)}")
+            self.log.error("Failed to initialize Bedrock client: %s", ex)
             raise
 
         try:
-            # Initialize the stream
-            self.stream = await self.bedrock_client.invoke_model_with_bidirectional_stream(
-                InvokeModelWithBidirectionalStreamOperationInput(model_id=self.model_id)
-            )
+            # Claim a pre-opened stream from the pool, or open a new one
+            self.stream = await self.client_pool.claim_stream()
+            self.stream_opened_at = time.monotonic()
             self.is_active = True
             
+            # Every event to Bedrock goes through one writer task
+            self.input_writer = BedrockInputWriter(self.stream.input_stream)
+            self.writer_task = asyncio.create_task(self.input_writer.run())
+            
             # Start listening for responses
             self.response_task = asyncio.create_task(self._process_responses())
 
             # Start processing audio input
-            asyncio.create_task(self._process_audio_input())
-            
-            # Wait a bit to ensure everything is set up
-            await asyncio.sleep(0.1)
+            self.audio_task = asyncio.create_task(self._process_audio_input())
+
+            # Start sending tool results as tools complete
+            self.tool_sender_task = asyncio.create_task(self._send_tool_results())
             
-            debug_print("Stream initialized successfully")
+            self.log.debug("Stream initialized successfully")
             return self
         except Exception as e:
             self.is_active = False
-            print(f"Failed to initialize stream: {str(e)}")
+            self.log.error("Failed to initialize stream: %s", e)
             raise
     
+    def _input_lane(self, event_type, event):
+        """Lane of a control event: urgent unless it must stay behind queued audio."""
+        if event_type in ("promptEnd", "sessionEnd"):
+            return ORDERED_LANE
+        if event_type == "contentStart" and event.get("type") == "AUDIO":
+            self.audio_contents.add(event.get("contentName"))
+            return ORDERED_LANE
+        if event_type == "contentEnd" and event.get("contentName") in self.audio_contents:
+            return ORDERED_LANE
+        return URGENT_LANE
+
     async def send_raw_event(self, event_data):
+        """Send a raw event to the Bedrock stream."""
         try:
-            """Send a raw event to the Bedrock stream."""
+            event_json = json.dumps(event_data)
+        except Exception as e:
+            self.log.warning("Error serializing event: %s", e)
+            return
+        if not self.stream_ready.is_set():
+            await self.stream_ready.wait()
+        if self.recorder:
+            self.recorder.bedrock_input(event_json)
+        event_type, event = next(iter(event_data["event"].items()))
+        self.conversation.client_event(event_type, event_data)
+        if event_type == "sessionEnd":
+            # The stream closing from here on is the expected end, not a failure
+            self.session_ending = True
+        await self.send_raw_bytes(event_json.encode('utf-8'), is_session_end=event_type == "sessionEnd",
+                                  lane=self._input_lane(event_type, event))
+
+    async def send_raw_bytes(self, payload, is_session_end=False, lane=ORDERED_LANE):
+        """Send an already serialized event to the Bedrock stream.
+
+        Waits until the writer task has handed the event to the stream; audio
+        uses the default ordered lane, tool results and control events jump
+        ahead of it on the urgent lane.
+        """
+        try:
+            if not self.stream_ready.is_set():
+                # A new stream is being set up
+                await self.stream_ready.wait()
             if not self.stream or not self.is_active:
-                debug_print("Stream not initialized or closed")
+                self.log.debug("Stream not initialized or closed")
                 return
             
-            event_json = json.dumps(event_data)
-            #if "audioInput" not in event_data["event"]:
-            #    print(event_json)
-            event = InvokeModelWithBidirectionalStreamInputChunk(
-                value=BidirectionalInputPayloadPart(bytes_=event_json.encode('utf-8'))
-            )
-            await self.stream.input_stream.send(event)
+            if not await self.input_writer.submit(payload, lane):
+                return
 
             # Close session
-            if "sessionEnd" in event_data["event"]:
-                print("Session end detected, closing stream gracefully...")
+            if is_session_end:
+                self.log.info("Session end detected, closing stream gracefully...")
                 # Don't call close() here as it will be called by _process_responses
                 # Just mark as inactive to stop processing
                 self.is_active = False
             
         except Exception as e:
-            debug_print(f"Error sending event: {str(e)}")
+            self.log.warning("Error sending event: %s", e)
     
     async def _process_audio_input(self):
         """Process audio input from the queue and send to Bedrock."""
         consecutive_audio_errors = 0
         max_audio_errors = 5
+        coalescer = self.audio_coalescer
+        loop = asyncio.get_running_loop()
         
         while self.is_active:
             try:
-                # Get audio data from the queue with timeout
+                # Wait for audio, or only until the buffered frame is due
+                timeout = 2.0 if not coalescer else max(coalescer.started + self.audio_frame_deadline - loop.time(), 0)
                 try:
-                    data = await asyncio.wait_for(self.audio_input_queue.get(), timeout=2.0)
+                    prompt_name, content_name, audio = await asyncio.wait_for(self.audio_input_queue.get(), timeout=timeout)
                 except asyncio.TimeoutError:
+                    if coalescer:
+                        async with self.audio_send_lock:
+                            # flush_audio_input may have sent it meanwhile
+                            frame = coalescer.flush()
+                            if frame:
+                                await self._send_audio_frame(frame)
                     # No audio data for 2 seconds, check if still active
-                    if not self.is_active:
+                    elif not self.is_active:
                         break
                     continue
                 
-                # Extract data from the queue item
-                prompt_name = data.get('prompt_name')
-                content_name = data.get('content_name')
-                audio_bytes = data.get('audio_bytes')
-                
-                if not audio_bytes or not prompt_name or not content_name:
-                    debug_print("Missing required audio data properties")
+                if not audio or not prompt_name or not content_name:
+                    self.log.debug("Missing required audio data properties")
                     continue
 
-                # Create the audio input event
-                audio_event = S2sEvent.audio_input(prompt_name, content_name, audio_bytes.decode('utf-8') if isinstance(audio_bytes, bytes) else audio_bytes)
-                
-                # Send the event
-                await self.send_raw_event(audio_event)
-                print(f"🎤 Audio sent to Bedrock at {time.strftime('%H:%M:%S')}")
-                print(f"📊 Audio chunk size: {len(audio_bytes) if isinstance(audio_bytes, str) else len(str(audio_bytes))} chars")
-                
-                # Update audio sent time for timeout tracking
-                self.last_audio_sent_time = time.time()
+                AUDIO_INPUT_CHUNKS.inc()
+                # Take frames out of the coalescer only under the lock, so a
+                # flush on contentEnd can't leave one behind to be sent after it
+                async with self.audio_send_lock:
+                    for frame in coalescer.add(prompt_name, content_name, audio, loop.time()):
+                        await self._send_audio_frame(frame)
                 
                 # Reset error counter on successful send
                 consecutive_audio_errors = 0
                 
             except asyncio.CancelledError:
-                print("Audio processing task cancelled")
+                self.log.debug("Audio processing task cancelled")
                 break
             except Exception as e:
                 consecutive_audio_errors += 1
-                print(f"Error processing audio (attempt {consecutive_audio_errors}/{max_audio_errors}): {e}")
+                self.log.warning("Error processing audio (attempt %d/%d): %s", consecutive_audio_errors, max_audio_errors, e,
+                                 exc_info=logger.isEnabledFor(logging.DEBUG))
                 
                 if consecutive_audio_errors >= max_audio_errors:
-                    print(f"Too many audio processing errors ({consecutive_audio_errors}), stopping audio processing")
+                    self.log.error("Too many audio processing errors (%d), stopping audio processing", consecutive_audio_errors)
                     break
-                
-                if DEBUG:
-                    import traceback
-                    traceback.print_exc()
         
-        print("Audio processing loop ended")
+        self.log.debug("Audio processing loop ended")
     
-    def add_audio_chunk(self, prompt_name, content_name, audio_data):
-        """Add an audio chunk to the queue."""
-        # The audio_data is already a base64 string from the frontend
-        print(f"📥 Audio chunk received from frontend - Prompt: {prompt_name}, Content: {content_name}")
-        print(f"📊 Audio data length: {len(audio_data) if isinstance(audio_data, str) else len(str(audio_data))} chars")
+    async def _send_audio_frame(self, frame):
+        """Send one coalesced frame of microphone audio as an audioInput event."""
+        prompt_name, content_name, audio, started = frame
+        # Build the serialized audioInput event in one step: base64 audio
+        # from JSON clients is spliced in as-is, raw PCM from binary
+        # clients or joined frames is encoded exactly once.
+        if isinstance(audio, str):
+            payload = self.audio_encoder.encode_base64(prompt_name, content_name, audio)
+        else:
+            payload = self.audio_encoder.encode_pcm(prompt_name, content_name, audio)
+        AUDIO_FRAME_DELAY_SECONDS.observe(asyncio.get_running_loop().time() - started)
+        
+        # Send the event
+        await self.send_raw_bytes(payload)
+        if self.recorder:
+            self.recorder.bedrock_input_audio(prompt_name, content_name, audio)
+        self.log.debug("🎤 Audio sent to Bedrock: %d bytes", len(payload), extra={"event": "audioInput"})
         
-        self.audio_input_queue.put_nowait({
-            'prompt_name': prompt_name,
-            'content_name': content_name,
-            'audio_bytes': audio_data
-        })
-        print(f"✅ Audio chunk added to queue. Queue size: {self.audio_input_queue.qsize()}")
+        # Update audio sent time for timeout tracking
+        self.last_audio_sent_time = time.time()
+        if self.stream_renewal:
+            # Kept until transcribed, for a renewal to send again
+            self.conversation.user_audio(audio)
+
+    def _mark_speech_end(self):
+        """Start timing the assistant's reply from the end of the user's speech."""
+        if self.reply_started:
+            return
+        self.turn_started_at = time.monotonic()
+        self.first_output_pending = set(FIRST_OUTPUT_EVENTS)
+
+    def _observe_first_output(self, event_name):
+        # Output after the reply (the FINAL text follows the audio) is ignored
+        if event_name in self.first_output_pending:
+            self.first_output_pending.discard(event_name)
+            FIRST_OUTPUT_SECONDS.labels(event_name).observe(time.monotonic() - self.turn_started_at)
+            self.reply_started = True
+
+    async def flush_audio_input(self):
+        """Send the queued and buffered microphone audio now.
+
+        Called before the audio content is closed, so no audio reaches Bedrock
+        after its contentEnd.
+        """
+        coalescer = self.audio_coalescer
+        loop = asyncio.get_running_loop()
+        async with self.audio_send_lock:
+            frames = []
+            while not self.audio_input_queue.empty():
+                prompt_name, content_name, audio = self.audio_input_queue.get_nowait()
+                if audio and prompt_name and content_name:
+                    AUDIO_INPUT_CHUNKS.inc()
+                    frames.extend(coalescer.add(prompt_name, content_name, audio, loop.time()))
+            if coalescer:
+                frames.append(coalescer.flush())
+            for frame in frames:
+                if self.is_active:
+                    await self._send_audio_frame(frame)
+        # The audio content ends with the user's turn
+        self._mark_speech_end()
     
-    async def _process_responses(self):
-        """Process incoming responses from Bedrock."""
+    async def add_audio_chunk(self, prompt_name, content_name, audio_data):
+        """Add an audio chunk to the queue.
+
+        audio_data is either the base64 string sent by JSON clients or the raw
+        LPCM bytes (bytes or memoryview) of a binary audio frame. Waits for room
+        when the audio queue uses the block policy and raises QueueOverflowError
+        when it uses the disconnect policy.
+        """
+        if self.recorder:
+            self.recorder.client_audio(prompt_name, content_name, audio_data)
+        if self.vad is None:
+            await self.audio_input_queue.put((prompt_name, content_name, audio_data))
+        else:
+            was_speaking = self.vad.speech_run_ms > 0
+            for item in self.vad.filter((prompt_name, content_name, audio_data)):
+                await self.audio_input_queue.put(item)
+            if was_speaking and self.vad.speech_run_ms == 0:
+                self._mark_speech_end()
+            if self.barge_in_vad and self.vad.speech_run_ms >= BARGE_IN_MIN_SPEECH_MS:
+                self.barge_in("vad")
+        self.log.debug("📥 Audio chunk queued: %d %s, queue size %d", len(audio_data),
+                       "chars" if isinstance(audio_data, str) else "bytes", self.audio_input_queue.qsize(),
+                       extra={"event": "audioInput"})
+    
+    async def _read_responses(self):
+        """Process incoming responses from the current Bedrock stream.
+
+        Returns why reading stopped, a BEDROCK_ERRORS category, or None once
+        the session ended.
+        """
+        end_reason = None
         consecutive_errors = 0
         max_consecutive_errors = 3
-        retry_delay = 0.5  # Start with 0.5 second delay (faster for user)
         max_no_response_time = 300.0  # 300 seconds without response (user-friendly)
         max_audio_no_response_time = 300.0  # 300 seconds after audio without response (allow time for processing)
         
@@ -208,159 +489,272 @@ class S2sSessionManager:
                 
                 # Check general timeout
                 if current_time - self.last_response_time > max_no_response_time:
-                    print(f"⚠️ No response from Bedrock for {max_no_response_time}s - User would be frustrated!")
-                    print("Breaking connection to allow reconnection")
+                    self.log.warning("⚠️ No response from Bedrock for %ss, breaking connection to allow reconnection", max_no_response_time)
+                    end_reason = "no_response"
+                    BEDROCK_ERRORS.labels(end_reason).inc()
                     break
                 
                 # Check audio-specific timeout (more aggressive)
                 if current_time - self.last_audio_sent_time > max_audio_no_response_time and not self.is_processing_response:
-                    print(f"🚨 Audio sent {max_audio_no_response_time}s ago but no response - User is waiting!")
-                    print("This indicates a stuck stream. Breaking connection immediately...")
+                    self.log.warning("🚨 Audio sent %ss ago but no response, stuck stream. Breaking connection", max_audio_no_response_time)
+                    end_reason = "stuck_stream"
+                    BEDROCK_ERRORS.labels(end_reason).inc()
                     break
                 
                 if not self.stream:
-                    print("Stream is None, breaking")
+                    self.log.warning("Stream is None, breaking")
+                    end_reason = "no_stream"
                     break
                     
                 output = await self.stream.await_output()
                 result = await output[1].receive()
-                
+
+                # receive() returns None once the output stream is over, which
+                # is expected after sessionEnd
+                if result is None:
+                    if self.is_active:
+                        self.log.info("Output stream ended")
+                        end_reason = "stream_ended"
+                        BEDROCK_ERRORS.labels(end_reason).inc()
+                    break
+
                 # Reset error counter and retry delay on successful response
                 consecutive_errors = 0
-                retry_delay = 0.5  # Reset delay (faster for user)
                 self.last_response_time = time.time()  # Update last response time
                 self.is_processing_response = True  # Mark that we're processing a response
-                #print(f"✅ Response received from Bedrock at {time.strftime('%H:%M:%S')}")
                 
                 if result.value and result.value.bytes_:
-                    response_data = result.value.bytes_.decode('utf-8')
+                    response_data = result.value.bytes_
+                    if self.recorder:
+                        self.recorder.bedrock_output(response_data)
+                    timestamp = int(time.time() * 1000)  # Milliseconds since epoch
+                    
+                    # Fast path: audio and text output only need to reach the
+                    # frontend, so forward the original bytes with the timestamp
+                    # spliced in instead of parsing and re-serializing them
+                    event_name = peek_event_type(response_data)
+                    # Only the assistant's output answers the turn, not the
+                    # transcript of the user's speech
+                    if event_name == "audioOutput" or (
+                            event_name == "textOutput" and peek_string_field(response_data, "role") == "ASSISTANT"):
+                        self._observe_first_output(event_name)
+                    if event_name == "textOutput":
+                        self.conversation.output_text(peek_string_field(response_data, "contentId"), response_data)
+                    if event_name in PASSTHROUGH_EVENTS:
+                        if event_name == "audioOutput" and self.audio_flushed:
+                            # The caller interrupted this reply; don't queue the rest of it
+                            self.is_processing_response = False
+                            continue
+                        if event_name == "textOutput" and self.barge_in_flush and is_interruption(response_data):
+                            self.barge_in("bedrock")
+                        payload = splice_timestamp(response_data, timestamp)
+                        if payload is not None:
+                            await self.output_queue.put((event_name, payload))
+                            self.log.debug("Output received: %d bytes", len(payload), extra={"event": event_name})
+                            self.is_processing_response = False
+                            continue
                     
                     json_data = json.loads(response_data)
-                    json_data["timestamp"] = int(time.time() * 1000)  # Milliseconds since epoch
+                    json_data["timestamp"] = timestamp
                     
                     event_name = None
                     if 'event' in json_data:
                         event_name = list(json_data["event"].keys())[0]
+                        self.conversation.output_event(event_name, json_data["event"][event_name])
                         
                         # Handle tool use detection
                         if event_name == 'toolUse':
                             self.toolUseContent = json_data['event']['toolUse']
                             self.toolName = json_data['event']['toolUse']['toolName']
                             self.toolUseId = json_data['event']['toolUse']['toolUseId']
-                            debug_print(f"Tool use detected: {self.toolName}, ID: {self.toolUseId}")
+                            self.log.info("Tool use detected, ID: %s", self.toolUseId, extra={"tool": self.toolName})
+                            
+                            # The toolUse payload is already complete, so lookups
+                            # can start now; mutating tools wait for contentEnd
+                            if self.speculative_tools and self.toolName in NovaSonicToolProcessor.READ_ONLY_TOOLS:
+                                self.speculative_tasks[self.toolUseId] = self._start_tool(self.toolName, self.toolUseContent)
+
+                        # Track the assistant audio content a barge-in would flush
+                        elif event_name == 'contentStart' and json_data['event'][event_name].get('type') == 'AUDIO':
+                            self.assistant_content_id = json_data['event'][event_name].get('contentId')
+                            self.audio_flushed = False
+                        elif event_name == 'contentEnd' and json_data['event'][event_name].get('type') == 'AUDIO':
+                            self.assistant_content_id = None
+                            self.audio_flushed = False
+                            # A stream that completed a reply is healthy again
+                            self.renewal_attempts = 0
+
+                        # Nova Sonic transcribes the user's speech once it detects
+                        # the end of the turn, the closest cheap signal without a VAD
+                        elif event_name == 'contentStart' and json_data['event'][event_name].get('role') == 'USER':
+                            self.user_transcript_id = json_data['event'][event_name].get('contentId')
+                        elif event_name == 'contentEnd' and self.user_transcript_id is not None and \
+                                json_data['event'][event_name].get('contentId') == self.user_transcript_id:
+                            self.user_transcript_id = None
+                            if self.vad is None:
+                                self._mark_speech_end()
 
                         # Process tool use when content ends
                         elif event_name == 'contentEnd' and json_data['event'][event_name].get('type') == 'TOOL':
                             prompt_name = json_data['event']['contentEnd'].get("promptName")
-                            debug_print("Processing tool use and sending result")
-                            toolResult = await self.processToolUse(self.toolName, self.toolUseContent)
-                                
-                            # Send tool start event
-                            toolContent = str(uuid.uuid4())
-                            tool_start_event = S2sEvent.content_start_tool(prompt_name, toolContent, self.toolUseId)
-                            await self.send_raw_event(tool_start_event)
-                            
-                            # Send tool result event
-                            if isinstance(toolResult, dict):
-                                content_json_string = json.dumps(toolResult)
-                            else:
-                                content_json_string = toolResult
-
-                            tool_result_event = S2sEvent.text_input_tool(prompt_name, toolContent, content_json_string)
-                            print("Tool result", tool_result_event)
-                            await self.send_raw_event(tool_result_event)
-
-                            # Send tool content end event
-                            tool_content_end_event = S2sEvent.content_end(prompt_name, toolContent)
-                            await self.send_raw_event(tool_content_end_event)
-                            print("🔄 Tool execution completed, waiting for Nova's response...")
+                            self.log.debug("Dispatching tool use", extra={"tool": self.toolName})
+                            # Run the tool in the background so this loop keeps
+                            # reading Bedrock output while the tool does its I/O
+                            self._dispatch_tool(prompt_name, self.toolName, self.toolUseContent, self.toolUseId)
                     
                     # Forward all events to the frontend (frontend handles display logic)
-                    await self.output_queue.put(json_data)
-                    print(f"📤 Event sent to frontend: {event_name}")
-                    
-                    # Log specific events for debugging
-                    if event_name == 'textOutput':
-                        print(f"📝 Text output received: {json_data['event']['textOutput'].get('content', '')[:100]}...")
-                    elif event_name == 'audioOutput':
-                        print(f"🔊 Audio output received: {len(json_data['event']['audioOutput'].get('content', ''))} bytes")
+                    await self.output_queue.put((event_name, json_data))
+                    self.log.debug("📤 Event sent to frontend", extra={"event": event_name})
                     
                     # Reset processing flag for certain events that indicate completion
                     # Don't reset for contentEnd of type TOOL, as Nova needs to continue processing
                     if event_name == 'contentEnd' and json_data['event'][event_name].get('type') == 'TOOL':
-                        print(f"🔄 Tool content ended, but keeping processing active for Nova's response")
+                        self.log.debug("🔄 Tool content ended, keeping processing active for Nova's response")
                     elif event_name in ['contentEnd', 'audioOutput', 'textOutput']:
                         self.is_processing_response = False
-                        #print(f"🔄 Response processing completed for: {event_name}")
-                        
-                        # If we get a textOutput, consider it a valid response even if speculative
-                        #if event_name == 'textOutput':
-                        #    print(f"📝 Text output received, marking response as complete")
-                        #    print(f"✅ Ready for next audio input")
-                        
-                        # If we get contentEnd, it means the current prompt is complete
-                        #if event_name == 'contentEnd':
-                        #    print(f"📋 Content ended, ready for new prompt")
-                        
-                        # If we get audioOutput, it means Nova finished speaking
-                        #if event_name == 'audioOutput':
-                        #    print(f"🔊 Audio output completed, ready for next input")
+                        # The assistant finished speaking: the next end of speech starts a new turn
+                        if event_name == 'contentEnd' and json_data['event'][event_name].get('type') == 'AUDIO':
+                            self.reply_started = False
 
 
             except json.JSONDecodeError as ex:
-                print(f"JSON decode error: {ex}")
+                self.log.warning("JSON decode error: %s", ex)
+                end_reason = "json_decode"
+                BEDROCK_ERRORS.labels(end_reason).inc()
                 continue
+            except QueueOverflowError as ex:
+                # The frontend isn't draining its events, disconnect it
+                self.log.warning("Slow client detected: %s", ex)
+                end_reason = "slow_client"
+                BEDROCK_ERRORS.labels(end_reason).inc()
+                break
             except StopAsyncIteration as ex:
                 # Stream has ended
-                print(f"Stream ended: {ex}")
+                self.log.info("Stream ended: %s", ex)
+                end_reason = "stream_ended"
+                BEDROCK_ERRORS.labels(end_reason).inc()
                 break
             except Exception as e:
-                # Handle specific AWS CRT errors and connection issues
-                error_str = str(e)
+                # Categorized from the SDK exception type (see bedrock_errors.py)
+                end_reason = classify_error(e)
+                BEDROCK_ERRORS.labels(end_reason).inc()
                 consecutive_errors += 1
-                
-                if any(keyword in error_str for keyword in ["CANCELLED", "AWS_ERROR_UNKNOWN", "InvalidStateError", "Future", "cancelled"]):
-                    print(f"AWS CRT error (connection closed or cancelled): {e}")
+
+                if end_reason == "connection_closed":
                     # This is normal when ending session, don't treat as error
+                    self.log.info("Bedrock stream closed: %s", e)
                     break
-                elif "Checksum mismatch" in error_str:
-                    print(f"Checksum mismatch error (data corruption): {e}")
-                    if consecutive_errors >= max_consecutive_errors:
-                        print(f"Too many consecutive errors ({consecutive_errors}), breaking connection")
-                        break
-                    print("This is usually a temporary network issue. Continuing...")
-                    continue  # Try to continue instead of breaking
-                elif "ValidationException" in error_str:
-                    error_message = str(e)
-                    print(f"Validation error: {error_message}")
-                    break
-                elif any(keyword in error_str.lower() for keyword in ["unexpected error during processing", "internal server error", "service unavailable", "throttling"]):
-                    print(f"AWS Bedrock service error: {e}")
-                    if consecutive_errors >= max_consecutive_errors:
-                        print(f"Too many consecutive errors ({consecutive_errors}), breaking connection")
-                        break
-                    print(f"This is an AWS service error. Waiting {retry_delay}s before retrying...")
-                    await asyncio.sleep(retry_delay)
-                    retry_delay = min(retry_delay * 2, 3.0)  # Exponential backoff, max 3s (user-friendly)
-                    continue  # Try to continue for AWS service errors
-                elif "StopAsyncIteration" in error_str or "stream ended" in error_str.lower():
-                    print(f"Stream ended normally: {e}")
-                    break
-                else:
-                    print(f"Error receiving response: {e}")
-                    if consecutive_errors >= max_consecutive_errors:
-                        print(f"Too many consecutive errors ({consecutive_errors}), breaking connection")
-                        break
-                    print("This may cause Audio Input to continue without response. Continuing...")
-                    continue  # Try to continue for other errors
+                if end_reason in ("checksum", "other") and consecutive_errors < max_consecutive_errors:
+                    # A corrupted or unexpected message, the stream itself may still be fine
+                    self.log.warning("Error receiving response (%s): %s. Continuing...", end_reason, e)
+                    continue
+                if end_reason in BEDROCK_FAILURE_CATEGORIES:
+                    self.client_pool.breaker.record_failure(end_reason)
+                # The stream is over after a service error; retries happen by
+                # renewing it, within the process-wide retry budget
+                self.log.warning("Bedrock stream failed (%s): %s", end_reason, e)
+                break
 
+        return end_reason
+
+    async def _process_responses(self):
+        """Read Bedrock output for the whole session, renewing the stream when it fails."""
+        while True:
+            end_reason = await self._read_responses()
+            if not self._should_renew(end_reason) or not await self._renew_stream(end_reason):
+                break
         self.is_active = False
-        print("Response processing loop ended")
+        self.log.info("Response processing loop ended")
         await self.close()
 
+    def _start_tool(self, tool_name, tool_use_content):
+        """Start a tracked tool invocation task."""
+        task = asyncio.create_task(self._run_tool(tool_name, tool_use_content))
+        self.tool_tasks.add(task)
+        task.add_done_callback(self.tool_tasks.discard)
+        return task
+
+    def _dispatch_tool(self, prompt_name, tool_name, tool_use_content, tool_use_id):
+        """Queue a tool result for the ordered sender, reusing a speculative run."""
+        task = self.speculative_tasks.pop(tool_use_id, None)
+        if task is None:
+            task = self._start_tool(tool_name, tool_use_content)
+        else:
+            self.log.debug("Using speculative result, ID: %s", tool_use_id, extra={"tool": tool_name})
+        task = asyncio.create_task(self._record_tool_result(tool_name, task))
+        for tracked in (self.tool_tasks, self.dispatched_tools):
+            tracked.add(task)
+            task.add_done_callback(tracked.discard)
+        self.tool_results.put_nowait((prompt_name, tool_use_id, task, self.stream_generation))
+        return task
+
+    async def _record_tool_result(self, tool_name, task):
+        """Await a tool call and keep its result for a renewal to replay."""
+        result = await task
+        if self.stream_renewal:
+            self.conversation.tool_result(tool_name, result if isinstance(result, str) else json.dumps(result))
+        return result
+
+    async def _run_tool(self, tool_name, tool_use_content):
+        """Run a tool with its configured timeout."""
+        timeout = TOOL_TIMEOUTS.get(tool_name, TOOL_TIMEOUT)
+        started = time.monotonic()
+        if self.recorder:
+            self.recorder.tool_call(tool_name, tool_use_content)
+        try:
+            result = await asyncio.wait_for(self.processToolUse(tool_name, tool_use_content), timeout=timeout)
+            outcome = "error" if isinstance(result.get("result"), dict) and "error" in result["result"] else "ok"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            self.log.warning("Tool timed out after %ss", timeout, extra={"tool": tool_name})
+            result = {"result": {"error": f"La operación {tool_name} tardó demasiado, intentá de nuevo en unos segundos"}}
+        elapsed = time.monotonic() - started
+        TOOL_SECONDS.labels(tool_name, outcome).observe(elapsed)
+        if self.recorder:
+            self.recorder.tool_result(tool_name, tool_use_content, outcome, elapsed, result)
+        return result
+
+    async def _send_tool_results(self):
+        """Send tool results to Bedrock in the order the tools were invoked."""
+        while True:
+            prompt_name, tool_use_id, task, generation = await self.tool_results.get()
+            try:
+                toolResult = await task
+            except asyncio.CancelledError:
+                if not self.is_active:
+                    raise
+                continue
+            except Exception as e:
+                self.log.error("Error running tool: %s", e)
+                toolResult = {"result": "An error occurred while attempting to retrieve information related to the toolUse event."}
+            if generation != self.stream_generation:
+                # The toolUse came from a stream that was since replaced; the
+                # result went into the replayed conversation instead
+                self.log.info("Tool result replayed into the renewed stream, ID: %s", tool_use_id)
+                continue
+
+            # Send tool start event
+            toolContent = str(uuid.uuid4())
+            tool_start_event = S2sEvent.content_start_tool(prompt_name, toolContent, tool_use_id)
+            await self.send_raw_event(tool_start_event)
+            
+            # Send tool result event
+            if isinstance(toolResult, dict):
+                content_json_string = json.dumps(toolResult)
+            else:
+                content_json_string = toolResult
+
+            tool_result_event = S2sEvent.text_input_tool(prompt_name, toolContent, content_json_string)
+            self.log.debug("Tool result: %s", content_json_string, extra={"event": "toolResult"})
+            await self.send_raw_event(tool_result_event)
+
+            # Send tool content end event
+            tool_content_end_event = S2sEvent.content_end(prompt_name, toolContent)
+            await self.send_raw_event(tool_content_end_event)
+            self.log.info("🔄 Tool execution completed, waiting for Nova's response...")
+
     async def processToolUse(self, toolName, toolUseContent):
         """Return the tool result using Carlos's tool processor"""
-        #print(f"Tool Use Content: {toolUseContent}")
 
         try:
             # Extract the tool content
@@ -374,51 +768,221 @@ class S2sSessionManager:
 
             return {"result": result}
         except Exception as ex:
-            print(f"Error in processToolUse: {ex}")
+            self.log.error("Error in processToolUse: %s", ex, extra={"tool": toolName})
             return {"result": "An error occurred while attempting to retrieve information related to the toolUse event."}
     
+    def _should_renew(self, end_reason):
+        return (self.stream_renewal and self.is_active and not self.is_closed and not self.session_ending
+                and end_reason not in _NOT_RENEWABLE)
+
+    async def _stop_writer(self):
+        if self.writer_task and not self.writer_task.done():
+            self.writer_task.cancel()
+            try:
+                await self.writer_task
+            except asyncio.CancelledError:
+                pass
+        if self.input_writer:
+            self.input_writer.close()
+
+    async def _renew_stream(self, reason):
+        """Replace the failed Bedrock stream and replay the conversation into it.
+
+        Runs in the response task. Audio and client events wait meanwhile;
+        returns False when no new stream could be set up within the attempts.
+        Streams lost to Bedrock failures (BEDROCK_FAILURE_CATEGORIES) are only
+        retried within the pool's retry budget, and no attempt is made while
+        its circuit is open.
+        """
+        started = time.monotonic()
+        if self.stream_opened_at and started - self.stream_opened_at > _RENEWAL_RESET_SECONDS:
+            self.renewal_attempts = 0
+        self.stream_ready.clear()
+        await self._stop_writer()
+        old_stream, self.stream = self.stream, None
+        if old_stream:
+            try:
+                await self.client_pool.release_stream(old_stream)
+            except Exception as e:
+                self.log.debug("Error closing the failed stream: %s", e)
+
+        # Tool calls of the old stream finish first (within their timeouts) so
+        # their results are part of the replayed conversation
+        if self.dispatched_tools:
+            await asyncio.wait(set(self.dispatched_tools))
+
+        # Output state and tool calls of the old stream don't carry over
+        self.stream_generation += 1
+        self.toolUseContent = ""
+        self.toolUseId = ""
+        self.toolName = ""
+        self.speculative_tasks.clear()
+        self.assistant_content_id = None
+        self.audio_flushed = False
+        self.is_processing_response = False
+        self.first_output_pending = set()
+        self.reply_started = False
+        self.user_transcript_id = None
+
+        outcome = "failed"
+        while self.renewal_attempts < STREAM_RENEWAL_ATTEMPTS and self.is_active:
+            if reason in BEDROCK_FAILURE_CATEGORIES and not self.client_pool.retry_budget.try_acquire():
+                self.log.warning("Bedrock retry budget spent, not renewing the stream (%s)", reason)
+                outcome = "no_budget"
+                break
+            self.renewal_attempts += 1
+            if self.renewal_attempts > 1:
+                # Jittered, so sessions failing together don't retry together
+                await asyncio.sleep(random.uniform(0.5, 1.0) * 2 ** (self.renewal_attempts - 2))
+            self.log.warning("Bedrock stream lost (%s), renewing it (attempt %d/%d)", reason,
+                             self.renewal_attempts, STREAM_RENEWAL_ATTEMPTS)
+            try:
+                self.stream = await self.client_pool.claim_stream()
+                self.stream_opened_at = time.monotonic()
+                self.input_writer = BedrockInputWriter(self.stream.input_stream)
+                self.writer_task = asyncio.create_task(self.input_writer.run())
+                for event in self.conversation.replay_events():
+                    payload = json.dumps(event)
+                    if self.recorder:
+                        self.recorder.bedrock_input(payload)
+                    if not await self.input_writer.submit(payload.encode("utf-8"), ORDERED_LANE):
+                        raise ConnectionError("The new stream closed during the replay")
+            except CircuitOpenError as e:
+                self.log.warning("Not renewing the Bedrock stream: %s", e)
+                outcome = "circuit_open"
+                break
+            except Exception as e:
+                self.log.warning("Couldn't renew the Bedrock stream: %s", e)
+                reason = classify_error(e)
+                await self._stop_writer()
+                if self.stream:
+                    old_stream, self.stream = self.stream, None
+                    try:
+                        await self.client_pool.release_stream(old_stream)
+                    except Exception:
+                        pass
+                if reason in _NOT_RENEWABLE:
+                    break
+                continue
+
+            self.last_response_time = time.time()
+            self.last_audio_sent_time = time.time()
+            self.stream_ready.set()
+            STREAM_RENEWALS.labels("renewed").inc()
+            STREAM_RENEWAL_SECONDS.observe(time.monotonic() - started)
+            self.log.info("Bedrock stream renewed in %.0fms, %d turns replayed", (time.monotonic() - started) * 1000,
+                          len(self.conversation.history))
+            # Let the client know: an assistant reply cut by the failure won't get its contentEnd
+            try:
+                self.output_queue.put_nowait(("streamRenewed", {"event": {"streamRenewed": {
+                    "reason": reason, "attempt": self.renewal_attempts}}}))
+            except QueueOverflowError:
+                pass
+            return True
+
+        if not self.is_active:
+            # The session ended while waiting for a stream
+            return False
+        STREAM_RENEWALS.labels(outcome).inc()
+        self.log.error("Giving up on the Bedrock stream after %d renewal attempts (%s)", self.renewal_attempts, outcome)
+        return False
+
+    def barge_in(self, source):
+        """Drop the assistant audio still queued for the client and tell it to stop playing.
+
+        source is "bedrock" (Nova Sonic's interruption signal) or "vad".
+        """
+        if self.audio_flushed:
+            return
+        dropped = self.output_queue.discard(is_audio_output)
+        if self.assistant_content_id is None and not dropped:
+            # Nothing of the assistant is playing or about to
+            return
+        self.audio_flushed = True
+        # The caller took the turn back: time the next reply from their speech
+        self.reply_started = False
+        self.barge_in_started = (time.monotonic(), source)
+        BARGE_IN_DROPPED.inc(dropped)
+        self.output_queue.put_nowait(("audioFlush", {"event": {"audioFlush": {
+            "contentId": self.assistant_content_id,
+            "source": source,
+            "droppedChunks": dropped,
+        }}}))
+        self.log.info("Barge-in detected by %s, dropped %d queued audio chunks", source, dropped,
+                      extra={"event": "audioFlush"})
+
+    def record_client_event(self, message):
+        """Record a non-audio event as received from the client."""
+        if self.recorder:
+            self.recorder.client_event(message)
+
+    async def end_session(self):
+        """End the conversation with Bedrock (contentEnd, promptEnd, sessionEnd).
+
+        Used when the server shuts down with the caller still connected; the
+        stream is released later by close().
+        """
+        if not self.is_active:
+            return
+        if self.prompt_name:
+            if self.audio_content_name:
+                await self.flush_audio_input()
+                await self.send_raw_event({"event": {"contentEnd": {
+                    "promptName": self.prompt_name, "contentName": self.audio_content_name}}})
+            await self.send_raw_event({"event": {"promptEnd": {"promptName": self.prompt_name}}})
+        await self.send_raw_event({"event": {"sessionEnd": {}}})
+
     async def close(self):
         """Close the stream properly."""
-        if not self.is_active:
+        # is_active is already False when the stream ended on its own or after
+        # sessionEnd, so track closing separately to still release everything
+        if self.is_closed:
             return
             
+        self.is_closed = True
         self.is_active = False
+        # Release sends waiting on a renewal that won't finish
+        self.stream_ready.set()
         
-        # Cancel all pending tasks
-        if self.response_task and not self.response_task.done():
-            self.response_task.cancel()
-            try:
-                await self.response_task
-            except asyncio.CancelledError:
-                pass
-            except Exception as e:
-                print(f"Error waiting for response task: {e}")
+        # Cancel all pending tasks, in-flight tools included (close() may run
+        # inside the response task)
+        for task in (self.response_task, self.audio_task, self.tool_sender_task, self.writer_task, *self.tool_tasks):
+            if task and not task.done() and task is not asyncio.current_task():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                except Exception as e:
+                    self.log.warning("Error waiting for session task: %s", e)
+        
+        # Release whoever still waits on an event the writer won't send
+        if self.input_writer:
+            self.input_writer.close()
         
         # Close stream if it exists
         if self.stream:
             try:
-                await self.stream.input_stream.close()
+                await self.client_pool.release_stream(self.stream)
             except Exception as e:
-                print(f"Error closing stream: {e}")
+                self.log.warning("Error closing stream: %s", e)
         
         # Clear queues safely
         try:
-            while not self.audio_input_queue.empty():
-                try:
-                    self.audio_input_queue.get_nowait()
-                except:
-                    pass
+            self.audio_input_queue.clear()
         except Exception as e:
-            print(f"Error clearing audio queue: {e}")
+            self.log.warning("Error clearing audio queue: %s", e)
             
         try:
-            while not self.output_queue.empty():
-                try:
-                    self.output_queue.get_nowait()
-                except:
-                    pass
+            self.output_queue.clear()
         except Exception as e:
-            print(f"Error clearing output queue: {e}")
+            self.log.warning("Error clearing output queue: %s", e)
+        
+        # Tell the forwarding task the session is over so it closes the WebSocket
+        self.output_queue.put_nowait((None, None))
+        
+        if self.recorder:
+            self.recorder.close()
         
         # Reset state
         self.stream = None
@@ -426,5 +990,13 @@ class S2sSessionManager:
         self.toolUseContent = ""
         self.toolUseId = ""
         self.toolName = ""
+        self.speculative_tasks.clear()
         self.last_response_time = time.time()
-        self.last_audio_sent_time = time.time() 
\ No newline at end of file
+        self.last_audio_sent_time = time.time()
+
+    def queue_stats(self):
+        """Return size and high-water-mark counters for the session queues."""
+        return {
+            "audio_input": self.audio_input_queue.stats(),
+            "output": self.output_queue.stats(),
+        } 
\ No newline at end of file
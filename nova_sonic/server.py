@@ -4,58 +4,219 @@ import json
 import logging
 import warnings
 from s2s_session_manager import S2sSessionManager
+from session_queues import QueueOverflowError
+from s2s_codec import BINARY_AUDIO_SUBPROTOCOL, AudioFrameError, parse_audio_frame, select_subprotocol
+from supervisor import WorkerSupervisor, publish_worker_status
+from admin_server import AdminServer, LoopLagMonitor, json_response
+from admission import AdmissionController, AdmissionRejected
+from bedrock_pool import STREAM_BACKEND, get_client_pool
+from bedrock_errors import classify_error
+from circuit_breaker import STATE_VALUES, CircuitOpenError
+from voice_activity import VAD_MODE, VAD_MODES
+from dynamo_async import get_dynamodb
+from tool_processor import ORDERS_TABLE, APPOINTMENTS_TABLE
+from lookup_cache import get_lookup_cache
+from logging_config import LOGLEVEL, configure_logging, stop_logging
+import metrics
 import argparse
-import http.server
-import threading
 import os
+import signal
+import time
 from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
 
-# Configure logging
-LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
-logging.basicConfig(level=LOGLEVEL, format="%(asctime)s %(message)s")
+# Logging is configured in configure_logging() (see logging_config.py)
 logger = logging.getLogger(__name__)
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
-DEBUG = False
+# Session managers currently serving a WebSocket in this process
+active_sessions = set()
 
-def debug_print(message):
-    """Print only if debug mode is enabled"""
-    if DEBUG:
-        print(message)
+# In --workers mode each worker serves /metrics (and /health) on
+# WORKER_METRICS_PORT + its index; unset disables per-worker endpoints
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+# Computed when /metrics is scraped, off the event loop's hot path
+metrics.ACTIVE_SESSIONS.set_function(lambda: len(active_sessions))
+metrics.QUEUE_DEPTH.labels("audio_input").set_function(
+    lambda: sum(session.audio_input_queue.qsize() for session in list(active_sessions)))
+metrics.QUEUE_DEPTH.labels("output").set_function(
+    lambda: sum(session.output_queue.qsize() for session in list(active_sessions)))
+
+# Worst recent event loop lag (seconds) before the process asks for no new calls
+READY_MAX_LOOP_LAG = float(os.getenv("READY_MAX_LOOP_LAG", "0.5"))
+
+loop_monitor = LoopLagMonitor()
+
+def get_aws_region():
+    return os.getenv("AWS_DEFAULT_REGION") or "us-east-1"
+
+# Session and Bedrock stream limits applied to new connections (see admission.py)
+admission = AdmissionController(
+    streams_in_use=lambda: get_client_pool(get_aws_region()).streams_in_use,
+    loop_lag=lambda: loop_monitor.lag,
+    bedrock_retry_after=lambda: get_client_pool(get_aws_region()).breaker.retry_after(),
+)
+
+metrics.BEDROCK_CIRCUIT_STATE.set_function(lambda: STATE_VALUES[get_client_pool(get_aws_region()).breaker.state])
+metrics.BEDROCK_RETRY_BUDGET_TOKENS.set_function(lambda: get_client_pool(get_aws_region()).retry_budget.tokens)
+
+# On SIGTERM, how long active calls get to finish before they are ended
+# (keep it below the ECS stopTimeout) and how often drain progress is logged
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "90"))
+DRAIN_REPORT_INTERVAL = 5.0
+# Time for ended sessions to close their WebSockets after the deadline
+_DRAIN_CLOSE_TIMEOUT = 5.0
+
+# Set once the WebSocket server is listening, cleared when draining
+accepting_sessions = False
+drain_deadline = None
+
+def readiness():
+    """Return (ready, reasons): whether this process should get new calls"""
+    reasons = []
+    if not accepting_sessions and not admission.draining:
+        reasons.append("not_accepting")
+    if loop_monitor.lag > READY_MAX_LOOP_LAG:
+        reasons.append("loop_lag")
+    # Loop lag is covered above, with a lower threshold than load shedding,
+    # and Bedrock's circuit below; a draining process reports "draining" here
+    capacity = admission.rejection_reason()
+    if capacity and capacity not in ("overloaded", "bedrock_unavailable"):
+        reasons.append(capacity)
+    if get_client_pool(get_aws_region()).is_failing():
+        reasons.append("bedrock_unavailable")
+    return not reasons, reasons
+
+def local_health():
+    """Health check payload of this process' own server"""
+    ready, reasons = readiness()
+    return {
+        "status": "draining" if admission.draining else "healthy",
+        "ready": ready,
+        "reasons": reasons,
+        "loop_lag": round(loop_monitor.lag, 4),
+        "active_sessions": len(active_sessions),
+        "drain_remaining": round(max(0.0, drain_deadline - time.monotonic()), 1) if drain_deadline else None,
+        "admission": admission.stats(),
+        "bedrock_pool": get_client_pool(get_aws_region()).stats(),
+        "lookup_cache": get_lookup_cache().stats(),
+    }
+
+def render_metrics():
+    return HTTPStatus.OK, metrics.CONTENT_TYPE, metrics.REGISTRY.render().encode("utf-8")
+
+def local_routes():
+    """Admin endpoints of a process serving WebSocket sessions"""
+    def ready():
+        ok, reasons = readiness()
+        return json_response({"ready": ok, "reasons": reasons}, ok)
+
+    health = lambda: json_response(local_health())
+    return {
+        # Answered from the event loop, so a wedged loop fails the probe
+        "/live": lambda: json_response({"status": "alive"}),
+        "/ready": ready,
+        "/health": health,
+        "/": health,
+        "/metrics": render_metrics,
+    }
+
+def supervisor_routes(supervisor):
+    """Admin endpoints of the supervisor, aggregated over its workers"""
+    def health():
+        payload = supervisor.health()
+        return json_response(payload, payload["status"] != "unhealthy")
+
+    return {
+        "/live": lambda: json_response({"status": "alive"}),
+        "/ready": lambda: json_response({"ready": supervisor.ready()}, supervisor.ready()),
+        "/health": health,
+        "/": health,
+    }
+
+async def reject_session(websocket, rejection):
+    """Tell the client why its session didn't start and close with 1013 (try again later)."""
+    try:
+        await websocket.send(json.dumps({"event": {"sessionRejected": {
+            "reason": rejection.reason,
+            "retryAfterMs": int(rejection.retry_after * 1000),
+            "message": "El servicio está ocupado, intentá de nuevo en unos segundos",
+        }}}))
+        await websocket.close(code=1013, reason="Try again later")
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+def session_vad_mode(websocket):
+    """VAD mode of this session: the ?vad= query parameter, else VAD_MODE."""
+    request = getattr(websocket, "request", None)
+    values = parse_qs(urlsplit(request.path).query).get("vad") if request else None
+    if not values:
+        return VAD_MODE
+    if values[0].lower() not in VAD_MODES:
+        logger.warning("Ignoring unknown VAD mode %r from the client", values[0])
+        return VAD_MODE
+    return values[0]
 
 async def websocket_handler(websocket):
-    aws_region = os.getenv("AWS_DEFAULT_REGION")
-    if not aws_region:
-        aws_region = "us-east-1"
+    aws_region = get_aws_region()
+
+    # Turn the connection away before it costs a Bedrock stream
+    try:
+        await admission.acquire()
+    except AdmissionRejected as e:
+        logger.warning("Rejecting new session: %s", e.reason)
+        await reject_session(websocket, e)
+        return
 
     stream_manager = None
     forward_task = None
+    # Clients that negotiated the binary audio subprotocol send microphone
+    # audio as binary frames instead of base64 audioInput JSON events
+    binary_audio = websocket.subprotocol == BINARY_AUDIO_SUBPROTOCOL
     try:
         async for message in websocket:
             try:
+                if isinstance(message, bytes):
+                    if not binary_audio or stream_manager is None:
+                        logger.debug("Binary frame received outside of a binary audio session, ignoring")
+                        continue
+                    prompt_name, content_name, pcm = parse_audio_frame(message)
+                    await stream_manager.add_audio_chunk(prompt_name, content_name, pcm)
+                    continue
+
                 data = json.loads(message)
                 if 'body' in data:
                     data = json.loads(data["body"])
                 if 'event' in data:
+                    event_type = next(iter(data['event']), None)
                     if stream_manager == None:
 
                         """Handle WebSocket connections from the frontend."""
                         # Create a new stream manager for this connection
-                        stream_manager = S2sSessionManager(model_id='amazon.nova-sonic-v1:0', region=aws_region)
+                        stream_manager = S2sSessionManager(model_id='amazon.nova-sonic-v1:0', region=aws_region,
+                                                           client_pool=get_client_pool(aws_region),
+                                                           vad_mode=session_vad_mode(websocket))
+                        active_sessions.add(stream_manager)
                         
                         # Initialize the Bedrock stream
-                        await stream_manager.initialize_stream()
+                        try:
+                            await stream_manager.initialize_stream()
+                        except Exception as e:
+                            # Bedrock is failing, the client can retry when the circuit half-opens
+                            if not isinstance(e, CircuitOpenError):
+                                e = AdmissionRejected(classify_error(e), retry_after=1.0)
+                            logger.warning("Rejecting new session: %s", e.reason)
+                            await reject_session(websocket, e)
+                            break
                         
                         # Start a task to forward responses from Bedrock to the WebSocket
                         forward_task = asyncio.create_task(forward_responses(websocket, stream_manager))
 
-                        event_type = list(data['event'].keys())[0]
-                        if event_type == "audioInput":
-                            debug_print(message[0:180])
-                        else:
-                            debug_print(message)
+                    if event_type != "audioInput":
+                        logger.debug("Event from frontend: %s", message, extra={"event": event_type})
                             
                     if event_type:
                         # Store prompt name and content names if provided
@@ -63,6 +224,9 @@ async def websocket_handler(websocket):
                             stream_manager.prompt_name = data['event']['promptStart']['promptName']
                         elif event_type == 'contentStart' and data['event']['contentStart'].get('type') == 'AUDIO':
                             stream_manager.audio_content_name = data['event']['contentStart']['contentName']
+                        elif event_type == 'contentEnd' and data['event']['contentEnd'].get('contentName') == stream_manager.audio_content_name:
+                            # Audio still buffered for a frame must reach Bedrock before the content ends
+                            await stream_manager.flush_audio_input()
                         
                         # Handle audio input separately
                         if event_type == 'audioInput':
@@ -72,19 +236,23 @@ async def websocket_handler(websocket):
                             audio_base64 = data['event']['audioInput']['content']
                             
                             # Add to the audio queue
-                            stream_manager.add_audio_chunk(prompt_name, content_name, audio_base64)
+                            await stream_manager.add_audio_chunk(prompt_name, content_name, audio_base64)
                         else:
                             # Send other events directly to Bedrock
+                            stream_manager.record_client_event(message)
                             await stream_manager.send_raw_event(data)
+            except AudioFrameError as e:
+                logger.warning("Invalid binary audio frame received from WebSocket: %s", e)
+            except QueueOverflowError as e:
+                # Bedrock isn't keeping up with this caller's audio
+                logger.warning("Audio queue overflow, disconnecting client: %s", e)
+                break
             except json.JSONDecodeError:
-                print("Invalid JSON received from WebSocket")
+                logger.warning("Invalid JSON received from WebSocket")
             except Exception as e:
-                print(f"Error processing WebSocket message: {e}")
-                if DEBUG:
-                    import traceback
-                    traceback.print_exc()
+                logger.error("Error processing WebSocket message: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
     except websockets.exceptions.ConnectionClosed:
-        print("WebSocket connection closed")
+        logger.info("WebSocket connection closed")
     finally:
         # Clean up tasks and connections
         if forward_task and not forward_task.done():
@@ -95,10 +263,13 @@ async def websocket_handler(websocket):
                 pass
         
         if stream_manager:
+            active_sessions.discard(stream_manager)
             await stream_manager.close()
         
         if websocket:
-            websocket.close()
+            await websocket.close()
+        
+        admission.release()
 
 
 async def forward_responses(websocket, stream_manager):
@@ -107,124 +278,174 @@ async def forward_responses(websocket, stream_manager):
         while True:
             # Get next response from the output queue
             try:
-                response = await stream_manager.output_queue.get()
+                event_name, response = await stream_manager.output_queue.get()
             except asyncio.CancelledError:
                 break
             
-            # Send to WebSocket
+            # The session closed (Bedrock stream ended or a queue overflowed)
+            if event_name is None:
+                break
+            
+            # Send to WebSocket; pass-through events are already serialized
             try:
-                event = json.dumps(response)
-                await websocket.send(event)
+                if isinstance(response, bytes):
+                    await websocket.send(response, text=True)
+                else:
+                    await websocket.send(json.dumps(response))
+                if event_name == "audioFlush" and stream_manager.barge_in_started:
+                    started, source = stream_manager.barge_in_started
+                    stream_manager.barge_in_started = None
+                    metrics.BARGE_IN_SECONDS.labels(source).observe(time.monotonic() - started)
             except websockets.exceptions.ConnectionClosed:
                 break
             except Exception as e:
-                print(f"Error sending to WebSocket: {e}")
+                logger.warning("Error sending to WebSocket: %s", e)
                 break
     except asyncio.CancelledError:
         # Task was cancelled
         pass
     except Exception as e:
-        print(f"Error forwarding responses: {e}")
+        logger.error("Error forwarding responses: %s", e)
     finally:
         # Ensure cleanup
         try:
-            if websocket and not websocket.closed:
-                websocket.close()
+            if websocket:
+                await websocket.close()
         except:
             pass
 
 
-class HealthCheckHandler(http.server.BaseHTTPRequestHandler):
-    def do_GET(self):
-        client_ip = self.client_address[0]
-        logger.info(
-            f"Health check request received from {client_ip} for path: {self.path}"
-        )
-
-        if self.path == "/health" or self.path == "/":
-            logger.info(f"Responding with 200 OK to health check from {client_ip}")
-            self.send_response(HTTPStatus.OK)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            response = json.dumps({"status": "healthy"})
-            self.wfile.write(response.encode("utf-8"))
-            logger.info(f"Health check response sent: {response}")
-        else:
-            logger.info(
-                f"Responding with 404 Not Found to request for {self.path} from {client_ip}"
-            )
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.end_headers()
-
-    def log_message(self, format, *args):
-        # Override to use our logger instead
-        pass
+async def drain(server, timeout=DRAIN_TIMEOUT):
+    """Stop taking calls and let active sessions finish, up to timeout seconds.
 
+    Sessions still running at the deadline are ended with sessionEnd and
+    their WebSockets closed with 1001 (going away).
+    """
+    global accepting_sessions, drain_deadline
+    accepting_sessions = False
+    admission.start_draining()
+    # Stop listening, open connections stay up
+    server.close(close_connections=False)
 
-def start_health_check_server(health_host, health_port):
-    """Start the HTTP health check server on port 80."""
-    try:
-        # Create the server with a socket timeout to prevent hanging
-        httpd = http.server.HTTPServer((health_host, health_port), HealthCheckHandler)
-        httpd.timeout = 5  # 5 second timeout
-
-        logger.info(f"Starting health check server on {health_host}:{health_port}")
-
-        # Run the server in a separate thread
-        thread = threading.Thread(target=httpd.serve_forever)
-        thread.daemon = (
-            True  # This ensures the thread will exit when the main program exits
-        )
-        thread.start()
-
-        # Verify the server is running
-        logger.info(
-            f"Health check server started at http://{health_host}:{health_port}/health"
-        )
-        logger.info(f"Health check thread is alive: {thread.is_alive()}")
-
-        # Try to make a local request to verify the server is responding
-        try:
-            import urllib.request
-
-            with urllib.request.urlopen(
-                f"http://localhost:{health_port}/health", timeout=2
-            ) as response:
-                logger.info(
-                    f"Local health check test: {response.status} - {response.read().decode('utf-8')}"
-                )
-        except Exception as e:
-            logger.warning(f"Local health check test failed: {e}")
-
-    except Exception as e:
-        logger.error(f"Failed to start health check server: {e}", exc_info=True)
+    started = time.monotonic()
+    drain_deadline = started + timeout
+    next_report = started + DRAIN_REPORT_INTERVAL
+    logger.info("Draining %d active sessions (up to %.0fs)", admission.sessions, timeout)
+    while admission.sessions and time.monotonic() < drain_deadline:
+        await asyncio.sleep(0.5)
+        if time.monotonic() >= next_report:
+            next_report += DRAIN_REPORT_INTERVAL
+            logger.info("Draining: %d sessions active, %.0fs left",
+                        admission.sessions, drain_deadline - time.monotonic())
 
+    if admission.sessions:
+        logger.warning("Drain deadline reached, ending %d sessions", admission.sessions)
+        await asyncio.gather(*(session.end_session() for session in list(active_sessions)),
+                             return_exceptions=True)
+        await asyncio.gather(*(connection.close(1001, "Server shutting down")
+                               for connection in server.connections), return_exceptions=True)
+        try:
+            await asyncio.wait_for(server.wait_closed(), _DRAIN_CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("%d sessions didn't close in time", admission.sessions)
+    logger.info("Drain finished after %.1fs", time.monotonic() - started)
 
-async def main(host, port, health_port):
+async def main(host, port, health_port, reuse_port=False, worker_status=None):
+    """Main function to run the WebSocket server."""
+    global accepting_sessions
+    loop_monitor.start()
 
     if health_port:
         try:
-            start_health_check_server(host, health_port)
+            await AdminServer(host, health_port, local_routes()).start()
         except Exception as ex:
-            print("Failed to start health check endpoint",ex)
+            logger.error("Failed to start health check endpoint: %s", ex)
 
-    """Main function to run the WebSocket server."""
     try:
-        # Start WebSocket server
-        async with websockets.serve(websocket_handler, host, port):
-            print(f"WebSocket server started at host:{host}, port:{port}")
+        # Publish heartbeats and readiness to the supervisor when running as a
+        # worker (keep a reference so the task isn't garbage collected)
+        if worker_status is not None:
+            status_task = asyncio.create_task(publish_worker_status(
+                worker_status, lambda: (len(active_sessions), readiness()[0], loop_monitor.lag)))
+
+        # Build the shared Bedrock clients up front so the first call doesn't pay for it
+        client_pool = get_client_pool(get_aws_region())
+        await client_pool.start()
+
+        # Same for the DynamoDB threads used by the tools
+        try:
+            await get_dynamodb().warm_up(ORDERS_TABLE, APPOINTMENTS_TABLE)
+        except Exception as ex:
+            logger.warning("Failed to warm up DynamoDB access: %s", ex)
+        # The warm-up stalls the loop; that lag mustn't fail /ready or shed
+        # the first calls once the socket opens
+        loop_monitor.reset()
+
+        # ECS sends SIGTERM on deploys and scale-in: drain instead of dying
+        stopping = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+
+        # Start WebSocket server; workers share the port through SO_REUSEPORT
+        async with websockets.serve(websocket_handler, host, port, select_subprotocol=select_subprotocol,
+                                    reuse_port=reuse_port) as server:
+            logger.info("WebSocket server started at host:%s, port:%s", host, port)
+            accepting_sessions = True
             
-            # Keep the server running forever
-            await asyncio.Future()
+            # Serve until SIGTERM
+            await stopping.wait()
+            logger.info("SIGTERM received")
+            await drain(server)
     except Exception as ex:
-        print("Failed to start websocket service",ex)
+        logger.error("Failed to start websocket service: %s", ex)
+
+
+def run_worker(index, worker_status, host, port):
+    """Entry point of a forked worker process."""
+    # The log writer thread doesn't survive fork, start this worker's own
+    configure_logging(logging.getLogger().level)
+    metrics_port = WORKER_METRICS_PORT + index if WORKER_METRICS_PORT else None
+    try:
+        asyncio.run(main(host, port, metrics_port, reuse_port=True, worker_status=worker_status))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_logging()
+
+
+async def supervise(supervisor, host, health_port):
+    """Run the supervisor's admin server and monitor the workers until stopped."""
+    admin = None
+    if health_port:
+        # Health checks report the aggregated state of all workers
+        admin = AdminServer(host, health_port, supervisor_routes(supervisor))
+        await admin.start()
+    try:
+        await supervisor.run()
+    finally:
+        if admin is not None:
+            await admin.close()
+
+
+def run_supervisor(num_workers, host, port, health_port):
+    """Run num_workers worker processes on the same port and supervise them."""
+    # Created before forking so that every worker shares the invalidation slots
+    get_lookup_cache().enable_shared_invalidation()
+
+    # Workers drain on SIGTERM, give them the whole deadline before killing them
+    supervisor = WorkerSupervisor(num_workers, run_worker, (host, port),
+                                  stop_timeout=DRAIN_TIMEOUT + _DRAIN_CLOSE_TIMEOUT + 5)
+    logger.info("Starting %d WebSocket workers on host:%s, port:%s", num_workers, host, port)
+    asyncio.run(supervise(supervisor, host, health_port))
 
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='Nova S2S WebSocket Server')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('--workers', type=int, default=int(os.getenv("WORKERS", "1")),
+                        help='Number of worker processes sharing the WebSocket port (SO_REUSEPORT)')
     args = parser.parse_args()
+    configure_logging("DEBUG" if args.debug else LOGLEVEL)
 
     host, port, health_port = None, None, None
     host = str(os.getenv("HOST","localhost"))
@@ -236,16 +457,16 @@ if __name__ == "__main__":
     aws_secret = os.getenv("AWS_SECRET_ACCESS_KEY")
 
     if not host or not port:
-        print(f"HOST and PORT are required. Received HOST: {host}, PORT: {port}")
-    elif not aws_key_id or not aws_secret:
-        print(f"AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY are required.")
+        logger.error("HOST and PORT are required. Received HOST: %s, PORT: %s", host, port)
+    elif STREAM_BACKEND != "fake" and (not aws_key_id or not aws_secret):
+        logger.error("AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY are required.")
     else:
         try:
-            asyncio.run(main(host, port, health_port))
+            if args.workers > 1:
+                run_supervisor(args.workers, host, port, health_port)
+            else:
+                asyncio.run(main(host, port, health_port))
         except KeyboardInterrupt:
-            print("Server stopped by user")
+            logger.info("Server stopped by user")
         except Exception as e:
-            print(f"Server error: {e}")
-            if args.debug:
-                import traceback
-                traceback.print_exc() 
\ No newline at end of file
+            logger.error("Server error: %s", e, exc_info=args.debug)
@@ -0,0 +1,124 @@
+import asyncio
+from metrics import QUEUE_DROPPED
+
+# Slow-consumer policies applied when a bounded session queue is full
+DROP_OLDEST = "drop_oldest"  # Evict the oldest droppable item to make room
+COALESCE = "coalesce"        # Merge the new item into the newest queued one, else drop oldest
+BLOCK = "block"              # Make the producer wait for a free slot
+DISCONNECT = "disconnect"    # Give up on the session
+QUEUE_POLICIES = (DROP_OLDEST, COALESCE, BLOCK, DISCONNECT)
+
+
+class QueueOverflowError(Exception):
+    """Raised when a queue using the disconnect policy overflows"""
+
+    def __init__(self, queue_name, maxsize):
+        super().__init__(f"Queue '{queue_name}' exceeded its limit of {maxsize} items")
+        self.queue_name = queue_name
+        self.maxsize = maxsize
+
+
+class BoundedSessionQueue(asyncio.Queue):
+    """asyncio.Queue with a size limit and a configurable slow-consumer policy.
+
+    merge(older, newer) returns a single item replacing both, or None when the
+    two can't be combined. droppable(item) tells drop_oldest which items may be
+    evicted; when none are, the oldest item is evicted regardless.
+    """
+
+    def __init__(self, name, maxsize=0, policy=DROP_OLDEST, merge=None, droppable=None):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}', expected one of {', '.join(QUEUE_POLICIES)}")
+        super().__init__(maxsize)
+        self.name = name
+        self.policy = policy
+        self._merge = merge
+        self._droppable = droppable
+
+        self._dropped_metric = QUEUE_DROPPED.labels(name)
+
+        # Counters exposed through stats()
+        self.high_water_mark = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self.overflows = 0
+
+    def put_nowait(self, item):
+        if self.full() and self.policy != BLOCK:
+            self.overflows += 1
+            if self.policy == DISCONNECT:
+                raise QueueOverflowError(self.name, self.maxsize)
+            if self.policy == COALESCE and self._coalesce(item):
+                return
+            self._drop_oldest()
+        super().put_nowait(item)
+        size = self.qsize()
+        if size > self.high_water_mark:
+            self.high_water_mark = size
+
+    async def put(self, item):
+        if self.policy != BLOCK:
+            return self.put_nowait(item)
+        if self.full():
+            self.blocked += 1
+        return await super().put(item)
+
+    def _coalesce(self, item):
+        if not self._merge or not self._queue:
+            return False
+        merged = self._merge(self._queue[-1], item)
+        if merged is None:
+            return False
+        self._queue[-1] = merged
+        self.coalesced += 1
+        return True
+
+    def _drop_oldest(self):
+        queue = self._queue
+        if self._droppable:
+            for index, queued in enumerate(queue):
+                if self._droppable(queued):
+                    del queue[index]
+                    self.dropped += 1
+                    self._dropped_metric.inc()
+                    return
+        queue.popleft()
+        self.dropped += 1
+        self._dropped_metric.inc()
+
+    def discard(self, predicate):
+        """Remove every queued item matching predicate; returns how many went."""
+        queue = self._queue
+        kept = [item for item in queue if not predicate(item)]
+        removed = len(queue) - len(kept)
+        if removed:
+            queue.clear()
+            queue.extend(kept)
+            # Keep asyncio.Queue's bookkeeping as if the items had been consumed
+            self._unfinished_tasks -= removed
+            if self._unfinished_tasks == 0:
+                self._finished.set()
+            for _ in range(removed):
+                self._wakeup_next(self._putters)
+        return removed
+
+    def clear(self):
+        """Discard every queued item."""
+        while not self.empty():
+            try:
+                self.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+
+    def stats(self):
+        return {
+            "size": self.qsize(),
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "high_water_mark": self.high_water_mark,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "blocked": self.blocked,
+            "overflows": self.overflows,
+        }
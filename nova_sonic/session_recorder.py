@@ -0,0 +1,206 @@
+import base64
+import json
+import logging
+import os
+import random
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from s2s_codec import audio_size, peek_event_type
+
+# Directory where session recordings are written (unset = recording off)
+SESSION_RECORD_DIR = os.getenv("SESSION_RECORD_DIR", "")
+# Fraction of sessions recorded when SESSION_RECORD_DIR is set
+SESSION_RECORD_SAMPLE_RATE = float(os.getenv("SESSION_RECORD_SAMPLE_RATE", "1.0"))
+
+# Recording file layout (little endian):
+#   MAGIC, then records of  u8 kind | u64 ns since the session started | u32 length | payload
+# JSON kinds hold the event bytes as sent or received. Audio kinds hold
+#   u16 metadata length | metadata JSON | raw 16-bit LPCM
+# with the audio decoded from base64 so it isn't stored a third bigger.
+MAGIC = b"NSREC\x01"
+_RECORD_HEADER = struct.Struct("<BQI")
+_AUDIO_META_HEADER = struct.Struct("<H")
+
+SESSION_META = 0      # JSON: session id, model, wall clock start
+CLIENT_EVENT = 1      # JSON event received from the WebSocket client
+CLIENT_AUDIO = 2      # Audio: promptName, contentName
+BEDROCK_INPUT = 3     # JSON event sent to Bedrock
+BEDROCK_INPUT_AUDIO = 4  # Metadata only (promptName, contentName, bytes): the PCM is the client's
+BEDROCK_OUTPUT = 5    # JSON event received from Bedrock
+BEDROCK_OUTPUT_AUDIO = 6  # Audio: the audioOutput event without its content
+TOOL_CALL = 7         # JSON: toolName, toolUseId, content
+TOOL_RESULT = 8       # JSON: toolName, toolUseId, outcome, seconds, result
+
+KIND_NAMES = {
+    SESSION_META: "session_meta",
+    CLIENT_EVENT: "client_event",
+    CLIENT_AUDIO: "client_audio",
+    BEDROCK_INPUT: "bedrock_input",
+    BEDROCK_INPUT_AUDIO: "bedrock_input_audio",
+    BEDROCK_OUTPUT: "bedrock_output",
+    BEDROCK_OUTPUT_AUDIO: "bedrock_output_audio",
+    TOOL_CALL: "tool_call",
+    TOOL_RESULT: "tool_result",
+}
+
+# Records are buffered and handed to the writer thread in blocks this big
+_FLUSH_BYTES = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+# One thread writes every recording of the process, in submission order, so
+# disk I/O never runs on the event loop. Created on first use (after fork).
+_writer = None
+
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-recorder")
+    return _writer
+
+
+def _write_block(file, block, close=False):
+    try:
+        if block:
+            file.write(block)
+    finally:
+        if close:
+            file.close()
+
+
+def _audio_payload(meta, pcm):
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    return b"".join((_AUDIO_META_HEADER.pack(len(meta_bytes)), meta_bytes, pcm))
+
+
+def decode_audio_payload(payload):
+    """Split an audio record payload into (metadata dict, PCM bytes)."""
+    (meta_len,) = _AUDIO_META_HEADER.unpack_from(payload)
+    meta_end = _AUDIO_META_HEADER.size + meta_len
+    return json.loads(payload[_AUDIO_META_HEADER.size:meta_end]), payload[meta_end:]
+
+
+class SessionRecorder:
+    """Append-only recording of one session, for offline replay and analysis.
+
+    Every method only appends to an in-memory buffer; full blocks are written
+    by a background thread. A write failure disables the recorder instead of
+    affecting the call.
+    """
+
+    def __init__(self, path, session_id, model_id):
+        self.path = path
+        self._file = open(path, "ab")
+        self._started = time.monotonic_ns()
+        self._buffer = bytearray(MAGIC)
+        self.closed = False
+        self.failed = False
+        self._record(SESSION_META, json.dumps({
+            "sessionId": session_id,
+            "modelId": model_id,
+            "startedAt": time.time(),
+        }).encode("utf-8"))
+
+    @classmethod
+    def for_session(cls, session_id, model_id, directory=SESSION_RECORD_DIR, sample_rate=SESSION_RECORD_SAMPLE_RATE):
+        """Return a recorder when this session should be recorded, else None."""
+        if not directory or random.random() >= sample_rate:
+            return None
+        path = os.path.join(directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{session_id}.nsrec")
+        try:
+            return cls(path, session_id, model_id)
+        except OSError as e:
+            logger.warning("Can't record session %s to %s: %s", session_id, directory, e)
+            return None
+
+    def _record(self, kind, payload):
+        if self.closed or self.failed:
+            return
+        self._buffer += _RECORD_HEADER.pack(kind, time.monotonic_ns() - self._started, len(payload))
+        self._buffer += payload
+        if len(self._buffer) >= _FLUSH_BYTES:
+            self._flush()
+
+    def _flush(self, close=False):
+        block = b"" if self.failed else bytes(self._buffer)
+        self._buffer = bytearray()
+        try:
+            _get_writer().submit(_write_block, self._file, block, close).add_done_callback(self._check_write)
+        except RuntimeError:
+            # The writer is shutting down with the interpreter
+            self.failed = True
+
+    def _check_write(self, future):
+        # Runs on the writer thread; _record() sees the flag on its next call
+        error = future.exception()
+        if error is not None and not self.failed:
+            logger.warning("Stopped recording %s: %s", self.path, error)
+            self.failed = True
+
+    def client_event(self, message):
+        self._record(CLIENT_EVENT, message.encode("utf-8") if isinstance(message, str) else bytes(message))
+
+    def client_audio(self, prompt_name, content_name, audio):
+        """audio is base64 (JSON clients) or raw PCM (binary frames)."""
+        pcm = base64.b64decode(audio) if isinstance(audio, str) else bytes(audio)
+        self._record(CLIENT_AUDIO, _audio_payload({"promptName": prompt_name, "contentName": content_name}, pcm))
+
+    def bedrock_input(self, payload):
+        self._record(BEDROCK_INPUT, payload.encode("utf-8") if isinstance(payload, str) else bytes(payload))
+
+    def bedrock_input_audio(self, prompt_name, content_name, audio):
+        self._record(BEDROCK_INPUT_AUDIO, json.dumps(
+            {"promptName": prompt_name, "contentName": content_name, "bytes": audio_size(audio)}).encode("utf-8"))
+
+    def bedrock_output(self, payload):
+        if peek_event_type(payload) != "audioOutput":
+            self._record(BEDROCK_OUTPUT, bytes(payload))
+            return
+        try:
+            event = json.loads(payload)["event"]["audioOutput"]
+            pcm = base64.b64decode(event.pop("content", ""))
+        except (ValueError, KeyError, TypeError):
+            self._record(BEDROCK_OUTPUT, bytes(payload))
+            return
+        self._record(BEDROCK_OUTPUT_AUDIO, _audio_payload(event, pcm))
+
+    def tool_call(self, tool_name, tool_use_content):
+        self._record(TOOL_CALL, json.dumps({
+            "toolName": tool_name,
+            "toolUseId": tool_use_content.get("toolUseId"),
+            "content": tool_use_content.get("content"),
+        }, default=str).encode("utf-8"))
+
+    def tool_result(self, tool_name, tool_use_content, outcome, seconds, result):
+        self._record(TOOL_RESULT, json.dumps({
+            "toolName": tool_name,
+            "toolUseId": tool_use_content.get("toolUseId"),
+            "outcome": outcome,
+            "seconds": round(seconds, 4),
+            "result": result,
+        }, default=str).encode("utf-8"))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._flush(close=True)
+
+
+def read_recording(path):
+    """Yield (kind, seconds since the session started, payload) records."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a session recording")
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                # A truncated last record means the process died mid-write
+                return
+            kind, offset_ns, length = _RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield kind, offset_ns / 1e9, payload
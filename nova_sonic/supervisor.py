@@ -0,0 +1,202 @@
+import asyncio
+import ctypes
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+# How often workers publish their status and when the supervisor considers a
+# worker wedged (its event loop stopped publishing heartbeats)
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "1.0"))
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "15.0"))
+
+# Crash-loop protection: restart delay doubles on quick successive crashes
+WORKER_RESTART_BACKOFF = 1.0
+WORKER_MAX_RESTART_BACKOFF = 30.0
+WORKER_STABLE_AFTER = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerStatus(ctypes.Structure):
+    """Per-worker slot in shared memory, written by the worker itself"""
+    _fields_ = [
+        ("pid", ctypes.c_int),
+        ("heartbeat", ctypes.c_double),
+        ("active_sessions", ctypes.c_int),
+        ("ready", ctypes.c_bool),
+        ("loop_lag", ctypes.c_double),
+    ]
+
+
+async def publish_worker_status(slot, get_status):
+    """Periodically publish this worker's heartbeat and readiness.
+
+    get_status returns (active_sessions, ready, loop_lag).
+    """
+    slot.pid = os.getpid()
+    while True:
+        slot.heartbeat = time.time()
+        slot.active_sessions, slot.ready, slot.loop_lag = get_status()
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+
+def _worker_main(target, index, slot, *args):
+    # The supervisor's SIGTERM handling is inherited through fork
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    target(index, slot, *args)
+
+
+class WorkerSupervisor:
+    """Forks N worker processes that share the WebSocket port via SO_REUSEPORT.
+
+    The supervisor restarts workers that exit or stop sending heartbeats and
+    aggregates their status for the health check endpoint.
+    """
+
+    def __init__(self, num_workers, target, args=(), stop_timeout=10):
+        self.num_workers = num_workers
+        self.target = target
+        self.args = args
+        # How long stopped workers get to exit (they drain their sessions)
+        self.stop_timeout = stop_timeout
+        self._ctx = multiprocessing.get_context("fork")
+        self.status = self._ctx.Array(WorkerStatus, num_workers, lock=False)
+        self.processes = [None] * num_workers
+        self.restarts = [0] * num_workers
+        self._started_at = [0.0] * num_workers
+        self._backoff = [WORKER_RESTART_BACKOFF] * num_workers
+        self._restart_at = [0.0] * num_workers
+        self._stopping = False
+
+    def _spawn(self, index):
+        slot = self.status[index]
+        slot.pid = 0
+        slot.heartbeat = time.time()
+        slot.active_sessions = 0
+        slot.ready = False
+        slot.loop_lag = 0.0
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.target, index, slot) + tuple(self.args),
+            name=f"nova-sonic-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        self._started_at[index] = time.time()
+        logger.info("Started worker %d (pid %d)", index, process.pid)
+
+    def start(self):
+        for index in range(self.num_workers):
+            self._spawn(index)
+
+    def _check_worker(self, index, now):
+        process = self.processes[index]
+        if process is None:
+            if now >= self._restart_at[index]:
+                self.restarts[index] += 1
+                self._spawn(index)
+            return
+
+        if process.is_alive():
+            if now - self.status[index].heartbeat <= WORKER_HEARTBEAT_TIMEOUT:
+                return
+            logger.warning("Worker %d (pid %d) missed heartbeats, killing it", index, process.pid)
+            process.kill()
+            process.join(timeout=5)
+
+        logger.warning("Worker %d (pid %d) exited with code %s", index, process.pid, process.exitcode)
+        # Back off when the worker keeps crashing right after starting
+        if now - self._started_at[index] < WORKER_STABLE_AFTER:
+            self._backoff[index] = min(self._backoff[index] * 2, WORKER_MAX_RESTART_BACKOFF)
+        else:
+            self._backoff[index] = WORKER_RESTART_BACKOFF
+        self.processes[index] = None
+        self._restart_at[index] = now + self._backoff[index]
+
+    async def run(self):
+        """Monitor workers until the supervisor is asked to stop.
+
+        Runs on the supervisor's event loop, next to its admin server.
+        """
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        self.start()
+        try:
+            while not self._stopping:
+                now = time.time()
+                for index in range(self.num_workers):
+                    self._check_worker(index, now)
+                await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+        finally:
+            self.stop()
+            await loop.run_in_executor(None, self.join, self.stop_timeout)
+            self.kill()
+
+    def stop(self):
+        self._stopping = True
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+
+    def join(self, timeout=10):
+        """Wait up to timeout seconds in total for the workers to exit."""
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=max(0.0, deadline - time.monotonic()))
+
+    def kill(self):
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                logger.warning("Worker %d (pid %d) didn't stop in time, killing it", index, process.pid)
+                process.kill()
+                process.join(timeout=5)
+
+    def health(self):
+        """Aggregate worker status into a health check response."""
+        now = time.time()
+        workers = []
+        for index, process in enumerate(self.processes):
+            slot = self.status[index]
+            alive = process is not None and process.is_alive()
+            healthy = alive and now - slot.heartbeat <= WORKER_HEARTBEAT_TIMEOUT
+            workers.append({
+                "index": index,
+                "pid": process.pid if process is not None else None,
+                "healthy": healthy,
+                "ready": healthy and slot.ready,
+                "loop_lag": round(slot.loop_lag, 4) if alive else None,
+                "active_sessions": slot.active_sessions if alive else 0,
+                "restarts": self.restarts[index],
+            })
+
+        healthy_workers = sum(1 for worker in workers if worker["healthy"])
+        if healthy_workers == self.num_workers:
+            status = "healthy"
+        elif healthy_workers:
+            status = "degraded"
+        else:
+            status = "unhealthy"
+        return {
+            "status": "draining" if self._stopping else status,
+            "workers": workers,
+            "healthy_workers": healthy_workers,
+            "ready_workers": sum(1 for worker in workers if worker["ready"]),
+            "active_sessions": sum(worker["active_sessions"] for worker in workers),
+        }
+
+    def ready(self):
+        """The task can take calls while at least one worker is ready."""
+        if self._stopping:
+            return False
+        now = time.time()
+        return any(
+            process is not None and process.is_alive()
+            and now - self.status[index].heartbeat <= WORKER_HEARTBEAT_TIMEOUT
+            and self.status[index].ready
+            for index, process in enumerate(self.processes)
+        )
@@ -1,12 +1,24 @@
 import os
 import asyncio
 import json
-import boto3
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 from decimal import Decimal
 import uuid
 import pytz
+from dynamo_async import condition_failure_item, get_dynamodb
+from id_allocator import get_id_allocator, is_conditional_check_failed
+from lookup_cache import get_lookup_cache
+
+ORDERS_TABLE = os.getenv('ORDERS_TABLE', 'nova-sonic-server-app-demo-orders')
+APPOINTMENTS_TABLE = os.getenv('APPOINTMENTS_TABLE', 'nova-sonic-server-app-demo-appointments')
+
+# Attempts to create an item before giving up on ID collisions
+MAX_CREATE_ATTEMPTS = 5
+
+# Attribute holding the lowercased, trimmed copy of an owner name, so an
+# ownership check is a single conditional write whatever the spelling
+NORMALIZED_SUFFIX = "Normalized"
 
 def convert_decimals(obj):
     """Convert Decimal objects to float/int for JSON serialization"""
@@ -22,12 +34,19 @@ def convert_decimals(obj):
 class NovaSonicToolProcessor:
     """Tool processor for Nova Sonic integration with orders and appointments"""
     
-    def __init__(self):
-        # Use boto3's default credential provider chain
-        # This will automatically try: environment variables, AWS CLI profile, IAM roles, etc.
-        self.dynamodb = boto3.resource('dynamodb')
-        self.orders_table = self.dynamodb.Table(os.getenv('ORDERS_TABLE', 'nova-sonic-server-app-demo-orders'))
-        self.appointments_table = self.dynamodb.Table(os.getenv('APPOINTMENTS_TABLE', 'nova-sonic-server-app-demo-appointments'))
+    # Tools without side effects, safe to run speculatively
+    READ_ONLY_TOOLS = frozenset(("consultarOrder", "consultarTurno"))
+    
+    def __init__(self, dynamodb=None, cache=None):
+        # Shared async DynamoDB layer: boto3 calls run on a bounded thread pool
+        # (default credential provider chain) so tool calls never block the event loop
+        self.dynamodb = dynamodb or get_dynamodb()
+        # Process-wide cache of looked up orders/appointments, refreshed on every write
+        self.cache = cache or get_lookup_cache()
+        self.orders_table = self.dynamodb.table(ORDERS_TABLE)
+        self.appointments_table = self.dynamodb.table(APPOINTMENTS_TABLE)
+        self.order_ids = get_id_allocator(self.orders_table, "ORDER", "ORDER#")
+        self.appointment_ids = get_id_allocator(self.appointments_table, "APPOINTMENT", "APPOINTMENT#")
 
     def _get_argentina_time(self) -> str:
         """Get current time in Argentina timezone (UTC-3)"""
@@ -37,29 +56,98 @@ class NovaSonicToolProcessor:
 
     async def _get_next_order_id(self) -> int:
         """Obtiene el siguiente número de pedido"""
-        try:
-            # Buscar el último número usado
-            response = self.orders_table.scan(
-                ProjectionExpression='id'
-            )
-            
-            numbers = [int(item.get('id', 0)) for item in response.get('Items', []) if item.get('id', '').isdigit()]
-            return max(numbers) + 1 if numbers else 1
-        except Exception:
-            return 1
+        return await self.order_ids.next_id()
 
     async def _get_next_appointment_id(self) -> int:
         """Obtiene el siguiente número de cita"""
-        try:
-            # Buscar el último número usado
-            response = self.appointments_table.scan(
-                ProjectionExpression='id'
-            )
-            
-            numbers = [int(item.get('id', 0)) for item in response.get('Items', []) if item.get('id', '').isdigit()]
-            return max(numbers) + 1 if numbers else 1
-        except Exception:
-            return 1
+        return await self.appointment_ids.next_id()
+
+    async def _put_new_item(self, table, allocator, build_item) -> Dict[str, Any]:
+        """Guarda un item nuevo con un ID asignado, sin pisar uno existente"""
+        for _ in range(MAX_CREATE_ATTEMPTS):
+            item = build_item(str(await allocator.next_id()))
+            try:
+                await table.put_item(Item=item, ConditionExpression="attribute_not_exists(PK)")
+                self.cache.invalidate(table.table_name, item["PK"], item)
+                return item
+            except Exception as e:
+                # The ID is already taken (e.g. created outside the allocator), try the next one
+                if not is_conditional_check_failed(e):
+                    raise
+        raise RuntimeError("No se pudo asignar un ID libre")
+
+    async def _get_item(self, table, pk) -> Optional[Dict[str, Any]]:
+        """get_item por PK/SK pasando por el cache de consultas"""
+        item = self.cache.get(table.table_name, pk)
+        if item is None:
+            response = await table.get_item(Key={"PK": pk, "SK": pk})
+            item = response.get("Item")
+            if item is not None:
+                self.cache.put(table.table_name, pk, item)
+        return item
+
+    @staticmethod
+    def _normalize_name(name) -> str:
+        return str(name or "").lower().strip()
+
+    @classmethod
+    def _same_name(cls, stored, provided) -> bool:
+        return cls._normalize_name(stored) == cls._normalize_name(provided)
+
+    async def _update_if_owner(self, table, key, owner_field, owner_name, condition=None, **update):
+        """UpdateItem condicionado a que el item exista y pertenezca a owner_name.
+
+        Identidad y estado se validan en la ConditionExpression, así que la
+        operación es un solo round-trip sin carrera entre chequeo y escritura.
+        El nombre se compara con la copia normalizada del item (p. ej.
+        customerNameNormalized); los items creados antes de esa copia la
+        reciben en la primera escritura, y hasta entonces un nombre escrito
+        distinto al guardado cuesta un segundo intento con el original.
+        Devuelve (atributos nuevos, None) o, si falla la condición,
+        (None, item actual), con item None cuando no existe.
+        """
+        names = {**update.pop("ExpressionAttributeNames", {}), "#pk": "PK"}
+        values = dict(update.pop("ExpressionAttributeValues", {}))
+        conditions = ["attribute_exists(#pk)"]
+        if owner_name:
+            names["#owner"] = owner_field
+            names["#ownerNormalized"] = owner_field + NORMALIZED_SUFFIX
+            values[":owner"] = owner_name.strip()
+            values[":ownerNormalized"] = self._normalize_name(owner_name)
+            conditions.append("(#ownerNormalized = :ownerNormalized OR "
+                              "(attribute_not_exists(#ownerNormalized) AND #owner = :owner))")
+            update["UpdateExpression"] += ", #ownerNormalized = :ownerNormalized"
+        if condition:
+            conditions.append(condition)
+
+        for attempt in range(2):
+            try:
+                response = await table.update_item(
+                    Key=key,
+                    ConditionExpression=" AND ".join(conditions),
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values,
+                    ReturnValues="ALL_NEW",
+                    ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                    **update
+                )
+                self.cache.invalidate(table.table_name, key["PK"], response["Attributes"])
+                return response["Attributes"], None
+            except Exception as e:
+                if not is_conditional_check_failed(e):
+                    raise
+                item = condition_failure_item(e)
+                # Whatever was cached didn't match DynamoDB, keep the current item instead
+                self.cache.invalidate(table.table_name, key["PK"], item)
+
+            # An item without the normalized name only matches the exact
+            # spelling: retry once with the stored one
+            stored_name = item.get(owner_field) if item and owner_name else None
+            if attempt or stored_name is None or owner_field + NORMALIZED_SUFFIX in item \
+                    or stored_name == values[":owner"] or not self._same_name(stored_name, owner_name):
+                return None, item
+            values[":owner"] = stored_name
+        return None, item
 
     async def process_tool_async(self, tool_name: str, tool_content: Dict[str, Any]) -> Dict[str, Any]:
         """Process a tool request asynchronously"""
@@ -105,8 +193,7 @@ class NovaSonicToolProcessor:
                 return {"error": "Se requiere DNI o nombre completo para verificar la identidad"}
             
             # Buscar directamente por PK/SK usando el ID
-            response = self.orders_table.get_item(Key={"PK": f"ORDER#{order_id}", "SK": f"ORDER#{order_id}"})
-            item = response.get("Item")
+            item = await self._get_item(self.orders_table, f"ORDER#{order_id}")
             
             if not item:
                 return {"error": f"Pedido {order_id} no encontrado"}
@@ -152,28 +239,14 @@ class NovaSonicToolProcessor:
             if not dni and not customer_name:
                 return {"error": "Se requiere DNI o nombre completo para verificar la identidad"}
 
-            # Buscar el pedido
-            response = self.orders_table.get_item(Key={"PK": f"ORDER#{order_id}", "SK": f"ORDER#{order_id}"})
-            item = response.get("Item")
-            
-            if not item:
-                return {"error": f"Pedido {order_id} no encontrado"}
-            
-            # Verificar identidad
-            order_customer_name = item.get("customerName", "").lower().strip()
-            provided_name = customer_name.lower().strip() if customer_name else ""
-            
+            # Cancelar verificando identidad y estado en la misma escritura
             # Si se proporcionó DNI, verificar que coincida (asumiendo que el DNI está almacenado)
             # Por ahora, solo verificamos el nombre
-            if customer_name and order_customer_name != provided_name:
-                return {"error": "El nombre proporcionado no coincide con el titular del pedido"}
-            
-            if item.get("status") == "cancelled":
-                return {"error": "El pedido ya está cancelado"}
-            
-            # Actualizar estado
-            self.orders_table.update_item(
-                Key={"PK": f"ORDER#{order_id}", "SK": f"ORDER#{order_id}"},
+            updated, item = await self._update_if_owner(
+                self.orders_table,
+                {"PK": f"ORDER#{order_id}", "SK": f"ORDER#{order_id}"},
+                "customerName", customer_name,
+                condition="#status <> :status",
                 UpdateExpression="SET #status = :status, updatedAt = :updatedAt",
                 ExpressionAttributeNames={"#status": "status"},
                 ExpressionAttributeValues={
@@ -182,6 +255,13 @@ class NovaSonicToolProcessor:
                 }
             )
             
+            if updated is None:
+                if not item:
+                    return {"error": f"Pedido {order_id} no encontrado"}
+                if customer_name and not self._same_name(item.get("customerName"), customer_name):
+                    return {"error": "El nombre proporcionado no coincide con el titular del pedido"}
+                return {"error": "El pedido ya está cancelado"}
+            
             return {
                 "success": True,
                 "message": f"Pedido #{order_id} cancelado exitosamente",
@@ -206,8 +286,6 @@ class NovaSonicToolProcessor:
             # Calcular total - convertir a Decimal para DynamoDB
             total = sum(Decimal(str(item.get("price", 0))) * Decimal(str(item.get("quantity", 1))) for item in items)
             
-            # Crear pedido con ID numérico
-            order_id = str(await self._get_next_order_id())
             now = self._get_argentina_time()
             # Calcular fecha de entrega estimada (5 días desde ahora en zona horaria de Argentina)
             argentina_tz = pytz.timezone('America/Argentina/Buenos_Aires')
@@ -221,23 +299,27 @@ class NovaSonicToolProcessor:
                 processed_item["quantity"] = Decimal(str(item.get("quantity", 1)))
                 processed_items.append(processed_item)
             
-            order_item = {
-                "id": order_id,
-                "customerName": customer_name,
-                "customerEmail": customer_email,
-                "items": processed_items,
-                "total": total,
-                "status": "pending",
-                "createdAt": now,
-                "updatedAt": now,
-                "estimatedDelivery": estimated_delivery,
-                "PK": f"ORDER#{order_id}",
-                "SK": f"ORDER#{order_id}",
-                "GSI1PK": customer_email,
-                "GSI1SK": f"pending#{now}"
-            }
+            # Crear pedido con ID numérico
+            def build_order(order_id):
+                return {
+                    "id": order_id,
+                    "customerName": customer_name,
+                    "customerNameNormalized": self._normalize_name(customer_name),
+                    "customerEmail": customer_email,
+                    "items": processed_items,
+                    "total": total,
+                    "status": "pending",
+                    "createdAt": now,
+                    "updatedAt": now,
+                    "estimatedDelivery": estimated_delivery,
+                    "PK": f"ORDER#{order_id}",
+                    "SK": f"ORDER#{order_id}",
+                    "GSI1PK": customer_email,
+                    "GSI1SK": f"pending#{now}"
+                }
             
-            self.orders_table.put_item(Item=order_item)
+            order_item = await self._put_new_item(self.orders_table, self.order_ids, build_order)
+            order_id = order_item["id"]
             
             return {
                 "success": True,
@@ -264,30 +346,30 @@ class NovaSonicToolProcessor:
                 return {"error": "Se requiere nombre del paciente, email, doctor y fecha"}
             
             # Crear cita con ID numérico
-            appointment_id = str(await self._get_next_appointment_id())
-            now = self._get_argentina_time()
-            
-            appointment_item = {
-                "id": appointment_id,
-                "patientName": patient_name,
-                "patientEmail": patient_email,
-                "doctorName": doctor_name,
-                "date": date,
-                "duration": duration,
-                "type": type_appointment,
-                "notes": notes,
-                "status": "scheduled",
-                "PK": f"APPOINTMENT#{appointment_id}",
-                "SK": f"APPOINTMENT#{appointment_id}",
-                "GSI1PK": patient_email,
-                "GSI1SK": patient_email,
-                "GSI2PK": doctor_name,
-                "GSI2SK": date,
-                "GSI3PK": "scheduled",
-                "GSI3SK": "scheduled"
-            }
+            def build_appointment(appointment_id):
+                return {
+                    "id": appointment_id,
+                    "patientName": patient_name,
+                    "patientNameNormalized": self._normalize_name(patient_name),
+                    "patientEmail": patient_email,
+                    "doctorName": doctor_name,
+                    "date": date,
+                    "duration": duration,
+                    "type": type_appointment,
+                    "notes": notes,
+                    "status": "scheduled",
+                    "PK": f"APPOINTMENT#{appointment_id}",
+                    "SK": f"APPOINTMENT#{appointment_id}",
+                    "GSI1PK": patient_email,
+                    "GSI1SK": patient_email,
+                    "GSI2PK": doctor_name,
+                    "GSI2SK": date,
+                    "GSI3PK": "scheduled",
+                    "GSI3SK": "scheduled"
+                }
             
-            self.appointments_table.put_item(Item=appointment_item)
+            appointment_item = await self._put_new_item(self.appointments_table, self.appointment_ids, build_appointment)
+            appointment_id = appointment_item["id"]
             
             return {
                 "success": True,
@@ -312,31 +394,24 @@ class NovaSonicToolProcessor:
             if not patient_name:
                 return {"error": "Se requiere el nombre del paciente para verificar la identidad"}
             
-            # Buscar la cita
-            response = self.appointments_table.get_item(Key={"PK": f"APPOINTMENT#{appointment_id}", "SK": f"APPOINTMENT#{appointment_id}"})
-            item = response.get("Item")
-            
-            if not item:
-                return {"error": f"Cita {appointment_id} no encontrada"}
-            
-            # Verificar identidad
-            appointment_patient_name = item.get("patientName", "").lower().strip()
-            provided_name = patient_name.lower().strip()
-            
-            if appointment_patient_name != provided_name:
-                return {"error": "El nombre proporcionado no coincide con el paciente de la cita"}
-            
-            if item.get("status") == "cancelled":
-                return {"error": "La cita ya está cancelada"}
-            
-            # Actualizar estado
-            self.appointments_table.update_item(
-                Key={"PK": f"APPOINTMENT#{appointment_id}", "SK": f"APPOINTMENT#{appointment_id}"},
+            # Cancelar verificando identidad y estado en la misma escritura
+            updated, item = await self._update_if_owner(
+                self.appointments_table,
+                {"PK": f"APPOINTMENT#{appointment_id}", "SK": f"APPOINTMENT#{appointment_id}"},
+                "patientName", patient_name,
+                condition="#status <> :status",
                 UpdateExpression="SET #status = :status",
                 ExpressionAttributeNames={"#status": "status"},
                 ExpressionAttributeValues={":status": "cancelled"}
             )
             
+            if updated is None:
+                if not item:
+                    return {"error": f"Cita {appointment_id} no encontrada"}
+                if not self._same_name(item.get("patientName"), patient_name):
+                    return {"error": "El nombre proporcionado no coincide con el paciente de la cita"}
+                return {"error": "La cita ya está cancelada"}
+            
             return {
                 "success": True,
                 "message": f"Cita #{appointment_id} cancelada exitosamente",
@@ -362,50 +437,63 @@ class NovaSonicToolProcessor:
             if not new_date and not new_time:
                 return {"error": "Se requiere nueva fecha o nueva hora"}
             
-            # Buscar la cita
-            response = self.appointments_table.get_item(Key={"PK": f"APPOINTMENT#{appointment_id}", "SK": f"APPOINTMENT#{appointment_id}"})
-            item = response.get("Item")
-            
-            if not item:
-                return {"error": f"Cita {appointment_id} no encontrada"}
-            
-            # Verificar identidad
-            appointment_patient_name = item.get("patientName", "").lower().strip()
-            provided_name = patient_name.lower().strip()
-            
-            if appointment_patient_name != provided_name:
-                return {"error": "El nombre proporcionado no coincide con el paciente de la cita"}
-            
-            # Construir nueva fecha/hora
-            current_date = datetime.fromisoformat(item.get("date").replace("Z", "+00:00"))
-            
-            if new_date:
-                # Si se proporciona nueva fecha, mantener la hora actual
-                new_date_obj = datetime.fromisoformat(new_date.replace("Z", "+00:00"))
-                new_datetime = current_date.replace(year=new_date_obj.year, month=new_date_obj.month, day=new_date_obj.day)
-            elif new_time:
-                # Si se proporciona nueva hora, mantener la fecha actual
-                new_time_obj = datetime.fromisoformat(new_time.replace("Z", "+00:00"))
-                new_datetime = current_date.replace(hour=new_time_obj.hour, minute=new_time_obj.minute)
-            else:
-                new_datetime = current_date
-            
-            # Actualizar cita
-            update_expression = "SET #date = :date"
-            expression_values = {":date": new_datetime.isoformat() + "Z"}
-            
-            self.appointments_table.update_item(
-                Key={"PK": f"APPOINTMENT#{appointment_id}", "SK": f"APPOINTMENT#{appointment_id}"},
-                UpdateExpression=update_expression,
-                ExpressionAttributeNames={"#date": "date"},
-                ExpressionAttributeValues=expression_values
-            )
+            # La nueva fecha se arma sobre la actual, así que hay que leerla:
+            # por el cache (la cita suele haberse consultado antes), con la
+            # escritura condicionada a que la fecha no haya cambiado
+            key = {"PK": f"APPOINTMENT#{appointment_id}", "SK": f"APPOINTMENT#{appointment_id}"}
+            item = await self._get_item(self.appointments_table, key["PK"])
+            retried = False
+            
+            while True:
+                if not item:
+                    return {"error": f"Cita {appointment_id} no encontrada"}
+                
+                # Verificar identidad
+                if not self._same_name(item.get("patientName"), patient_name):
+                    return {"error": "El nombre proporcionado no coincide con el paciente de la cita"}
+                
+                # Construir nueva fecha/hora
+                current_date = datetime.fromisoformat(item.get("date").replace("Z", "+00:00"))
+                
+                if new_date:
+                    # Si se proporciona nueva fecha, mantener la hora actual
+                    new_date_obj = datetime.fromisoformat(new_date.replace("Z", "+00:00"))
+                    new_datetime = current_date.replace(year=new_date_obj.year, month=new_date_obj.month, day=new_date_obj.day)
+                elif new_time:
+                    # Si se proporciona nueva hora, mantener la fecha actual
+                    new_time_obj = datetime.fromisoformat(new_time.replace("Z", "+00:00"))
+                    new_datetime = current_date.replace(hour=new_time_obj.hour, minute=new_time_obj.minute)
+                else:
+                    new_datetime = current_date
+                
+                # Actualizar cita solo si no cambió desde la lectura
+                updated, current = await self._update_if_owner(
+                    self.appointments_table,
+                    key,
+                    "patientName", patient_name,
+                    condition="#date = :currentDate",
+                    UpdateExpression="SET #date = :date",
+                    ExpressionAttributeNames={"#date": "date"},
+                    ExpressionAttributeValues={
+                        ":date": new_datetime.isoformat() + "Z",
+                        ":currentDate": item.get("date")
+                    }
+                )
+                if updated is not None:
+                    break
+                if not current:
+                    return {"error": f"Cita {appointment_id} no encontrada"}
+                if retried:
+                    return {"error": "La cita fue modificada por otra operación, intente nuevamente"}
+                # La fecha leída estaba vieja (cache): repetir una vez con el
+                # item actual que devolvió la condición fallida
+                item, retried = current, True
             
             return {
                 "success": True,
                 "message": f"Cita #{appointment_id} modificada exitosamente",
                 "appointmentId": appointment_id,
-                "newDate": new_datetime.isoformat() + "Z"
+                "newDate": updated.get("date")
             }
         except Exception as e:
             return {"error": f"Error modificando cita: {str(e)}"}
@@ -424,8 +512,7 @@ class NovaSonicToolProcessor:
                 return {"error": "Se requiere el nombre del paciente para verificar la identidad"}
             
             # Buscar la cita
-            response = self.appointments_table.get_item(Key={"PK": f"APPOINTMENT#{appointment_id}", "SK": f"APPOINTMENT#{appointment_id}"})
-            item = response.get("Item")
+            item = await self._get_item(self.appointments_table, f"APPOINTMENT#{appointment_id}")
             
             if not item:
                 return {"error": f"Cita {appointment_id} no encontrada"}
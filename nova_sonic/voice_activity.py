@@ -0,0 +1,166 @@
+import base64
+import logging
+import os
+from collections import deque
+from metrics import VAD_AUDIO_BYTES
+
+try:
+    import numpy as np
+except ImportError:  # VAD is optional: without NumPy all audio is forwarded
+    np = None
+
+# What to do with the microphone audio of a silent line (VAD_MODE, or the
+# ?vad= query parameter of the WebSocket URL for a single session):
+#   off        forward everything, as the browser sends it
+#   keepalive  after the hangover, forward one silent chunk every VAD_KEEPALIVE_MS
+#   suppress   after the hangover, forward nothing until speech starts again
+VAD_MODE = os.getenv("VAD_MODE", "off")
+VAD_MODES = ("off", "keepalive", "suppress")
+# A 10 ms frame is speech when its RMS level is at least this many dBFS...
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", "-45"))
+# ...and its zero-crossing rate is below this (rejects hiss and fan noise)
+VAD_MAX_ZCR = float(os.getenv("VAD_MAX_ZCR", "0.35"))
+# Silence still forwarded after speech. Nova Sonic detects the end of the
+# user's turn from this silence, so keep it above its end-of-turn pause.
+VAD_HANGOVER_MS = int(os.getenv("VAD_HANGOVER_MS", "1500"))
+# Silence kept back and sent ahead of the first speech chunk, so the onset
+# the detector needed a frame to notice isn't clipped
+VAD_PREROLL_MS = int(os.getenv("VAD_PREROLL_MS", "300"))
+# Audio time between keep-alive chunks on a silent line (keepalive mode)
+VAD_KEEPALIVE_MS = int(os.getenv("VAD_KEEPALIVE_MS", "1000"))
+
+# Nova Sonic input audio: 16 kHz, 16-bit mono LPCM
+INPUT_SAMPLE_RATE = 16000
+_FRAME_MS = 10
+
+logger = logging.getLogger(__name__)
+
+
+def vad_available():
+    return np is not None
+
+
+def resolve_vad_mode(mode):
+    """Validate a VAD mode, falling back to off when NumPy isn't installed."""
+    mode = (mode or "off").lower()
+    if mode not in VAD_MODES:
+        raise ValueError(f"Unknown VAD mode {mode!r}, expected one of {', '.join(VAD_MODES)}")
+    if mode != "off" and np is None:
+        logger.warning("VAD mode %s needs NumPy, forwarding all audio", mode)
+        return "off"
+    return mode
+
+
+class VoiceActivityDetector:
+    """Energy and zero-crossing VAD over one session's microphone audio.
+
+    filter() takes the queued audio items (prompt name, content name, audio)
+    in arrival order and returns the ones to forward to Bedrock. Speech and
+    the hangover after it always go through; past the hangover silent chunks
+    are held in a short pre-roll buffer and either thinned to keep-alives or
+    dropped, depending on the mode. In off mode every chunk is forwarded and
+    only speech_run_ms is tracked, for barge-in detection.
+    """
+
+    def __init__(self, mode, sample_rate=INPUT_SAMPLE_RATE, threshold_db=VAD_THRESHOLD_DB, max_zcr=VAD_MAX_ZCR,
+                 hangover_ms=VAD_HANGOVER_MS, preroll_ms=VAD_PREROLL_MS, keepalive_ms=VAD_KEEPALIVE_MS):
+        self.mode = mode
+        self.frame_samples = sample_rate * _FRAME_MS // 1000
+        self.bytes_per_ms = sample_rate * 2 / 1000
+        # Compare mean squares instead of taking a root and a log per frame
+        self.min_mean_square = (32768.0 * 10 ** (threshold_db / 20)) ** 2
+        self.max_zcr = max_zcr
+        self.hangover_ms = hangover_ms
+        self.preroll_ms = preroll_ms
+        self.keepalive_ms = keepalive_ms
+
+        # Silence since the last speech frame; starts past the hangover so a
+        # line that opens silent is treated as idle right away
+        self.silence_ms = hangover_ms
+        # Speech without a silent chunk in between, up to the last chunk
+        self.speech_run_ms = 0.0
+        self.since_forward_ms = 0.0
+        self.preroll = deque()
+        self.preroll_ms_held = 0.0
+        self.speech_chunks = 0
+        self.forwarded_bytes = 0
+        self.suppressed_bytes = 0
+
+    def is_speech(self, pcm):
+        """True when any 10 ms frame of the 16-bit PCM looks like speech."""
+        samples = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2)
+        frames = len(samples) // self.frame_samples
+        if frames == 0:
+            if len(samples) == 0:
+                return False
+            frames_view = samples.reshape(1, -1)
+        else:
+            frames_view = samples[:frames * self.frame_samples].reshape(frames, self.frame_samples)
+        as_float = frames_view.astype(np.float32)
+        mean_square = np.einsum("ij,ij->i", as_float, as_float) / frames_view.shape[1]
+        sign = np.signbit(frames_view)
+        zcr = np.count_nonzero(sign[:, 1:] != sign[:, :-1], axis=1) / frames_view.shape[1]
+        return bool(np.any((mean_square >= self.min_mean_square) & (zcr <= self.max_zcr)))
+
+    def filter(self, item):
+        """Return the audio items to forward now, oldest first."""
+        audio = item[2]
+        pcm = base64.b64decode(audio) if isinstance(audio, str) else audio
+        duration_ms = len(pcm) / self.bytes_per_ms
+
+        speech = self.is_speech(pcm)
+        self.speech_run_ms = self.speech_run_ms + duration_ms if speech else 0.0
+        if self.mode == "off":
+            return [item]
+
+        if speech:
+            self.speech_chunks += 1
+            self.silence_ms = 0.0
+            items = [held for held, _ in self.preroll]
+            items.append(item)
+            self._forward(self.preroll_ms_held + duration_ms)
+            self.preroll.clear()
+            self.preroll_ms_held = 0.0
+            return items
+
+        self.silence_ms += duration_ms
+        if self.silence_ms <= self.hangover_ms:
+            self._forward(duration_ms)
+            return [item]
+
+        self.since_forward_ms += duration_ms
+        if self.mode == "keepalive" and self.since_forward_ms >= self.keepalive_ms:
+            # The held silence is older than this chunk, so it can't be sent later
+            self._suppress(self.preroll_ms_held)
+            self.preroll.clear()
+            self.preroll_ms_held = 0.0
+            self._forward(duration_ms)
+            return [item]
+
+        # Hold the chunk as pre-roll; what falls off the front is suppressed
+        self.preroll.append((item, duration_ms))
+        self.preroll_ms_held += duration_ms
+        while self.preroll_ms_held - self.preroll[0][1] >= self.preroll_ms:
+            _, dropped_ms = self.preroll.popleft()
+            self.preroll_ms_held -= dropped_ms
+            self._suppress(dropped_ms)
+        return []
+
+    def _forward(self, duration_ms):
+        self.since_forward_ms = 0.0
+        size = int(duration_ms * self.bytes_per_ms)
+        self.forwarded_bytes += size
+        VAD_AUDIO_BYTES.labels("forwarded").inc(size)
+
+    def _suppress(self, duration_ms):
+        size = int(duration_ms * self.bytes_per_ms)
+        self.suppressed_bytes += size
+        VAD_AUDIO_BYTES.labels("suppressed").inc(size)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "speechChunks": self.speech_chunks,
+            "forwardedBytes": self.forwarded_bytes,
+            "suppressedBytes": self.suppressed_bytes,
+        }
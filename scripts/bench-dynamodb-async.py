@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the async DynamoDB layer used by the Nova Sonic tool processor.
+
+Runs N concurrent "sessions", each doing consultarOrder lookups, against a
+local DynamoDB stand-in and reports lookup latency percentiles together with
+the event loop lag every other session on the process would see.
+
+Start a local DynamoDB first, for example:
+    docker run -p 8000:8000 amazon/dynamodb-local
+    # or: moto_server -p 8000
+
+Usage:
+    python scripts/bench-dynamodb-async.py --sessions 50 --lookups 20 --mode both
+
+The async mode measures DynamoDB itself: the tool processor's lookup cache is
+disabled unless --cache is given.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# nova_sonic modules use flat imports, so add the package directory itself
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nova_sonic"))
+
+import boto3
+
+ORDERS_TABLE = "nova-sonic-bench-orders"
+APPOINTMENTS_TABLE = "nova-sonic-bench-appointments"
+ORDER_ID = "1"
+CUSTOMER_NAME = "Cliente Benchmark"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def setup_tables(endpoint_url):
+    """Create the benchmark tables on the local endpoint and seed one order"""
+    dynamodb = boto3.resource("dynamodb", endpoint_url=endpoint_url)
+    existing = {table.name for table in dynamodb.tables.all()}
+    for name in (ORDERS_TABLE, APPOINTMENTS_TABLE):
+        if name not in existing:
+            dynamodb.create_table(
+                TableName=name,
+                KeySchema=[{"AttributeName": "PK", "KeyType": "HASH"}, {"AttributeName": "SK", "KeyType": "RANGE"}],
+                AttributeDefinitions=[
+                    {"AttributeName": "PK", "AttributeType": "S"},
+                    {"AttributeName": "SK", "AttributeType": "S"},
+                ],
+                BillingMode="PAY_PER_REQUEST",
+            ).wait_until_exists()
+    dynamodb.Table(ORDERS_TABLE).put_item(Item={
+        "PK": f"ORDER#{ORDER_ID}",
+        "SK": f"ORDER#{ORDER_ID}",
+        "id": ORDER_ID,
+        "customerName": CUSTOMER_NAME,
+        "customerEmail": "bench@example.com",
+        "status": "pending",
+        "total": 10,
+        "items": [],
+    })
+
+
+async def measure_loop_lag(samples, stop, interval=0.01):
+    """Record how late the event loop wakes up a 10 ms sleeper"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def run_sessions(lookup, sessions, lookups):
+    latencies = []
+    lag_samples = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples, stop))
+
+    async def session():
+        for _ in range(lookups):
+            start = time.perf_counter()
+            result = await lookup()
+            latencies.append(time.perf_counter() - start)
+            if not result.get("success"):
+                raise RuntimeError(f"Lookup failed: {result}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session() for _ in range(sessions)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+    return latencies, lag_samples, elapsed
+
+
+def report(mode, latencies, lag_samples, elapsed):
+    ms = lambda seconds: f"{seconds * 1000:.1f}ms"
+    print(f"\n📊 Modo {mode}: {len(latencies)} consultas en {elapsed:.2f}s ({len(latencies) / elapsed:.0f} ops/s)")
+    print(f"  Latencia  p50={ms(percentile(latencies, 50))}  p95={ms(percentile(latencies, 95))}  p99={ms(percentile(latencies, 99))}")
+    print(f"  Loop lag  p50={ms(percentile(lag_samples, 50))}  p99={ms(percentile(lag_samples, 99))}  max={ms(max(lag_samples, default=0.0))}")
+
+
+async def main(args):
+    os.environ["ORDERS_TABLE"] = ORDERS_TABLE
+    os.environ["APPOINTMENTS_TABLE"] = APPOINTMENTS_TABLE
+
+    from dynamo_async import AsyncDynamoDB
+    from lookup_cache import LookupCache
+    from tool_processor import NovaSonicToolProcessor
+
+    content = {"orderId": ORDER_ID, "customerName": CUSTOMER_NAME}
+
+    if args.mode in ("sync", "both"):
+        # Baseline: blocking boto3 calls made directly on the event loop
+        table = boto3.resource("dynamodb", endpoint_url=args.endpoint).Table(ORDERS_TABLE)
+
+        async def blocking_lookup():
+            response = table.get_item(Key={"PK": f"ORDER#{ORDER_ID}", "SK": f"ORDER#{ORDER_ID}"})
+            return {"success": "Item" in response}
+
+        report("sync", *await run_sessions(blocking_lookup, args.sessions, args.lookups))
+
+    if args.mode in ("async", "both"):
+        dynamodb = AsyncDynamoDB(max_workers=args.workers, endpoint_url=args.endpoint)
+        await dynamodb.warm_up(ORDERS_TABLE, APPOINTMENTS_TABLE)
+        # With the default cache every lookup after the first would be a hit
+        cache = LookupCache() if args.cache else LookupCache(ttl=0)
+        processor = NovaSonicToolProcessor(dynamodb=dynamodb, cache=cache)
+
+        async def async_lookup():
+            return await processor.process_tool_async("consultarOrder", content)
+
+        mode = f"async ({args.workers} threads, {'con' if args.cache else 'sin'} caché)"
+        report(mode, *await run_sessions(async_lookup, args.sessions, args.lookups))
+        dynamodb.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del acceso async a DynamoDB")
+    parser.add_argument("--endpoint", default=os.getenv("DYNAMODB_ENDPOINT_URL", "http://localhost:8000"))
+    parser.add_argument("--sessions", type=int, default=50, help="Sesiones concurrentes")
+    parser.add_argument("--lookups", type=int, default=20, help="Consultas por sesión")
+    parser.add_argument("--workers", type=int, default=16, help="Threads del pool de DynamoDB")
+    parser.add_argument("--mode", choices=("async", "sync", "both"), default="both")
+    parser.add_argument("--cache", action="store_true", help="Usar el caché de consultas en el modo async")
+    args = parser.parse_args()
+
+    # DynamoDB Local accepts any credentials
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    print(f"🧪 Benchmark DynamoDB en {args.endpoint}: {args.sessions} sesiones x {args.lookups} consultas")
+    setup_tables(args.endpoint)
+    asyncio.run(main(args))
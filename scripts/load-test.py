@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Load generator for the Nova Sonic WebSocket server.
+
+Opens N concurrent WebSocket clients. Each one replays a realistic call:
+sessionStart, promptStart, the system prompt, then microphone audio (16 kHz
+PCM streamed at real-time pace: speech followed by silence until the
+assistant's reply ends, for every turn) and finally sessionEnd.
+
+Reports, per run:
+  - time from the end of the user's speech to the first audioOutput (p50/p95/p99)
+  - assistant audio underruns (a client playing the audio would have stalled)
+    and audio dropped from the server's session queues
+  - microphone chunks the clients sent late (the generator itself is overloaded)
+  - server event loop lag and resident memory per session, scraped from /metrics
+
+With --spawn-server the server is started with STREAM_BACKEND=fake (the
+in-process Nova Sonic simulator), so runs need no AWS credentials and are
+reproducible in CI; --scenario and --seed are passed to the simulator.
+
+Usage:
+    python scripts/load-test.py --spawn-server --sessions 50 --turns 3
+    python scripts/load-test.py --url ws://localhost:8081 --metrics-url http://localhost:8080/metrics --sessions 20
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+NOVA_SONIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nova_sonic")
+# nova_sonic modules use flat imports, so add the package directory itself
+sys.path.append(NOVA_SONIC_DIR)
+
+import websockets
+from s2s_codec import BINARY_AUDIO_SUBPROTOCOL, build_audio_frame
+from s2s_events import S2sEvent
+
+INPUT_SAMPLE_RATE = 16000
+# Assistant audio is 24 kHz 16-bit mono (S2sEvent.DEFAULT_AUDIO_OUTPUT_CONFIG)
+OUTPUT_BYTES_PER_SECOND = 24000 * 2
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_pcm(duration_ms, amplitude):
+    """A chunk of 16-bit mono PCM: a 220 Hz tone, or silence when amplitude is 0"""
+    samples = INPUT_SAMPLE_RATE * duration_ms // 1000
+    pcm = bytearray(samples * 2)
+    if amplitude:
+        for i in range(samples):
+            value = int(amplitude * math.sin(2 * math.pi * 220 * i / INPUT_SAMPLE_RATE))
+            pcm[2 * i:2 * i + 2] = value.to_bytes(2, "little", signed=True)
+    return bytes(pcm)
+
+
+class SessionResult:
+    def __init__(self):
+        self.first_audio_latencies = []
+        self.turns_completed = 0
+        self.underruns = 0
+        self.audio_received_ms = 0.0
+        self.chunks_sent = 0
+        self.late_chunks = 0
+        self.rejected = None
+        self.error = None
+
+
+class LoadClient:
+    """One simulated caller"""
+
+    def __init__(self, index, args, speech, silence):
+        self.index = index
+        self.args = args
+        self.speech = speech
+        self.silence = silence
+        self.result = SessionResult()
+        self.prompt_name = f"load-prompt-{index}"
+        self.audio_content = f"load-audio-{index}"
+
+        self.chunk_seconds = args.chunk_ms / 1000
+        self.next_send = None
+        self.speech_ended_at = None
+        self.first_audio_at = None
+        self.playback_end = None
+        # turn_done also wakes the turn when the connection closes; only
+        # turn_answered says the reply's audio contentEnd actually arrived
+        self.turn_done = asyncio.Event()
+        self.turn_answered = False
+        self.closed = False
+
+    async def run(self, start_delay):
+        await asyncio.sleep(start_delay)
+        subprotocols = [BINARY_AUDIO_SUBPROTOCOL] if self.args.binary else None
+        try:
+            async with websockets.connect(self.args.url, subprotocols=subprotocols, max_size=None) as ws:
+                self.ws = ws
+                reader = asyncio.create_task(self.read_events())
+                await self.send_event(S2sEvent.session_start())
+                await self.send_event(S2sEvent.prompt_start(self.prompt_name))
+                system_content = f"load-system-{self.index}"
+                await self.send_event(S2sEvent.content_start_text(self.prompt_name, system_content))
+                await self.send_event(S2sEvent.text_input(self.prompt_name, system_content))
+                await self.send_event(S2sEvent.content_end(self.prompt_name, system_content))
+                await self.send_event(S2sEvent.content_start_audio(self.prompt_name, self.audio_content))
+
+                self.next_send = time.monotonic()
+                for _ in range(self.args.turns):
+                    if self.closed:
+                        break
+                    await self.run_turn()
+
+                if not self.closed:
+                    await self.send_event(S2sEvent.content_end(self.prompt_name, self.audio_content))
+                    await self.send_event(S2sEvent.prompt_end(self.prompt_name))
+                    await self.send_event(S2sEvent.session_end())
+                reader.cancel()
+        except websockets.exceptions.ConnectionClosed as e:
+            if not self.result.rejected:
+                self.result.error = f"connection closed ({e.rcvd.code if e.rcvd else 'no close frame'})"
+        except Exception as e:
+            self.result.error = f"{type(e).__name__}: {e}"
+        return self.result
+
+    async def run_turn(self):
+        self.turn_done.clear()
+        self.turn_answered = False
+        self.first_audio_at = None
+        self.playback_end = None
+        self.speech_ended_at = None
+
+        for _ in range(self.args.speech_ms // self.args.chunk_ms):
+            await self.send_audio(self.speech)
+        self.speech_ended_at = time.monotonic()
+
+        # Keep the microphone open (silence) until the assistant finished replying
+        deadline = self.speech_ended_at + self.args.turn_timeout
+        while not self.turn_done.is_set() and not self.closed and time.monotonic() < deadline:
+            await self.send_audio(self.silence)
+        if self.turn_answered:
+            self.result.turns_completed += 1
+        for _ in range(self.args.pause_ms // self.args.chunk_ms):
+            await self.send_audio(self.silence)
+
+    async def send_event(self, event):
+        await self.ws.send(json.dumps(event))
+
+    async def send_audio(self, pcm):
+        """Send one microphone chunk on its real-time schedule"""
+        if self.closed:
+            return
+        now = time.monotonic()
+        if now - self.next_send > self.chunk_seconds:
+            self.result.late_chunks += 1
+        if self.args.binary:
+            await self.ws.send(build_audio_frame(self.prompt_name, self.audio_content, pcm))
+        else:
+            content = base64.b64encode(pcm).decode("ascii")
+            await self.send_event(S2sEvent.audio_input(self.prompt_name, self.audio_content, content))
+        self.result.chunks_sent += 1
+        self.next_send += self.chunk_seconds
+        await asyncio.sleep(max(0.0, self.next_send - time.monotonic()))
+
+    async def read_events(self):
+        try:
+            async for message in self.ws:
+                now = time.monotonic()
+                event = json.loads(message).get("event", {})
+                if "audioOutput" in event:
+                    self.on_audio(now, event["audioOutput"].get("content", ""))
+                elif "contentEnd" in event:
+                    content_end = event["contentEnd"]
+                    if content_end.get("type") == "AUDIO" and content_end.get("stopReason") in ("END_TURN", "INTERRUPTED"):
+                        self.turn_answered = True
+                        self.turn_done.set()
+                elif "sessionRejected" in event:
+                    self.result.rejected = event["sessionRejected"].get("reason", "unknown")
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+            self.turn_done.set()
+
+    def on_audio(self, now, content):
+        padding = content.count("=", -2)
+        duration = (len(content) * 3 // 4 - padding) / OUTPUT_BYTES_PER_SECOND
+        self.result.audio_received_ms += duration * 1000
+        if self.first_audio_at is None:
+            self.first_audio_at = now
+            if self.speech_ended_at is not None:
+                self.result.first_audio_latencies.append(now - self.speech_ended_at)
+            # Playback starts once the jitter buffer is filled
+            self.playback_end = now + self.args.jitter_buffer_ms / 1000 + duration
+            return
+        if now > self.playback_end:
+            # The player ran out of audio before this chunk arrived
+            self.result.underruns += 1
+            self.playback_end = now
+        self.playback_end += duration
+
+
+def scrape_metrics(url):
+    """Parse a Prometheus text page into {name{labels}: value}"""
+    samples = {}
+    with urllib.request.urlopen(url, timeout=2) as response:
+        for line in response.read().decode("utf-8").splitlines():
+            if line and not line.startswith("#"):
+                name, _, value = line.rpartition(" ")
+                try:
+                    samples[name] = float(value)
+                except ValueError:
+                    pass
+    return samples
+
+
+async def sample_server(url, samples, stop, interval=0.5):
+    """Scrape the server's /metrics until stopped (off the event loop)"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        try:
+            samples.append(await loop.run_in_executor(None, scrape_metrics, url))
+        except Exception:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def spawn_server(args):
+    """Start server.py on the Nova Sonic simulator and wait until it's ready"""
+    env = dict(os.environ)
+    env.update({
+        "STREAM_BACKEND": "fake",
+        "HOST": "localhost",
+        "WS_PORT": str(args.port),
+        "HEALTH_PORT": str(args.health_port),
+        "LOGLEVEL": env.get("LOGLEVEL", "WARNING"),
+        "DRAIN_TIMEOUT": "0",
+    })
+    # Tools still run against DynamoDB; don't wait on instance metadata for credentials
+    env.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    if args.scenario:
+        env["FAKE_NOVA_SONIC_SCENARIO"] = os.path.abspath(args.scenario)
+    if args.seed is not None:
+        env["FAKE_NOVA_SONIC_SEED"] = str(args.seed)
+
+    process = subprocess.Popen([sys.executable, "server.py"], cwd=NOVA_SONIC_DIR, env=env)
+    ready_url = f"http://localhost:{args.health_port}/ready"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(ready_url, timeout=1):
+                return process
+        except Exception:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("server.py didn't become ready in 30s")
+
+
+def summarize(results, server_samples, elapsed, args):
+    latencies = [value for result in results for value in result.first_audio_latencies]
+    lag = [sample.get("nova_sonic_event_loop_lag_seconds", 0.0) for sample in server_samples]
+    rss = [sample["process_resident_memory_bytes"] for sample in server_samples if "process_resident_memory_bytes" in sample]
+    peak_sessions = max((sample.get("nova_sonic_active_sessions", 0) for sample in server_samples), default=0)
+
+    def dropped(queue):
+        key = f'nova_sonic_queue_dropped_total{{queue="{queue}"}}'
+        if not server_samples:
+            return None
+        return server_samples[-1].get(key, 0) - server_samples[0].get(key, 0)
+
+    def delta(key):
+        if not server_samples:
+            return 0
+        return server_samples[-1].get(key, 0) - server_samples[0].get(key, 0)
+
+    frames = delta("nova_sonic_audio_frame_delay_seconds_count")
+
+    def vad_bytes(decision):
+        key = f'nova_sonic_vad_audio_bytes_total{{decision="{decision}"}}'
+        if not server_samples:
+            return None
+        return server_samples[-1].get(key, 0) - server_samples[0].get(key, 0)
+
+    return {
+        "sessions": len(results),
+        "elapsed_seconds": round(elapsed, 2),
+        "errors": sum(1 for result in results if result.error),
+        "rejected": sum(1 for result in results if result.rejected),
+        "turns_completed": sum(result.turns_completed for result in results),
+        "turns_expected": len(results) * args.turns,
+        "first_audio_ms": {
+            "count": len(latencies),
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies, default=0.0) * 1000, 1),
+        },
+        "audio_received_seconds": round(sum(result.audio_received_ms for result in results) / 1000, 1),
+        "audio_underruns": sum(result.underruns for result in results),
+        "output_audio_dropped": dropped("output"),
+        "input_audio_dropped": dropped("audio_input"),
+        "input_chunks_sent": sum(result.chunks_sent for result in results),
+        "input_chunks_late": sum(result.late_chunks for result in results),
+        "audio_input_chunks": int(delta("nova_sonic_audio_input_chunks_total")),
+        "audio_input_events": int(frames),
+        "audio_frame_delay_ms_mean": round(delta("nova_sonic_audio_frame_delay_seconds_sum") / frames * 1000, 1) if frames else None,
+        "vad_forwarded_bytes": vad_bytes("forwarded"),
+        "vad_suppressed_bytes": vad_bytes("suppressed"),
+        "loop_lag_ms": {
+            "p50": round(percentile(lag, 50) * 1000, 1),
+            "p95": round(percentile(lag, 95) * 1000, 1),
+            "max": round(max(lag, default=0.0) * 1000, 1),
+        } if lag else None,
+        "peak_active_sessions": int(peak_sessions),
+        "rss_mb": {
+            "baseline": round(rss[0] / 2**20, 1),
+            "peak": round(max(rss) / 2**20, 1),
+            "per_session_kb": round((max(rss) - rss[0]) / 1024 / peak_sessions, 1) if peak_sessions else None,
+        } if rss else None,
+    }
+
+
+def report(summary):
+    print(f"\n📊 {summary['sessions']} sesiones en {summary['elapsed_seconds']}s "
+          f"({summary['errors']} con error, {summary['rejected']} rechazadas), "
+          f"turnos completos {summary['turns_completed']}/{summary['turns_expected']}")
+    latency = summary["first_audio_ms"]
+    print(f"  Primer audio  p50={latency['p50']}ms  p95={latency['p95']}ms  p99={latency['p99']}ms  max={latency['max']}ms")
+    print(f"  Audio recibido {summary['audio_received_seconds']}s, cortes de reproducción {summary['audio_underruns']}, "
+          f"descartado en el servidor: salida {summary['output_audio_dropped']} / entrada {summary['input_audio_dropped']}")
+    print(f"  Chunks de micrófono enviados {summary['input_chunks_sent']}, tarde {summary['input_chunks_late']}")
+    if summary["audio_input_events"]:
+        print(f"  audioInput a Bedrock: {summary['audio_input_chunks']} chunks en {summary['audio_input_events']} eventos, "
+              f"espera media para completar el frame {summary['audio_frame_delay_ms_mean']}ms")
+    if summary["vad_forwarded_bytes"] or summary["vad_suppressed_bytes"]:
+        forwarded, suppressed = summary["vad_forwarded_bytes"], summary["vad_suppressed_bytes"]
+        print(f"  VAD: audio enviado a Bedrock {forwarded / 2**20:.1f}MB, suprimido {suppressed / 2**20:.1f}MB "
+              f"({suppressed / (forwarded + suppressed) * 100:.0f}%)")
+    if summary["loop_lag_ms"]:
+        lag = summary["loop_lag_ms"]
+        print(f"  Loop lag del servidor  p50={lag['p50']}ms  p95={lag['p95']}ms  max={lag['max']}ms")
+    if summary["rss_mb"]:
+        rss = summary["rss_mb"]
+        per_session = f" ({rss['per_session_kb']}KB por sesión)" if rss["per_session_kb"] is not None else ""
+        print(f"  RSS del servidor {rss['baseline']}MB -> {rss['peak']}MB con {summary['peak_active_sessions']} sesiones"
+              f"{per_session}")
+
+
+async def main(args):
+    speech = make_pcm(args.chunk_ms, 6000)
+    silence = make_pcm(args.chunk_ms, 0)
+
+    samples = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_server(args.metrics_url, samples, stop)) if args.metrics_url else None
+    # Let the sampler record the idle baseline first
+    await asyncio.sleep(0.6 if sampler else 0)
+
+    clients = [LoadClient(index, args, speech, silence) for index in range(args.sessions)]
+    ramp_step = args.ramp / args.sessions if args.sessions else 0
+    started = time.monotonic()
+    results = await asyncio.gather(*(client.run(index * ramp_step) for index, client in enumerate(clients)))
+    elapsed = time.monotonic() - started
+
+    if sampler:
+        # One last scrape so the drop counters include the end of the run
+        await asyncio.sleep(0.6)
+        stop.set()
+        await sampler
+    return summarize(results, samples, elapsed, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de sesiones concurrentes contra el servidor Nova Sonic")
+    parser.add_argument("--url", default=None, help="URL del WebSocket (por defecto ws://localhost:PORT)")
+    parser.add_argument("--metrics-url", default=None, help="URL de /metrics del servidor (por defecto la del servidor levantado)")
+    parser.add_argument("--spawn-server", action="store_true", help="Levantar server.py con STREAM_BACKEND=fake")
+    parser.add_argument("--port", type=int, default=18081, help="Puerto WebSocket del servidor levantado")
+    parser.add_argument("--health-port", type=int, default=18080, help="Puerto de health/metrics del servidor levantado")
+    parser.add_argument("--scenario", default=None, help="Escenario JSON del simulador (FAKE_NOVA_SONIC_SCENARIO)")
+    parser.add_argument("--seed", type=int, default=1, help="Semilla de fallas del simulador")
+    parser.add_argument("--sessions", type=int, default=20, help="Sesiones concurrentes")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Segundos para abrir todas las sesiones")
+    parser.add_argument("--turns", type=int, default=3, help="Turnos del usuario por sesión")
+    parser.add_argument("--speech-ms", type=int, default=1500, help="Duración del habla en cada turno")
+    parser.add_argument("--pause-ms", type=int, default=500, help="Silencio entre el fin de la respuesta y el próximo turno")
+    parser.add_argument("--chunk-ms", type=int, default=32, help="Duración de cada chunk de micrófono")
+    parser.add_argument("--turn-timeout", type=float, default=15.0, help="Segundos máximos esperando la respuesta de un turno")
+    parser.add_argument("--jitter-buffer-ms", type=int, default=100, help="Buffer del reproductor simulado antes de empezar a sonar")
+    parser.add_argument("--binary", action="store_true", help="Enviar el audio como frames binarios (subprotocolo)")
+    parser.add_argument("--json", default=None, help="Guardar el resumen en este archivo JSON")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="Salir con error si el p95 del primer audio lo supera")
+    args = parser.parse_args()
+
+    args.url = args.url or f"ws://localhost:{args.port}"
+    if args.spawn_server and args.metrics_url is None:
+        args.metrics_url = f"http://localhost:{args.health_port}/metrics"
+
+    server = spawn_server(args) if args.spawn_server else None
+    try:
+        print(f"🧪 Prueba de carga en {args.url}: {args.sessions} sesiones x {args.turns} turnos")
+        summary = asyncio.run(main(args))
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    failed = summary["errors"] or summary["turns_completed"] < summary["turns_expected"]
+    if args.max_p95_ms is not None and summary["first_audio_ms"]["p95"] > args.max_p95_ms:
+        print(f"❌ p95 del primer audio {summary['first_audio_ms']['p95']}ms supera {args.max_p95_ms}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
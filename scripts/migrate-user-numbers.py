@@ -9,6 +9,23 @@ import boto3
 from datetime import datetime
 import json
 
+def scan_items(table, key_prefix):
+    """Escanea todos los items cuya PK empieza con key_prefix.
+
+    Filtra el item contador de IDs (PK = COUNTER#...) que vive en la misma tabla.
+    """
+    kwargs = {
+        'FilterExpression': 'begins_with(PK, :prefix)',
+        'ExpressionAttributeValues': {':prefix': key_prefix},
+    }
+    items = []
+    while True:
+        response = table.scan(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
 def migrate_orders():
     """Migra pedidos existentes agregando userOrderNumber"""
     dynamodb = boto3.resource('dynamodb')
@@ -17,8 +34,7 @@ def migrate_orders():
     print("🔄 Migrando pedidos...")
     
     # Escanear todos los pedidos
-    response = orders_table.scan()
-    orders = response.get('Items', [])
+    orders = scan_items(orders_table, 'ORDER#')
     
     # Ordenar por fecha de creación para asignar números secuenciales
     orders.sort(key=lambda x: x.get('createdAt', ''))
@@ -53,8 +69,7 @@ def migrate_appointments():
     print("🔄 Migrando citas...")
     
     # Escanear todas las citas
-    response = appointments_table.scan()
-    appointments = response.get('Items', [])
+    appointments = scan_items(appointments_table, 'APPOINTMENT#')
     
     # Ordenar por fecha de creación para asignar números secuenciales
     appointments.sort(key=lambda x: x.get('date', ''))
@@ -90,15 +105,13 @@ def verify_migration():
     print("🔍 Verificando migración...")
     
     # Verificar pedidos
-    orders_response = orders_table.scan()
-    orders = orders_response.get('Items', [])
+    orders = scan_items(orders_table, 'ORDER#')
     orders_with_numbers = [o for o in orders if 'userOrderNumber' in o]
     
     print(f"  📦 Pedidos con userOrderNumber: {len(orders_with_numbers)}/{len(orders)}")
     
     # Verificar citas
-    appointments_response = appointments_table.scan()
-    appointments = appointments_response.get('Items', [])
+    appointments = scan_items(appointments_table, 'APPOINTMENT#')
     appointments_with_numbers = [a for a in appointments if 'userAppointmentNumber' in a]
     
     print(f"  📅 Citas con userAppointmentNumber: {len(appointments_with_numbers)}/{len(appointments)}")
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded Nova Sonic session against the WebSocket server.
+
+Recordings are written by the server when SESSION_RECORD_DIR is set (see
+nova_sonic/session_recorder.py). The client events and microphone audio of
+the recording are sent again with their recorded timing, optionally
+accelerated, and the time of the first audioOutput of every assistant reply
+is compared with the recording.
+
+Run the server on the Nova Sonic simulator to reproduce an incident offline:
+    STREAM_BACKEND=fake python nova_sonic/server.py
+
+Usage:
+    python scripts/replay-session.py recordings/20250801T101500-1a2b3c4d.nsrec
+    python scripts/replay-session.py session.nsrec --speed 4 --binary
+    python scripts/replay-session.py session.nsrec --dump
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+
+# nova_sonic modules use flat imports, so add the package directory itself
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nova_sonic"))
+
+import websockets
+from s2s_codec import BINARY_AUDIO_SUBPROTOCOL, build_audio_frame
+from s2s_events import S2sEvent
+from session_recorder import (
+    BEDROCK_OUTPUT_AUDIO,
+    CLIENT_AUDIO,
+    CLIENT_EVENT,
+    KIND_NAMES,
+    SESSION_META,
+    TOOL_RESULT,
+    decode_audio_payload,
+    read_recording,
+)
+
+
+def load(path):
+    """Split a recording into what the client sent and what Bedrock answered"""
+    meta = {}
+    client = []          # (seconds, kind, payload)
+    reply_starts = []    # seconds of the first audioOutput of every assistant audio content
+    tools = []
+    seen_contents = set()
+    counts = {}
+    duration = 0.0
+    for kind, offset, payload in read_recording(path):
+        counts[KIND_NAMES.get(kind, kind)] = counts.get(KIND_NAMES.get(kind, kind), 0) + 1
+        duration = offset
+        if kind == SESSION_META:
+            meta = json.loads(payload)
+        elif kind in (CLIENT_EVENT, CLIENT_AUDIO):
+            client.append((offset, kind, payload))
+        elif kind == BEDROCK_OUTPUT_AUDIO:
+            content_id = decode_audio_payload(payload)[0].get("contentId")
+            if content_id not in seen_contents:
+                seen_contents.add(content_id)
+                reply_starts.append(offset)
+        elif kind == TOOL_RESULT:
+            tools.append((offset, json.loads(payload)))
+    return meta, client, reply_starts, tools, counts, duration
+
+
+def dump(path):
+    meta, client, reply_starts, tools, counts, duration = load(path)
+    audio_seconds = sum(len(decode_audio_payload(payload)[1]) for _, kind, payload in client if kind == CLIENT_AUDIO) / 32000
+    print(f"📼 Sesión {meta.get('sessionId')} ({meta.get('modelId')}), {duration:.2f}s, "
+          f"{audio_seconds:.1f}s de audio del usuario")
+    for name, count in sorted(counts.items()):
+        print(f"  {name:<22} {count}")
+    for offset, tool in tools:
+        print(f"  🔧 {offset:8.3f}s {tool['toolName']} {tool['outcome']} en {tool['seconds'] * 1000:.0f}ms")
+    for index, offset in enumerate(reply_starts, 1):
+        print(f"  🔊 {offset:8.3f}s respuesta {index}: primer audio")
+
+
+async def replay(args):
+    meta, client, recorded_replies, _, _, duration = load(args.recording)
+    if not client:
+        raise SystemExit("La grabación no tiene eventos del cliente")
+
+    speed = args.speed
+    scale = (lambda offset: offset / speed) if speed > 0 else (lambda offset: 0.0)
+    subprotocols = [BINARY_AUDIO_SUBPROTOCOL] if args.binary else None
+    replies = []
+    seen_contents = set()
+
+    async with websockets.connect(args.url, subprotocols=subprotocols, max_size=None) as ws:
+        started = time.monotonic()
+
+        async def read_events():
+            try:
+                async for message in ws:
+                    event = json.loads(message).get("event", {})
+                    audio = event.get("audioOutput")
+                    if audio is not None and audio.get("contentId") not in seen_contents:
+                        seen_contents.add(audio.get("contentId"))
+                        replies.append(time.monotonic() - started)
+                    elif "sessionRejected" in event:
+                        print(f"❌ Sesión rechazada: {event['sessionRejected'].get('reason')}")
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+        reader = asyncio.create_task(read_events())
+        sent = 0
+        for offset, kind, payload in client:
+            delay = started + scale(offset) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if kind == CLIENT_EVENT:
+                await ws.send(payload.decode("utf-8"))
+            else:
+                audio_meta, pcm = decode_audio_payload(payload)
+                if args.binary:
+                    await ws.send(build_audio_frame(audio_meta["promptName"], audio_meta["contentName"], pcm))
+                else:
+                    await ws.send(json.dumps(S2sEvent.audio_input(
+                        audio_meta["promptName"], audio_meta["contentName"], base64.b64encode(pcm).decode("ascii"))))
+            sent += 1
+
+        # Leave time for the replies that came after the last client event
+        tail = max(scale(duration - client[-1][0]), 1.0) + args.tail
+        try:
+            await asyncio.wait_for(reader, tail)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.monotonic() - started
+
+    print(f"▶️  {sent} eventos enviados en {elapsed:.2f}s (grabación de {duration:.2f}s, velocidad {speed or 'máxima'})")
+    for index in range(max(len(recorded_replies), len(replies))):
+        recorded = scale(recorded_replies[index]) if index < len(recorded_replies) else None
+        replayed = replies[index] if index < len(replies) else None
+        if recorded is not None and replayed is not None:
+            print(f"  🔊 respuesta {index + 1}: grabada {recorded:.3f}s, replay {replayed:.3f}s ({(replayed - recorded) * 1000:+.0f}ms)")
+        else:
+            print(f"  🔊 respuesta {index + 1}: grabada {recorded if recorded is None else f'{recorded:.3f}s'}, "
+                  f"replay {replayed if replayed is None else f'{replayed:.3f}s'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducir una sesión grabada contra el servidor Nova Sonic")
+    parser.add_argument("recording", help="Archivo .nsrec grabado con SESSION_RECORD_DIR")
+    parser.add_argument("--url", default="ws://localhost:8081", help="URL del WebSocket del servidor")
+    parser.add_argument("--speed", type=float, default=1.0, help="Velocidad de reproducción (2 = el doble de rápido, 0 = sin esperas)")
+    parser.add_argument("--binary", action="store_true", help="Enviar el audio como frames binarios (subprotocolo)")
+    parser.add_argument("--tail", type=float, default=2.0, help="Segundos extra esperando respuestas al final")
+    parser.add_argument("--dump", action="store_true", help="Solo mostrar el contenido de la grabación")
+    args = parser.parse_args()
+
+    if args.dump:
+        dump(args.recording)
+    else:
+        asyncio.run(replay(args))
@@ -9,6 +9,11 @@ const docClient = DynamoDBDocumentClient.from(client);
 const ORDERS_TABLE = process.env.ORDERS_TABLE || 'nova-sonic-server-app-demo-orders';
 const APPOINTMENTS_TABLE = process.env.APPOINTMENTS_TABLE || 'nova-sonic-server-app-demo-appointments';
 
+// Lowercased, trimmed owner name the Nova Sonic tools check identity against
+function normalizeName(name) {
+  return name.toLowerCase().trim();
+}
+
 // Helper function to create dates in Argentina timezone (UTC-3)
 function createArgentinaDate(year, month, day, hour = 0, minute = 0, second = 0) {
   // Create date in Argentina timezone (UTC-3)
@@ -321,7 +326,7 @@ async function seedOrders() {
     try {
       const command = new PutCommand({
         TableName: ORDERS_TABLE,
-        Item: order
+        Item: { ...order, customerNameNormalized: normalizeName(order.customerName) }
       });
       
       await docClient.send(command);
@@ -342,7 +347,7 @@ async function seedAppointments() {
     try {
       const command = new PutCommand({
         TableName: APPOINTMENTS_TABLE,
-        Item: appointment
+        Item: { ...appointment, patientNameNormalized: normalizeName(appointment.patientName) }
       });
       
       await docClient.send(command);
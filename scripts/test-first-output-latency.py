@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Check nova_sonic_first_output_seconds against the latency a caller perceives.
+
+Runs sessions in-process on the Nova Sonic simulator (no AWS credentials):
+the user speaks, then the microphone keeps streaming silence, as browsers
+do, until the assistant answers. With the local VAD (BARGE_IN_VAD), the time
+from the last speech chunk to the first assistant textOutput/audioOutput
+seen in the session's output queue must match what the histogram recorded
+for the turn, and must include the simulator's end-of-turn silence and first
+output delay. Without it (the default) the turn is timed from the user
+transcript, so the histogram must hold the first output delay and stay
+below the perceived latency.
+
+Usage:
+    python scripts/test-first-output-latency.py
+"""
+
+import asyncio
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+import time
+
+# Turns without tools (no DynamoDB) and a known reply delay; set before the
+# simulator module reads it
+SCENARIO = {
+    "first_output_delay": 0.4,
+    "turns": [{"transcript": "Hola", "text": "Hola, ¿en qué te ayudo?", "audio_ms": 600}],
+}
+scenario_file = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+json.dump(SCENARIO, scenario_file)
+scenario_file.close()
+os.environ["FAKE_NOVA_SONIC_SCENARIO"] = scenario_file.name
+
+# nova_sonic modules use flat imports, so add the package directory itself
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nova_sonic"))
+
+from bedrock_pool import BedrockClientPool
+from fake_nova_sonic import DEFAULT_SCENARIO
+from metrics import FIRST_OUTPUT_SECONDS
+from s2s_events import S2sEvent
+from s2s_session_manager import S2sSessionManager
+from voice_activity import vad_available
+
+CHUNK_MS = 32
+TURNS = 2
+# Allowed difference between the histogram and the latency seen here
+TOLERANCE = 0.1
+
+
+def pcm(ms, speech):
+    samples = 16 * ms
+    if not speech:
+        return bytes(2 * samples)
+    return struct.pack(f"<{samples}h", *(int(8000 * math.sin(2 * math.pi * 220 * i / 16000)) for i in range(samples)))
+
+
+def histogram_totals():
+    """(count, sum) of the first output histogram per output event"""
+    totals = {}
+    for output in ("textOutput", "audioOutput"):
+        child = FIRST_OUTPUT_SECONDS.labels(output)
+        totals[output] = (sum(child.counts), child.sum)
+    return totals
+
+
+async def run_turn(session):
+    """Speak, stream silence until the reply, return the perceived latencies"""
+    for _ in range(1000 // CHUNK_MS):
+        await session.add_audio_chunk("p", "a", pcm(CHUNK_MS, True))
+        await asyncio.sleep(CHUNK_MS / 1000)
+    speech_ended = time.monotonic()
+
+    latencies = {}
+    reply_over = False
+    while not reply_over:
+        await session.add_audio_chunk("p", "a", pcm(CHUNK_MS, False))
+        await asyncio.sleep(CHUNK_MS / 1000)
+        while not session.output_queue.empty():
+            event_name, payload = session.output_queue.get_nowait()
+            event = json.loads(payload)["event"][event_name] if isinstance(payload, bytes) else payload["event"][event_name]
+            if event_name in ("textOutput", "audioOutput") and event.get("role", "ASSISTANT") == "ASSISTANT":
+                latencies.setdefault(event_name, time.monotonic() - speech_ended)
+            elif event_name == "contentEnd" and event.get("type") == "AUDIO":
+                reply_over = True
+    return latencies
+
+
+async def run_session(pool, minimum, exact, **options):
+    """Run TURNS turns and check the histogram against them, True if all ok"""
+    session = S2sSessionManager(model_id="amazon.nova-sonic-v1:0", region="us-east-1", client_pool=pool, **options)
+    await session.initialize_stream()
+    for event in (S2sEvent.session_start(), S2sEvent.prompt_start("p"), S2sEvent.content_start_text("p", "sys"),
+                  S2sEvent.text_input("p", "sys"), S2sEvent.content_end("p", "sys"), S2sEvent.content_start_audio("p", "a")):
+        await session.send_raw_event(event)
+
+    ok_all = True
+    try:
+        for turn in range(1, TURNS + 1):
+            before = histogram_totals()
+            latencies = await run_turn(session)
+            after = histogram_totals()
+            for output, perceived in sorted(latencies.items()):
+                count = after[output][0] - before[output][0]
+                observed = after[output][1] - before[output][1]
+                matches = abs(observed - perceived) <= TOLERANCE if exact else observed <= perceived + TOLERANCE
+                ok = count == 1 and matches and observed >= minimum
+                ok_all &= ok
+                print(f"  {'✅' if ok else '❌'} turno {turn} {output}: percibido {perceived * 1000:.0f}ms, "
+                      f"histograma {observed * 1000:.0f}ms ({count} muestras, mínimo {minimum * 1000:.0f}ms)")
+            if set(latencies) != {"textOutput", "audioOutput"}:
+                print(f"  ❌ turno {turn}: faltan salidas del asistente ({', '.join(latencies) or 'ninguna'})")
+                ok_all = False
+    finally:
+        await session.close()
+    return ok_all
+
+
+async def main():
+    pool = BedrockClientPool("us-east-1", backend="fake")
+    failed = False
+    try:
+        print("🔇 Sin VAD local: desde la transcripción del usuario")
+        failed |= not await run_session(pool, SCENARIO["first_output_delay"] - TOLERANCE, exact=False)
+        if vad_available():
+            print("🎙️  Con VAD local: desde el fin del habla")
+            minimum = DEFAULT_SCENARIO["end_of_turn_silence"] + SCENARIO["first_output_delay"]
+            failed |= not await run_session(pool, minimum, exact=True, barge_in_vad=True)
+        else:
+            print("⚠️  Sin NumPy no se prueba el fin del habla detectado por el VAD")
+    finally:
+        os.unlink(scenario_file.name)
+
+    print("❌ La latencia medida no coincide" if failed else "✅ La latencia medida coincide con la percibida")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -10,6 +10,8 @@ import asyncio
 
 # Agregar el directorio padre al path para poder importar nova_sonic
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# nova_sonic modules import each other with flat imports
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nova_sonic'))
 
 from nova_sonic.tool_processor import NovaSonicToolProcessor
 
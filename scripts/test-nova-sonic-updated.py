@@ -10,6 +10,8 @@ import boto3
 
 # Add the parent directory to the Python path to find nova_sonic module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# nova_sonic modules import each other with flat imports
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nova_sonic'))
 
 from nova_sonic.tool_processor import NovaSonicToolProcessor
 
@@ -184,6 +186,20 @@ async def test_tools():
     
     return error_count == 0
 
+async def first_item(table, key_prefix):
+    """Primer item cuya PK empieza con key_prefix (salta el contador de IDs)"""
+    kwargs = {
+        "Limit": 10,
+        "FilterExpression": "begins_with(PK, :prefix)",
+        "ExpressionAttributeValues": {":prefix": key_prefix},
+    }
+    while True:
+        response = await table.scan(**kwargs)
+        items = response.get('Items', [])
+        if items or 'LastEvaluatedKey' not in response:
+            return items[0] if items else None
+        kwargs["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
 async def test_dynamodb_schema():
     """Test DynamoDB schema and data structure"""
     print("\n🔗 Probando esquema de DynamoDB...")
@@ -193,11 +209,9 @@ async def test_dynamodb_schema():
         
         # Test orders table structure
         print("   📦 Probando tabla de pedidos...")
-        response = processor.orders_table.scan(Limit=1)
-        items = response.get('Items', [])
+        item = await first_item(processor.orders_table, "ORDER#")
         
-        if items:
-            item = items[0]
+        if item:
             print(f"   ✅ Tabla de pedidos accesible")
             print(f"   📋 Campos encontrados: {list(item.keys())}")
             
@@ -214,11 +228,9 @@ async def test_dynamodb_schema():
         
         # Test appointments table structure
         print("   🏥 Probando tabla de citas...")
-        response = processor.appointments_table.scan(Limit=1)
-        items = response.get('Items', [])
+        item = await first_item(processor.appointments_table, "APPOINTMENT#")
         
-        if items:
-            item = items[0]
+        if item:
             print(f"   ✅ Tabla de citas accesible")
             print(f"   📋 Campos encontrados: {list(item.keys())}")
             
@@ -157,9 +157,21 @@ resource "aws_ecs_task_definition" "nova_sonic_task" {
         {
           name  = "AWS_DEFAULT_REGION"
           value = var.aws_region
+        },
+        {
+          name  = "WORKERS"
+          value = tostring(var.nova_sonic_workers)
+        },
+        {
+          name  = "DRAIN_TIMEOUT"
+          value = tostring(var.nova_sonic_drain_timeout)
         }
       ]
 
+      # SIGTERM starts the drain; ECS sends SIGKILL after stopTimeout, so
+      # leave time to end the remaining sessions and stop the workers
+      stopTimeout = var.nova_sonic_drain_timeout + 20
+
       logConfiguration = {
         logDriver = "awslogs"
         options = {
@@ -26,4 +26,21 @@ variable "lambda_memory_size" {
   description = "Lambda function memory size in MB"
   type        = number
   default     = 128
-} 
\ No newline at end of file
+}
+
+variable "nova_sonic_workers" {
+  description = "Number of Nova Sonic WebSocket worker processes per ECS task (sharing the port via SO_REUSEPORT)"
+  type        = number
+  default     = 1
+} 
+
+variable "nova_sonic_drain_timeout" {
+  description = "Seconds active calls get to finish when a Nova Sonic task is stopped (deploys, scale-in)"
+  type        = number
+  default     = 90
+
+  validation {
+    condition     = var.nova_sonic_drain_timeout >= 0 && var.nova_sonic_drain_timeout <= 100
+    error_message = "The drain timeout must leave room within the 120 second Fargate stopTimeout limit (0-100)."
+  }
+}